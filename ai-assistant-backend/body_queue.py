@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+# Failed attempts after which a message is given up on
+FAILED_MESSAGE_MAX_ATTEMPTS = int(os.getenv("FAILED_MESSAGE_MAX_ATTEMPTS", "5"))
+
+# Labels Gmail assigns to mail the user is likely to search for, and to bulk mail
+_IMPORTANT_LABELS = {'IMPORTANT': 2, 'STARRED': 2, 'CATEGORY_PERSONAL': 1, 'SENT': 1}
+_BULK_LABELS = {'CATEGORY_PROMOTIONS': -2, 'CATEGORY_SOCIAL': -2, 'CATEGORY_FORUMS': -1, 'CATEGORY_UPDATES': -1}
+
+
+def sender_importance(email: Dict[str, Any]) -> int:
+    """
+    Score how likely a message is to matter, from its labels and headers.
+
+    Gmail's importance/category labels do the heavy lifting; mailing-list
+    headers (List-Unsubscribe, Precedence: bulk) push newsletters down.
+    """
+    labels = email.get('labels') or []
+    score = sum(_IMPORTANT_LABELS.get(label, 0) + _BULK_LABELS.get(label, 0) for label in labels)
+    if email.get('bulk'):
+        score -= 2
+    return score
+
+
+class BodyFetchQueue:
+    """
+    Per-account queue of messages indexed from headers only, awaiting their body.
+
+    Entries are served most important sender first, then newest first, so
+    the background body pass reaches the mail people search before bulk mail.
+    Entries whose fetch fails stay queued and are dropped after
+    ``max_attempts`` failed attempts.
+    """
+
+    def __init__(self, path: Path, max_attempts: int = FAILED_MESSAGE_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_bodies (
+                    email_id TEXT PRIMARY KEY,
+                    importance INTEGER NOT NULL DEFAULT 0,
+                    date INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_pending_priority ON pending_bodies(importance DESC, date DESC)"
+            )
+
+    def add_many(self, items: Iterable[tuple]) -> None:
+        """Queue (email_id, importance, date_ms) entries; existing entries are kept."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO pending_bodies (email_id, importance, date) VALUES (?, ?, ?)",
+                list(items)
+            )
+
+    def next_batch(self, limit: int) -> List[str]:
+        """Highest-priority email ids still waiting for their body."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT email_id FROM pending_bodies ORDER BY importance DESC, date DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def remove_many(self, email_ids: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM pending_bodies WHERE email_id = ?", [(i,) for i in email_ids])
+
+    def record_failures(self, email_ids: Iterable[str]) -> List[str]:
+        """
+        Count a failed fetch for each queued entry.
+
+        Returns:
+            Ids that ran out of attempts and were dropped
+        """
+        email_ids = list(email_ids)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE pending_bodies SET attempts = attempts + 1 WHERE email_id = ?", [(i,) for i in email_ids]
+            )
+            exhausted = [
+                row[0] for row in self._conn.execute(
+                    "SELECT email_id FROM pending_bodies WHERE attempts >= ?", (self.max_attempts,)
+                )
+            ]
+            self._conn.executemany("DELETE FROM pending_bodies WHERE email_id = ?", [(i,) for i in exhausted])
+        return exhausted
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_bodies").fetchone()[0]
+
+
+class FailedMessageQueue:
+    """
+    Per-account set of messages that failed to index, retried by later sync passes.
+
+    Lets the history checkpoint move past a pass in which some messages
+    could not be fetched or parsed (429s, 5xx) without losing them. Each
+    failed attempt is counted and a message is dropped after ``max_attempts``.
+    """
+
+    def __init__(self, path: Path, max_attempts: int = FAILED_MESSAGE_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS failed_messages (
+                    email_id TEXT PRIMARY KEY,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+    def record_failures(self, email_ids: Iterable[str]) -> List[str]:
+        """
+        Count a failed attempt for each message.
+
+        Returns:
+            Ids that ran out of attempts and were dropped
+        """
+        email_ids = list(email_ids)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO failed_messages (email_id, attempts) VALUES (?, 1) "
+                "ON CONFLICT(email_id) DO UPDATE SET attempts = attempts + 1",
+                [(i,) for i in email_ids]
+            )
+            exhausted = [
+                row[0] for row in self._conn.execute(
+                    "SELECT email_id FROM failed_messages WHERE attempts >= ?", (self.max_attempts,)
+                )
+            ]
+            self._conn.executemany("DELETE FROM failed_messages WHERE email_id = ?", [(i,) for i in exhausted])
+        return exhausted
+
+    def pending(self) -> List[str]:
+        """Ids waiting for another attempt, fewest attempts first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT email_id FROM failed_messages ORDER BY attempts, email_id").fetchall()
+        return [row[0] for row in rows]
+
+    def remove_many(self, email_ids: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM failed_messages WHERE email_id = ?", [(i,) for i in email_ids])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM failed_messages").fetchone()[0]
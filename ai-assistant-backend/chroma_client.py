@@ -1,8 +1,7 @@
 import chromadb
 from chromadb.config import Settings
 import os
-from typing import List
-from ollama_client import get_embedding
+from typing import List, Optional
 from ollama_client import get_embedding
 
 
@@ -39,6 +38,50 @@ def add_to_chroma(doc_id: str, content: str, metadata: dict, embedding: List[flo
         print(f"Error adding to Chroma: {e}")
         raise
 
+def add_many_to_chroma(
+    doc_ids: List[str],
+    contents: List[str],
+    metadatas: List[dict],
+    embeddings: List[List[float]]
+):
+    """
+    Add several documents to the Chroma collection in one upsert.
+    
+    Args:
+        doc_ids: Unique identifiers for the documents
+        contents: Text content of each document
+        metadatas: Metadata dictionary for each document
+        embeddings: Vector embedding for each document
+    """
+    if not doc_ids:
+        return
+    try:
+        collection.upsert(
+            ids=doc_ids,
+            documents=contents,
+            embeddings=embeddings,
+            metadatas=metadatas
+        )
+    except Exception as e:
+        print(f"Error adding batch to Chroma: {e}")
+        raise
+
+def update_chroma_metadata(doc_ids: List[str], metadatas: List[dict]):
+    """
+    Update metadata fields of stored documents without re-embedding them.
+    
+    Args:
+        doc_ids: Identifiers of the documents to update
+        metadatas: Fields to set on each document; other fields are kept
+    """
+    if not doc_ids:
+        return
+    try:
+        collection.update(ids=doc_ids, metadatas=metadatas)
+    except Exception as e:
+        print(f"Error updating Chroma metadata: {e}")
+        raise
+
 def query_chroma(query_embedding: List[float], top_k: int = 5):
     results = collection.query(
         query_embeddings=[query_embedding],
@@ -48,6 +91,28 @@ def query_chroma(query_embedding: List[float], top_k: int = 5):
     return results
 
 
+def query_chroma_batch(query_embeddings: List[List[float]], top_k: int = 5, where: Optional[dict] = None):
+    """
+    Run several nearest-neighbour searches in a single Chroma query.
+
+    Args:
+        query_embeddings: One embedding per query
+        top_k: Number of results to return per query
+        where: Optional metadata filter applied to every query in the batch
+
+    Returns:
+        Chroma query results with one result list per query embedding
+    """
+    params = {
+        "query_embeddings": query_embeddings,
+        "n_results": top_k,
+        "include": ["documents", "distances", "metadatas"]
+    }
+    if where:
+        params["where"] = where
+    return collection.query(**params)
+
+
 def search_similar_documents(query_text: str, top_k: int = 5):
     try:
         print(f"\n🔎 Searching Chroma for: {query_text}")
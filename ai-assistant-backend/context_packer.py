@@ -0,0 +1,129 @@
+import os
+import re
+from typing import List, Optional, Tuple
+
+# Maximum number of tokens of retrieved context to place in an LLM prompt
+DEFAULT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+
+# Words, numbers and individual punctuation marks each count as one token.
+# Long words are split in chunks of 4 characters, which tracks BPE tokenizers
+# such as the llama3 one closely enough for budgeting purposes.
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+_WORD_PATTERN = re.compile(r"\w+")
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how",
+    "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "was",
+    "what", "when", "where", "which", "who", "why", "with", "do", "does",
+    "did", "i", "my", "me", "you", "your",
+}
+
+
+def count_tokens(text: str) -> int:
+    """Approximate the number of LLM tokens in a piece of text."""
+    if not text:
+        return 0
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences/paragraphs, dropping empty fragments."""
+    return [s.strip() for s in _SENTENCE_PATTERN.split(text) if s and s.strip()]
+
+
+def _query_terms(query: str) -> set:
+    return {w for w in _WORD_PATTERN.findall(query.lower()) if w not in _STOPWORDS}
+
+
+def _trim_to_budget(text: str, terms: set, budget: int) -> Tuple[str, int]:
+    """
+    Keep the sentences of a document that best match the query terms.
+
+    Sentences are ranked by how many query terms they contain (ties broken by
+    position, earlier first), added greedily while they fit in the budget and
+    then put back in their original order so the excerpt still reads naturally.
+    """
+    sentences = split_sentences(text)
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(terms & set(_WORD_PATTERN.findall(sentences[i].lower()))), i)
+    )
+
+    selected = []
+    used = 0
+    for i in ranked:
+        cost = count_tokens(sentences[i])
+        if used + cost > budget:
+            continue
+        selected.append(i)
+        used += cost
+
+    if not selected and ranked:
+        # A single sentence is larger than the budget: keep its leading words
+        words = []
+        for word in sentences[ranked[0]].split():
+            cost = count_tokens(word)
+            if used + cost > budget:
+                break
+            words.append(word)
+            used += cost
+        return " ".join(words), used
+
+    return " ".join(sentences[i] for i in sorted(selected)), used
+
+
+def pack_context(
+    documents: List[str],
+    distances: Optional[List[float]] = None,
+    query: str = "",
+    max_tokens: Optional[int] = None,
+    separator: str = "\n\n"
+) -> Tuple[str, int]:
+    """
+    Assemble retrieved documents into a prompt context that fits a token budget.
+
+    Args:
+        documents: Retrieved document texts
+        distances: Chroma distances for each document (lower is better). When
+            given, the closest documents are packed first.
+        query: The user's question, used to pick the most relevant sentences
+            from documents that do not fit in full
+        max_tokens: Token budget for the context (defaults to CONTEXT_TOKEN_BUDGET)
+        separator: String placed between packed documents
+
+    Returns:
+        Tuple of (context, token_count) where token_count is the number of
+        tokens packed into the context, separators included
+    """
+    budget = DEFAULT_CONTEXT_TOKEN_BUDGET if max_tokens is None else max_tokens
+    order = list(range(len(documents)))
+    if distances:
+        order.sort(key=lambda i: distances[i] if i < len(distances) and distances[i] is not None else float("inf"))
+
+    terms = _query_terms(query)
+    separator_cost = count_tokens(separator)
+    parts = []
+    used = 0
+
+    for i in order:
+        doc = (documents[i] or "").strip()
+        if not doc:
+            continue
+
+        remaining = budget - used - (separator_cost if parts else 0)
+        if remaining <= 0:
+            break
+
+        cost = count_tokens(doc)
+        if cost > remaining:
+            doc, cost = _trim_to_budget(doc, terms, remaining)
+            if not doc:
+                continue
+
+        if parts:
+            used += separator_cost
+        parts.append(doc)
+        used += cost
+
+    return separator.join(parts), used
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CACHE_DB_PATH = "./download_cache.db"
+
+# Larger downloads are aborted
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+
+# Concurrent downloads per host, and pooled connections overall
+DOWNLOAD_PER_HOST_LIMIT = int(os.getenv("DOWNLOAD_PER_HOST_LIMIT", "4"))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "20"))
+
+# Seconds to connect, and between bytes once connected
+DOWNLOAD_CONNECT_TIMEOUT = 10
+DOWNLOAD_READ_TIMEOUT = 60
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a download exceeds the size limit."""
+
+
+class Download:
+    """
+    A downloaded file, or a note that the URL's content has not changed.
+
+    ``path`` is a unique temporary file owned by the caller (remove it with
+    ``cleanup``); it is None when ``not_modified`` is set.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        path: Optional[str],
+        not_modified: bool = False,
+        content_type: str = "",
+        size: int = 0,
+        content_hash: Optional[str] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ):
+        self.url = url
+        self.path = path
+        self.not_modified = not_modified
+        self.content_type = content_type
+        self.size = size
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def cleanup(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class DownloadCache:
+    """
+    URL-keyed validators (ETag, Last-Modified) and content hashes of processed downloads.
+
+    Entries are only written once a download has been processed, so a
+    failed ingestion is retried with a full download instead of a 304.
+    """
+
+    def __init__(self, path: str = DOWNLOAD_CACHE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    size INTEGER,
+                    fetched_at REAL
+                )
+            """)
+
+    def get(self, url: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM downloads WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def put(self, download: Download) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?)",
+                (download.url, download.etag, download.last_modified,
+                 download.content_hash, download.size, time.time())
+            )
+
+
+class DownloadService:
+    """
+    Shared async downloader with pooled connections.
+
+    Downloads are limited per host, capped at ``max_bytes`` (checked against
+    Content-Length and while streaming) and written to unique temporary
+    files. URLs seen before are requested conditionally; a 304, or a body
+    whose hash matches the processed one, comes back as ``not_modified``
+    so the caller can skip parsing and embedding it again.
+    """
+
+    def __init__(
+        self,
+        cache: DownloadCache,
+        max_bytes: int = DOWNLOAD_MAX_BYTES,
+        per_host_limit: int = DOWNLOAD_PER_HOST_LIMIT,
+        max_connections: int = DOWNLOAD_MAX_CONNECTIONS
+    ):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.per_host_limit = per_host_limit
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=httpx.Timeout(DOWNLOAD_READ_TIMEOUT, connect=DOWNLOAD_CONNECT_TIMEOUT)
+            )
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    async def download(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        suffix: str = ""
+    ) -> Download:
+        """
+        Download a URL to a unique temporary file, unless it is unchanged.
+
+        Args:
+            url: The URL to fetch
+            headers: Extra request headers (e.g. Slack's Authorization)
+            suffix: Temporary file suffix, so parsers can tell the file type
+
+        Returns:
+            The download; call ``record`` once it has been processed
+
+        Raises:
+            DownloadTooLarge: If the body exceeds max_bytes
+            httpx.HTTPError: On network errors and error statuses
+        """
+        request_headers = dict(headers or {})
+        cached = self.cache.get(url)
+        if cached:
+            if cached["etag"]:
+                request_headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                request_headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with self._host_limit(url):
+            async with self._get_client().stream("GET", url, headers=request_headers) as response:
+                if response.status_code == 304:
+                    logger.info(f"Not modified since last download: {url}")
+                    return Download(url, None, not_modified=True, size=cached["size"] or 0,
+                                    content_hash=cached["content_hash"])
+                response.raise_for_status()
+
+                content_length = int(response.headers.get("Content-Length") or 0)
+                if content_length > self.max_bytes:
+                    raise DownloadTooLarge(f"{url} is {content_length} bytes (limit {self.max_bytes})")
+
+                fd, temp_path = tempfile.mkstemp(suffix=suffix)
+                digest = hashlib.sha256()
+                size = 0
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                            size += len(chunk)
+                            if size > self.max_bytes:
+                                raise DownloadTooLarge(f"{url} exceeds {self.max_bytes} bytes")
+                            digest.update(chunk)
+                            f.write(chunk)
+                except BaseException:
+                    os.unlink(temp_path)
+                    raise
+
+        download = Download(
+            url,
+            temp_path,
+            content_type=response.headers.get("Content-Type", ""),
+            size=size,
+            content_hash=digest.hexdigest(),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified")
+        )
+        if cached and cached["content_hash"] == download.content_hash:
+            # Server without validators, but the same bytes as last time
+            logger.info(f"Content unchanged since last download: {url}")
+            download.cleanup()
+            download.path = None
+            download.not_modified = True
+            self.cache.put(download)
+        return download
+
+    def record(self, download: Download) -> None:
+        """Remember a processed download's validators for conditional requests."""
+        self.cache.put(download)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Shared download service (Slack links and files)
+download_service = DownloadService(DownloadCache())
@@ -0,0 +1,536 @@
+import base64
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from chroma_client import add_many_to_chroma, update_chroma_metadata
+from email_utils import get_gmail_service, is_not_found
+from embedding import generate_embeddings
+from file_parser import SUPPORTED_EXTENSIONS, parse_and_chunk
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENTS_DB_PATH = "./email_attachments.db"
+
+# Index attachments of ingested emails
+INGEST_ATTACHMENTS = os.getenv("INGEST_ATTACHMENTS", "true").lower() in ("1", "true", "yes")
+
+# Larger attachments are skipped without being downloaded
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Processes parsing attachments (PDF text extraction is CPU bound)
+ATTACHMENT_PARSE_WORKERS = int(os.getenv("ATTACHMENT_PARSE_WORKERS", "2"))
+
+# Attachments queued in memory; beyond this they wait in the store as pending
+ATTACHMENT_QUEUE_SIZE = 1000
+
+# Seconds the worker waits on running parses before checking for new attachments
+ATTACHMENT_POLL_INTERVAL = 1.0
+
+# Attempts before an attachment that keeps failing is marked failed
+ATTACHMENT_MAX_ATTEMPTS = int(os.getenv("ATTACHMENT_MAX_ATTEMPTS", "5"))
+
+# Retry backoff: ATTACHMENT_RETRY_BASE * 2^(attempt - 1) seconds, capped
+ATTACHMENT_RETRY_BASE = 60
+ATTACHMENT_RETRY_MAX = 3600
+
+
+class AttachmentStore:
+    """
+    SQLite record of attachments seen on ingested emails.
+
+    ``attachments`` holds one row per distinct content hash (parsed and
+    embedded once), ``email_attachments`` links every (account, email, part)
+    to its content hash and tracks whether it is still pending, so queued
+    attachments survive a restart. Pending attachments that failed carry
+    their attempt count and the time of their next attempt.
+    """
+
+    def __init__(self, path: str = ATTACHMENTS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS attachments (
+                    content_hash TEXT PRIMARY KEY,
+                    filename TEXT,
+                    mime_type TEXT,
+                    size INTEGER,
+                    chunk_count INTEGER,
+                    email_id TEXT,
+                    created_at REAL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS email_attachments (
+                    account TEXT NOT NULL,
+                    email_id TEXT NOT NULL,
+                    part_id TEXT NOT NULL,
+                    attachment_id TEXT,
+                    filename TEXT,
+                    mime_type TEXT,
+                    size INTEGER,
+                    content_hash TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (account, email_id, part_id)
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_email_attachments_status ON email_attachments(status)"
+            )
+
+    def add_pending(self, account: str, email_id: str, attachment: Dict[str, Any]) -> bool:
+        """Record an attachment to process; returns False if it is already known."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO email_attachments "
+                "(account, email_id, part_id, attachment_id, filename, mime_type, size, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'pending')",
+                (account, email_id, attachment['part_id'], attachment.get('attachment_id'),
+                 attachment['filename'], attachment.get('mime_type', ''), attachment.get('size', 0))
+            )
+            return cursor.rowcount > 0
+
+    def pending(self, limit: Optional[int] = None, due_by: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Attachments recorded but not processed yet.
+
+        Args:
+            limit: Maximum number of rows (all if None)
+            due_by: Only attachments whose next attempt is due by this time
+        """
+        sql = "SELECT * FROM email_attachments WHERE status = 'pending'"
+        params: List[Any] = []
+        if due_by is not None:
+            sql += " AND next_attempt_at <= ?"
+            params.append(due_by)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def next_attempt_at(self, after: float) -> Optional[float]:
+        """Earliest scheduled retry of a pending attachment later than ``after``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM email_attachments WHERE status = 'pending' AND next_attempt_at > ?",
+                (after,)
+            ).fetchone()
+        return row[0]
+
+    def record_failure(self, account: str, email_id: str, part_id: str, error: str,
+                       max_attempts: int = ATTACHMENT_MAX_ATTEMPTS) -> bool:
+        """
+        Record a failed attempt, scheduling a retry with exponential backoff.
+
+        Returns:
+            True if a retry was scheduled, False if the attachment ran out of
+            attempts and was marked failed
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT attempts FROM email_attachments WHERE account = ? AND email_id = ? AND part_id = ?",
+                (account, email_id, part_id)
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            retry = attempts < max_attempts
+            delay = min(ATTACHMENT_RETRY_BASE * 2 ** (attempts - 1), ATTACHMENT_RETRY_MAX)
+            self._conn.execute(
+                "UPDATE email_attachments SET status = ?, attempts = ?, next_attempt_at = ?, error = ? "
+                "WHERE account = ? AND email_id = ? AND part_id = ?",
+                ('pending' if retry else 'failed', attempts, now + delay, error, account, email_id, part_id)
+            )
+        return retry
+
+    def count_pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM email_attachments WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def mark(self, account: str, email_id: str, part_id: str, status: str,
+             content_hash: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE email_attachments SET status = ?, content_hash = ?, error = ? "
+                "WHERE account = ? AND email_id = ? AND part_id = ?",
+                (status, content_hash, error, account, email_id, part_id)
+            )
+
+    def has_content(self, content_hash: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM attachments WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row is not None
+
+    def add_content(self, content_hash: str, filename: str, mime_type: str,
+                    size: int, chunk_count: int, email_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO attachments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, filename, mime_type, size, chunk_count, email_id, time.time())
+            )
+
+    def chunk_count(self, content_hash: str) -> int:
+        """Number of chunks embedded for this content (0 if unknown or no text)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunk_count FROM attachments WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def emails_for(self, content_hash: str) -> List[str]:
+        """Ids of every email carrying an attachment with this content."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT email_id FROM email_attachments WHERE content_hash = ?", (content_hash,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class AttachmentIngestor:
+    """
+    Background indexer for email attachments.
+
+    Ingestion only records attachment descriptors; a worker thread then
+    downloads each supported attachment (skipping oversized ones without
+    downloading), hashes it, and parses, chunks and embeds content it has not
+    seen before. Parsing runs in a process pool with up to twice as many files
+    in flight as there are workers, so the worker keeps downloading and
+    embedding while files are parsed. Identical files attached to several
+    emails are embedded once and linked to every parent email; the chunks'
+    ``email_ids`` metadata lists all of them. Failed attachments are retried
+    with exponential backoff up to ATTACHMENT_MAX_ATTEMPTS times, except
+    ones deleted from the mailbox (404).
+
+    Every attachment is recorded as pending before it is queued. When the
+    in-memory queue is full, or after a restart, the worker reads pending
+    rows from the store once the queue runs dry instead of blocking callers.
+    """
+
+    def __init__(self, store: AttachmentStore, parse_workers: int = ATTACHMENT_PARSE_WORKERS):
+        self.store = store
+        self.parse_workers = parse_workers
+        self._max_in_flight = max(parse_workers, 1) * 2
+        self._queue: "queue.Queue" = queue.Queue(maxsize=ATTACHMENT_QUEUE_SIZE)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # (account, email_id, part_id) of attachments queued or being processed
+        self._active: Set[Tuple[str, str, str]] = set()
+        self._active_lock = threading.Lock()
+        # Whether the store may hold pending attachments that are not queued,
+        # and when the next one is due if none is due now (None: check now)
+        self._backlog = False
+        self._retry_at: Optional[float] = None
+        self._backlog_rows: Deque[Dict[str, Any]] = deque()
+        # Content hashes being parsed, with the attachments waiting on them
+        self._parsing: Dict[str, List[Tuple[str, str, Dict[str, Any]]]] = {}
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="attachment-ingestor", daemon=True)
+            self._thread.start()
+
+    def submit(self, account: str, email: Dict[str, Any]) -> int:
+        """
+        Queue the supported attachments of a parsed email.
+
+        Returns:
+            Number of attachments queued
+        """
+        queued = 0
+        for attachment in email.get('attachments') or []:
+            if not attachment['filename'].lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            if attachment.get('size', 0) > ATTACHMENT_MAX_BYTES:
+                logger.info(f"[{account}] Skipping large attachment {attachment['filename']} on {email['id']}")
+                continue
+            if self.store.add_pending(account, email['id'], attachment):
+                self._ensure_started()
+                self._enqueue(account, email['id'], attachment)
+                queued += 1
+        return queued
+
+    def resume_pending(self) -> int:
+        """
+        Resume attachments left pending by a previous run.
+
+        Pending rows stay in the store and are read by the worker as the
+        queue drains, so this returns immediately however many there are.
+
+        Returns:
+            Number of pending attachments
+        """
+        pending = self.store.count_pending()
+        if pending:
+            self._backlog = True
+            self._retry_at = None
+            self._ensure_started()
+            self._wake()
+        return pending
+
+    def _enqueue(self, account: str, email_id: str, attachment: Dict[str, Any]) -> None:
+        key = (account, email_id, attachment['part_id'])
+        with self._active_lock:
+            self._active.add(key)
+        try:
+            self._queue.put_nowait((account, email_id, attachment))
+        except queue.Full:
+            # Already recorded as pending; the worker reads it from the store later
+            with self._active_lock:
+                self._active.discard(key)
+            self._backlog = True
+            self._retry_at = None
+
+    def _wake(self) -> None:
+        """Unblock a worker waiting on an empty queue."""
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _release(self, account: str, email_id: str, attachment: Dict[str, Any]) -> None:
+        with self._active_lock:
+            self._active.discard((account, email_id, attachment['part_id']))
+
+    def _next_pending(self) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """Next pending attachment from the store that is not queued or being processed."""
+        if not self._backlog_rows:
+            with self._active_lock:
+                active = set(self._active)
+            # Over-fetch by the active count so a page of active rows cannot hide the rest
+            now = time.time()
+            rows = self.store.pending(limit=ATTACHMENT_QUEUE_SIZE + len(active), due_by=now)
+            rows = [row for row in rows if (row['account'], row['email_id'], row['part_id']) not in active]
+            if not rows:
+                # Only retries scheduled for later are left, if any
+                self._retry_at = self.store.next_attempt_at(now)
+                self._backlog = self._retry_at is not None
+                return None
+            self._backlog_rows.extend(rows)
+        row = self._backlog_rows.popleft()
+        with self._active_lock:
+            self._active.add((row['account'], row['email_id'], row['part_id']))
+        return row['account'], row['email_id'], {
+            'part_id': row['part_id'],
+            'attachment_id': row['attachment_id'],
+            'filename': row['filename'],
+            'mime_type': row['mime_type'],
+            'size': row['size'],
+            'data': None,
+        }
+
+    def _next(self, block: bool) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """Next attachment to process: queued ones first, then the store backlog."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                if self._backlog and (self._retry_at is None or self._retry_at <= time.time()):
+                    item = self._next_pending()
+                    if item is not None:
+                        return item
+                if not block:
+                    return None
+                # Wake up for the next scheduled retry if there is one
+                timeout = max(self._retry_at - time.time(), 0) if self._backlog and self._retry_at else None
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+            if item is not None:
+                return item
+
+    def _run(self) -> None:
+        in_flight: Dict[Future, Tuple] = {}
+        while True:
+            if in_flight:
+                room = len(in_flight) < self._max_in_flight
+                done, _ = wait(in_flight, timeout=0 if room else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._finish(future, *in_flight.pop(future))
+                if len(in_flight) >= self._max_in_flight:
+                    continue
+
+            item = self._next(block=not in_flight)
+            if item is None:
+                # Nothing new to start: wait for a parse, then look again
+                wait(in_flight, timeout=ATTACHMENT_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                continue
+
+            account, email_id, attachment = item
+            try:
+                started = self._start(account, email_id, attachment)
+            except Exception as e:
+                self._fail(account, email_id, attachment, e)
+                continue
+            if started is not None:
+                in_flight[started[0]] = started[1:]
+
+    def _fail(self, account: str, email_id: str, attachment: Dict[str, Any], error: Exception) -> None:
+        """Schedule a retry of a failed attachment, or mark it failed if it is gone or out of attempts."""
+        if is_not_found(error):
+            retry = False
+            self.store.mark(account, email_id, attachment['part_id'], 'failed', error=str(error))
+        else:
+            retry = self.store.record_failure(account, email_id, attachment['part_id'], str(error))
+        if retry:
+            logger.warning(f"[{account}] Failed to ingest attachment {attachment['filename']} on {email_id}, "
+                           f"will retry: {error}")
+            self._backlog = True
+            self._retry_at = None
+        else:
+            logger.error(f"[{account}] Failed to ingest attachment {attachment['filename']} on {email_id}: {error}")
+        self._release(account, email_id, attachment)
+
+    def _download(self, account: str, email_id: str, attachment: Dict[str, Any]) -> bytes:
+        data = attachment.get('data')
+        if not data:
+            # Cached per thread by the client cache, which also refreshes and invalidates credentials
+            service = get_gmail_service(account)
+            if service is None:
+                raise RuntimeError(f"No Gmail credentials for {account}")
+            response = service.users().messages().attachments().get(
+                userId='me', messageId=email_id, id=attachment['attachment_id']
+            ).execute()
+            data = response.get('data', '')
+        return base64.urlsafe_b64decode(data)
+
+    def _parse(self, content: bytes, filename: str) -> Tuple[Future, str]:
+        """Start parsing a file in the process pool; returns the future and its temp file."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        suffix = Path(filename).suffix.lower()
+        fd, temp_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            return self._pool.submit(parse_and_chunk, temp_path), temp_path
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def _start(self, account: str, email_id: str, attachment: Dict[str, Any]) -> Optional[Tuple]:
+        """
+        Download and hash an attachment and start parsing it if its content is new.
+
+        Returns:
+            (future, account, email_id, attachment, content_hash, size, temp_path)
+            if a parse was started, None if the attachment was settled here
+        """
+        content = self._download(account, email_id, attachment)
+        if len(content) > ATTACHMENT_MAX_BYTES:
+            self.store.mark(account, email_id, attachment['part_id'], 'skipped', error="too large")
+            self._release(account, email_id, attachment)
+            return None
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        if self.store.has_content(content_hash):
+            # Already embedded from another email: only link it
+            self.store.mark(account, email_id, attachment['part_id'], 'linked', content_hash=content_hash)
+            self._release(account, email_id, attachment)
+            self._update_parents(content_hash)
+            logger.debug(f"[{account}] Attachment {attachment['filename']} on {email_id} is a duplicate")
+            return None
+        if content_hash in self._parsing:
+            # Same content is being parsed for another email: link it once that is stored
+            self._parsing[content_hash].append((account, email_id, attachment))
+            return None
+
+        future, temp_path = self._parse(content, attachment['filename'])
+        self._parsing[content_hash] = []
+        return future, account, email_id, attachment, content_hash, len(content), temp_path
+
+    def _finish(self, future: Future, account: str, email_id: str, attachment: Dict[str, Any],
+                content_hash: str, size: int, temp_path: str) -> None:
+        """Embed and store a parsed attachment, then link the duplicates that waited on it."""
+        os.unlink(temp_path)
+        waiting = self._parsing.pop(content_hash, [])
+        try:
+            self._store(future.result(), account, email_id, attachment, content_hash, size)
+        except Exception as e:
+            for item in [(account, email_id, attachment)] + waiting:
+                self._fail(*item, e)
+            return
+        for waiting_account, waiting_email_id, waiting_attachment in waiting:
+            self.store.mark(waiting_account, waiting_email_id, waiting_attachment['part_id'], 'linked',
+                            content_hash=content_hash)
+            self._release(waiting_account, waiting_email_id, waiting_attachment)
+        if waiting:
+            self._update_parents(content_hash)
+
+    @staticmethod
+    def _chunk_ids(content_hash: str, chunk_count: int) -> List[str]:
+        return [f"attachment_{content_hash[:32]}_{i}" for i in range(chunk_count)]
+
+    def _update_parents(self, content_hash: str) -> None:
+        """List every email carrying this content on its chunks, so search results lead to all of them."""
+        chunk_count = self.store.chunk_count(content_hash)
+        if not chunk_count:
+            return
+        email_ids = ",".join(self.store.emails_for(content_hash))
+        try:
+            update_chroma_metadata(
+                self._chunk_ids(content_hash, chunk_count), [{'email_ids': email_ids}] * chunk_count
+            )
+        except Exception as e:
+            # The link is recorded in the store; only the chunk metadata is stale
+            logger.error(f"Failed to update the parent emails of attachment {content_hash[:12]}: {e}")
+
+    def _store(self, chunks: List[str], account: str, email_id: str, attachment: Dict[str, Any],
+               content_hash: str, size: int) -> None:
+        if chunks:
+            embeddings = generate_embeddings(chunks)
+            doc_ids = self._chunk_ids(content_hash, len(chunks))
+            metadatas = [
+                {
+                    'source': 'gmail_attachment',
+                    'type': 'attachment',
+                    'email_id': email_id,
+                    'parent_id': f"email_{email_id}",
+                    # Comma-separated ids of every email carrying this file
+                    'email_ids': email_id,
+                    'email_account': account,
+                    'filename': attachment['filename'],
+                    'mime_type': attachment.get('mime_type', ''),
+                    'content_hash': content_hash,
+                    'chunk_index': i,
+                    'chunk_count': len(chunks),
+                }
+                for i in range(len(chunks))
+            ]
+            add_many_to_chroma(doc_ids, chunks, metadatas, embeddings)
+
+        self.store.add_content(
+            content_hash, attachment['filename'], attachment.get('mime_type', ''),
+            size, len(chunks), email_id
+        )
+        self.store.mark(account, email_id, attachment['part_id'], 'done', content_hash=content_hash)
+        self._release(account, email_id, attachment)
+        logger.info(f"[{account}] Indexed attachment {attachment['filename']} ({len(chunks)} chunks) on {email_id}")
+
+
+# Shared ingestor used by every account's ingestion service
+attachment_ingestor = AttachmentIngestor(AttachmentStore())
@@ -0,0 +1,244 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from email_ingestion import EmailIngestionService, PROCESSED_EMAILS_DIR
+from email_utils import get_gmail_service
+from ingestion_pipeline import email_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Messages listed per messages.list page (Gmail allows up to 500)
+BACKFILL_PAGE_SIZE = 100
+
+# Listed pages allowed in the pipeline ahead of the checkpoint
+BACKFILL_MAX_IN_FLIGHT = 4
+
+# Times a page's failed messages are resubmitted before they are left to the
+# account's failed-message queue, and the base delay between attempts (seconds)
+BACKFILL_PAGE_RETRIES = 3
+BACKFILL_RETRY_DELAY = 5
+
+
+def backfill_checkpoint_file(email: str) -> Path:
+    """Path of an account's backfill checkpoint."""
+    safe_email = email.replace('@', '_').replace('.', '_')
+    return PROCESSED_EMAILS_DIR / f"{safe_email}_backfill.json"
+
+
+def checkpoint_progress(email: str) -> Optional[Dict[str, Any]]:
+    """
+    Progress of a backfill not running in this process, from its persisted checkpoint.
+
+    Returns:
+        The checkpoint in the shape of MailboxBackfill.progress, or None if
+        the account never started a backfill
+    """
+    checkpoint_file = backfill_checkpoint_file(email)
+    if not checkpoint_file.exists():
+        return None
+    try:
+        with open(checkpoint_file, 'r') as f:
+            state = json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading backfill checkpoint for {email}: {e}")
+        return None
+    return {**state, 'messages_per_second': None, 'eta_seconds': None, 'pipeline': None}
+
+
+class MailboxBackfill:
+    """
+    Index an account's existing mailbox, page by page, with a persisted checkpoint.
+
+    Pages of ``messages.list`` are submitted to the shared EmailPipeline that
+    batch-fetches, parses, embeds and bulk-upserts them. The checkpoint (the
+    page token after the last fully processed page) only advances over pages
+    that completed in order, so a restarted backfill resumes without gaps.
+    A page whose messages failed to fetch is resubmitted before the
+    checkpoint moves past it.
+    """
+
+    def __init__(
+        self,
+        ingestion: EmailIngestionService,
+        page_size: int = BACKFILL_PAGE_SIZE,
+        max_in_flight: int = BACKFILL_MAX_IN_FLIGHT
+    ):
+        """
+        Args:
+            ingestion: The account's ingestion service; its processed-email set
+                is shared so live sync and backfill never index a message twice
+            page_size: Messages per messages.list page
+            max_in_flight: Listed pages in the pipeline at once
+        """
+        self.ingestion = ingestion
+        self.email = ingestion.email
+        self.page_size = page_size
+        self.max_in_flight = max_in_flight
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._run_started: Optional[float] = None
+        self._run_seen = 0
+        self.state = self._load_checkpoint()
+
+    def _get_checkpoint_file(self) -> Path:
+        """Get the path to the backfill checkpoint for this account."""
+        return backfill_checkpoint_file(self.email)
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        state = {
+            'email': self.email,
+            'status': 'pending',
+            'page_token': None,
+            'pages_done': 0,
+            'messages_seen': 0,
+            'processed': 0,
+            'total_estimate': None,
+            'error': None,
+            'updated_at': None
+        }
+        checkpoint_file = self._get_checkpoint_file()
+        if checkpoint_file.exists():
+            try:
+                with open(checkpoint_file, 'r') as f:
+                    state.update(json.load(f))
+            except Exception as e:
+                logger.error(f"Error loading backfill checkpoint for {self.email}: {e}")
+        return state
+
+    def _save_checkpoint(self) -> None:
+        with self._lock:
+            self.state['updated_at'] = datetime.utcnow().isoformat()
+            state = dict(self.state)
+        try:
+            with open(self._get_checkpoint_file(), 'w') as f:
+                json.dump(state, f, indent=2)
+        except Exception as e:
+            logger.error(f"Error saving backfill checkpoint for {self.email}: {e}")
+
+    def progress(self) -> Dict[str, Any]:
+        """Current progress, throughput and estimated time remaining."""
+        with self._lock:
+            progress = dict(self.state)
+        rate = None
+        eta_seconds = None
+        if self._run_started and self._run_seen:
+            rate = self._run_seen / max(time.monotonic() - self._run_started, 1e-6)
+            total = progress.get('total_estimate')
+            if total and progress['status'] == 'running':
+                eta_seconds = max(total - progress['messages_seen'], 0) / rate
+        progress['messages_per_second'] = round(rate, 2) if rate else None
+        progress['eta_seconds'] = round(eta_seconds) if eta_seconds is not None else None
+        progress['pipeline'] = email_pipeline.metrics() if self._run_started else None
+        return progress
+
+    def stop(self) -> None:
+        """Stop after the pages in flight finish; the checkpoint is kept for resuming."""
+        self._stop_event.set()
+
+    def is_running(self) -> bool:
+        return self.state['status'] == 'running'
+
+    def run(self) -> None:
+        """Run (or resume) the backfill until the mailbox is exhausted or stopped."""
+        if self.state['status'] == 'completed':
+            logger.info(f"[{self.email}] Backfill already completed")
+            return
+
+        self._stop_event.clear()
+        self._run_started = time.monotonic()
+        self._run_seen = 0
+        with self._lock:
+            self.state['status'] = 'running'
+            self.state['error'] = None
+
+        try:
+            service = get_gmail_service(self.email)
+            profile = service.users().getProfile(userId='me').execute()
+            with self._lock:
+                self.state['total_estimate'] = profile.get('messagesTotal')
+            self._save_checkpoint()
+
+            page_token = self.state['page_token']
+            exhausted = False
+            in_flight = deque()
+
+            while not self._stop_event.is_set():
+                # Keep up to max_in_flight pages in the pipeline
+                while not exhausted and len(in_flight) < self.max_in_flight and not self._stop_event.is_set():
+                    response = service.users().messages().list(
+                        userId='me',
+                        maxResults=self.page_size,
+                        pageToken=page_token
+                    ).execute()
+                    message_ids = [msg['id'] for msg in response.get('messages', [])]
+                    page_token = response.get('nextPageToken')
+                    future = email_pipeline.submit(self.ingestion, message_ids)
+                    in_flight.append((future, page_token, len(message_ids), 1, 0))
+                    if not page_token:
+                        exhausted = True
+
+                if not in_flight:
+                    break
+
+                # Advance the checkpoint over the oldest page once it is done
+                future, next_page_token, listed, attempt, processed_count = in_flight.popleft()
+                result = future.result()
+                processed_count += result.written
+                if result.failed:
+                    if self._stop_event.is_set():
+                        # Keep the checkpoint before this page; resuming retries it
+                        in_flight.appendleft((future, next_page_token, listed, attempt, processed_count))
+                        break
+                    if attempt < BACKFILL_PAGE_RETRIES:
+                        logger.warning(
+                            f"[{self.email}] {len(result.failed)} messages of a backfill page failed, "
+                            f"retrying (attempt {attempt + 1}/{BACKFILL_PAGE_RETRIES})"
+                        )
+                        self._stop_event.wait(BACKFILL_RETRY_DELAY * attempt)
+                        retry = email_pipeline.submit(self.ingestion, result.failed)
+                        in_flight.appendleft((retry, next_page_token, listed, attempt + 1, processed_count))
+                        continue
+                    # Still failing: leave them to the sync passes' retries and move on
+                    logger.error(f"[{self.email}] {len(result.failed)} backfill messages still failing")
+                    self.ingestion.record_failed(result.failed)
+                self._run_seen += listed
+                with self._lock:
+                    self.state['page_token'] = next_page_token
+                    self.state['pages_done'] += 1
+                    self.state['messages_seen'] += listed
+                    self.state['processed'] += processed_count
+                self.ingestion.save_processed_emails()
+                self._save_checkpoint()
+                logger.info(f"[{self.email}] Backfill progress: {self.progress()}")
+
+            with self._lock:
+                self.state['status'] = 'completed' if exhausted and not in_flight else 'stopped'
+            logger.info(f"[{self.email}] Backfill {self.state['status']}: {self.state['processed']} emails indexed")
+
+        except Exception as e:
+            logger.error(f"[{self.email}] Backfill failed: {e}")
+            with self._lock:
+                self.state['status'] = 'failed'
+                self.state['error'] = str(e)
+        finally:
+            self._save_checkpoint()
+
+
+def find_interrupted_backfills() -> List[str]:
+    """Accounts whose backfill was still running when the process stopped."""
+    accounts = []
+    for checkpoint_file in PROCESSED_EMAILS_DIR.glob("*_backfill.json"):
+        try:
+            with open(checkpoint_file, 'r') as f:
+                state = json.load(f)
+            if state.get('status') == 'running' and state.get('email'):
+                accounts.append(state['email'])
+        except Exception as e:
+            logger.error(f"Error reading backfill checkpoint {checkpoint_file}: {e}")
+    return accounts
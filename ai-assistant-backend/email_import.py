@@ -0,0 +1,367 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email import message_from_bytes, policy
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from chroma_client import add_many_to_chroma
+from email_index import email_index
+from email_ingestion import PROCESSED_EMAILS_DIR, build_email_document
+from email_mime import message_body
+from email_normalize import normalize_email
+from embedding import generate_embeddings
+from near_duplicates import near_duplicate_index
+from processed_store import ProcessedIdStore
+
+logger = logging.getLogger(__name__)
+
+# Root directory the import API may read archives from; the CLI is not restricted
+IMPORT_DIR = Path(os.getenv("IMPORT_DIR", "./imports"))
+
+# Processes parsing messages (MIME decoding and HTML to text are CPU bound)
+IMPORT_PARSE_WORKERS = int(os.getenv("IMPORT_PARSE_WORKERS", str(os.cpu_count() or 2)))
+
+# Parsed messages embedded and upserted together
+IMPORT_EMBED_BATCH_SIZE = int(os.getenv("IMPORT_EMBED_BATCH_SIZE", "64"))
+
+# Messages sent to a worker process per task
+IMPORT_PARSE_CHUNK = 32
+
+# Seconds between progress log lines
+IMPORT_LOG_INTERVAL = 10
+
+# mboxrd escapes body lines starting with "From " as ">From ", ">>From ", ...
+_MBOX_ESCAPED_FROM = re.compile(rb'^>(>*From )')
+
+
+def resolve_import_path(path: str, root: Path = IMPORT_DIR) -> Path:
+    """
+    Resolve an import path requested over the API, relative to ``root``.
+
+    Raises:
+        PermissionError: If the path (after resolving symlinks and "..") is
+            outside ``root``
+    """
+    root = root.resolve()
+    resolved = (root / path).resolve()
+    if resolved != root and root not in resolved.parents:
+        raise PermissionError(f"Import path must be inside {root}: {path}")
+    return resolved
+
+
+def iter_mbox(path: Path) -> Iterator[bytes]:
+    """Yield the raw messages of an mbox file one at a time, without reading the whole file."""
+    lines: List[bytes] = []
+    previous_blank = True
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'From ') and previous_blank:
+                # Envelope line: starts the next message and is not part of it
+                if lines:
+                    yield b''.join(lines)
+                lines = []
+                previous_blank = False
+                continue
+            lines.append(_MBOX_ESCAPED_FROM.sub(rb'\1', line))
+            previous_blank = not line.strip()
+    if lines:
+        yield b''.join(lines)
+
+
+def iter_eml_directory(path: Path) -> Iterator[bytes]:
+    """Yield every .eml file under a directory, in path order."""
+    for eml_path in sorted(path.rglob('*.eml')):
+        yield eml_path.read_bytes()
+
+
+def iter_eml_zip(path: Path) -> Iterator[bytes]:
+    """Yield every .eml member of a zip archive, decompressing one at a time."""
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith('.eml'):
+                yield archive.read(info)
+
+
+def open_archive(path: Path) -> Tuple[Iterator[bytes], int]:
+    """
+    Stream the raw messages of an mbox file, a directory of .eml files or a zip of them.
+
+    Returns:
+        Tuple of (message iterator, total size in bytes for progress)
+    """
+    if path.is_dir():
+        return iter_eml_directory(path), sum(p.stat().st_size for p in path.rglob('*.eml'))
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            total = sum(i.file_size for i in archive.infolist() if i.filename.lower().endswith('.eml'))
+        return iter_eml_zip(path), total
+    return iter_mbox(path), path.stat().st_size
+
+
+def _header(message, name: str) -> str:
+    try:
+        return str(message[name] or '')
+    except Exception:
+        # Malformed headers raise when the default policy decodes them
+        return ''
+
+
+def parse_raw_email(raw: bytes) -> Dict[str, Any]:
+    """
+    Parse a raw RFC 5322 message into the email dict shape of email_utils.parse_email.
+
+    The id is derived from the Message-ID header (or the raw bytes when it is
+    missing), so importing the same archive twice does not duplicate mail.
+    """
+    message = message_from_bytes(raw, policy=policy.default)
+    key = _header(message, 'Message-ID').strip() or hashlib.sha256(raw).hexdigest()
+    email = {
+        'id': 'import_' + hashlib.sha1(key.encode('utf-8', errors='replace')).hexdigest()[:24],
+        'thread_id': None,
+        'from': _header(message, 'From'),
+        'to': _header(message, 'To'),
+        'subject': _header(message, 'Subject'),
+        'date': _header(message, 'Date'),
+        'snippet': '',
+        'labels': [],
+        'bulk': bool(_header(message, 'List-Unsubscribe'))
+            or _header(message, 'Precedence').lower() in ('bulk', 'list', 'junk'),
+        'body': message_body(message)
+    }
+    email.update(normalize_email(email['from'], email['subject'], email['body']))
+    return email
+
+
+def _parse_batch(raws: List[bytes]) -> List[Optional[Dict[str, Any]]]:
+    """Parse a chunk of messages in a worker process; unparseable ones come back as None."""
+    emails = []
+    for raw in raws:
+        try:
+            emails.append(parse_raw_email(raw))
+        except Exception as e:
+            logger.error(f"Failed to parse imported message: {e}")
+            emails.append(None)
+    return emails
+
+
+class MailImport:
+    """
+    Import an mbox file, a directory of .eml files or a zip of them into an account.
+
+    Messages are streamed from disk and parsed in a process pool, a bounded
+    number of chunks ahead; parsed messages are embedded in batches and
+    bulk-upserted while the workers keep parsing. No Gmail API calls are
+    made. Imported ids are kept in a per-account store, so re-running an
+    import (e.g. after stopping it) only embeds what is missing.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        account: str,
+        parse_workers: int = IMPORT_PARSE_WORKERS,
+        embed_batch_size: int = IMPORT_EMBED_BATCH_SIZE
+    ):
+        """
+        Args:
+            path: The mbox file, directory or zip archive to import
+            account: Email address the imported mail is listed under
+            parse_workers: Processes parsing messages
+            embed_batch_size: Messages embedded and upserted together
+        """
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"No such file or directory: {path}")
+        self.account = account
+        self.parse_workers = max(1, parse_workers)
+        self.embed_batch_size = embed_batch_size
+        self.id = hashlib.sha1(f"{account}:{self.path.resolve()}".encode('utf-8')).hexdigest()[:12]
+        safe_email = account.replace('@', '_').replace('.', '_')
+        self._imported = ProcessedIdStore(PROCESSED_EMAILS_DIR / f"{safe_email}_imported.db")
+        self._documents: List[Tuple[str, str, Dict[str, Any], str]] = []
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._started: Optional[float] = None
+        self._last_log = 0.0
+        self.state = {
+            'id': self.id,
+            'path': str(self.path),
+            'account': account,
+            'status': 'pending',
+            'total_bytes': None,
+            'bytes_read': 0,
+            'messages_seen': 0,
+            'imported': 0,
+            'skipped': 0,
+            'duplicates': 0,
+            'failed': 0,
+            'error': None,
+            'started_at': None,
+            'finished_at': None
+        }
+
+    def progress(self) -> Dict[str, Any]:
+        """Current counts, throughput and estimated time remaining."""
+        with self._lock:
+            progress = dict(self.state)
+        rate = None
+        eta_seconds = None
+        if self._started and progress['messages_seen']:
+            elapsed = max(time.monotonic() - self._started, 1e-6)
+            rate = progress['messages_seen'] / elapsed
+            if progress['total_bytes'] and progress['status'] == 'running':
+                remaining = max(progress['total_bytes'] - progress['bytes_read'], 0)
+                eta_seconds = remaining / (progress['bytes_read'] / elapsed) if progress['bytes_read'] else None
+        progress['messages_per_second'] = round(rate, 2) if rate else None
+        progress['eta_seconds'] = round(eta_seconds) if eta_seconds is not None else None
+        return progress
+
+    def stop(self) -> None:
+        """Stop reading the archive; messages already parsed are still written."""
+        self._stop_event.set()
+
+    def is_running(self) -> bool:
+        return self.state['status'] == 'running'
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.state[key] += amount
+
+    def _collect(self, emails: List[Optional[Dict[str, Any]]]) -> None:
+        """Queue parsed messages for embedding, skipping known ones.
+
+        Near-duplicates are only added to the email index, linked to their
+        canonical document, and not embedded.
+        """
+        for email in emails:
+            if email is None:
+                self._count('failed')
+                continue
+            if email['id'] in self._imported:
+                self._count('skipped')
+                continue
+            doc_id, content, metadata = build_email_document(email, self.account)
+            # Imported mail is listed and searched alongside synced mail
+            metadata['imported_from'] = self.path.name
+            canonical_id = near_duplicate_index.check(
+                doc_id, email['body'], 'import', self.account,
+                entry={'ids': [doc_id], 'documents': [content], 'metadatas': [metadata]}
+            )
+            if canonical_id:
+                email_index.upsert(doc_id, {**metadata, 'canonical_id': canonical_id})
+                self._imported.add(email['id'])
+                self._count('duplicates')
+                continue
+            self._documents.append((doc_id, content, metadata, email['body']))
+            if len(self._documents) >= self.embed_batch_size:
+                self._write()
+
+    def _write(self) -> None:
+        """Embed and bulk-upsert the queued documents."""
+        if not self._documents:
+            return
+        documents, self._documents = self._documents, []
+        doc_ids = [doc_id for doc_id, _, _, _ in documents]
+        contents = [content for _, content, _, _ in documents]
+        metadatas = [metadata for _, _, metadata, _ in documents]
+
+        add_many_to_chroma(doc_ids, contents, metadatas, generate_embeddings(contents))
+        email_index.upsert_many(zip(doc_ids, metadatas))
+        for doc_id, _, _, body in documents:
+            near_duplicate_index.register(doc_id, body, 'import', self.account)
+        self._imported.add_many(metadata['email_id'] for metadata in metadatas)
+        self._count('imported', len(documents))
+
+        if time.monotonic() - self._last_log >= IMPORT_LOG_INTERVAL:
+            self._last_log = time.monotonic()
+            progress = self.progress()
+            logger.info(
+                f"[{self.account}] Import of {self.path.name}: {progress['messages_seen']} read, "
+                f"{progress['imported']} imported, {progress['messages_per_second']} msg/s, "
+                f"ETA {progress['eta_seconds']}s"
+            )
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run the import until the archive is exhausted or stopped.
+
+        Returns:
+            The final progress
+        """
+        self._stop_event.clear()
+        self._started = time.monotonic()
+        with self._lock:
+            self.state['status'] = 'running'
+            self.state['error'] = None
+            self.state['started_at'] = datetime.utcnow().isoformat()
+
+        try:
+            messages, total_bytes = open_archive(self.path)
+            with self._lock:
+                self.state['total_bytes'] = total_bytes
+
+            # Chunks handed to the pool but not collected yet
+            in_flight = deque()
+            max_in_flight = self.parse_workers * 2
+            chunk: List[bytes] = []
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+                for raw in messages:
+                    if self._stop_event.is_set():
+                        break
+                    with self._lock:
+                        self.state['messages_seen'] += 1
+                        self.state['bytes_read'] += len(raw)
+                    chunk.append(raw)
+                    if len(chunk) < IMPORT_PARSE_CHUNK:
+                        continue
+                    in_flight.append(pool.submit(_parse_batch, chunk))
+                    chunk = []
+                    # Embed while the workers parse ahead, up to max_in_flight chunks
+                    while len(in_flight) >= max_in_flight:
+                        self._collect(in_flight.popleft().result())
+
+                if chunk:
+                    in_flight.append(pool.submit(_parse_batch, chunk))
+                while in_flight:
+                    self._collect(in_flight.popleft().result())
+            self._write()
+
+            with self._lock:
+                self.state['status'] = 'stopped' if self._stop_event.is_set() else 'completed'
+            logger.info(f"[{self.account}] Import of {self.path.name} {self.state['status']}: {self.progress()}")
+
+        except Exception as e:
+            logger.error(f"[{self.account}] Import of {self.path} failed: {e}")
+            with self._lock:
+                self.state['status'] = 'failed'
+                self.state['error'] = str(e)
+        finally:
+            self._imported.flush()
+            with self._lock:
+                self.state['finished_at'] = datetime.utcnow().isoformat()
+
+        return self.progress()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import an mbox file, a directory of .eml files or a zip of them"
+    )
+    parser.add_argument("path", help="mbox file, directory or zip archive")
+    parser.add_argument("--account", required=True, help="Email address to list the imported mail under")
+    parser.add_argument("--workers", type=int, default=IMPORT_PARSE_WORKERS, help="Parser processes")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_EMBED_BATCH_SIZE, help="Messages per embedding batch")
+    args = parser.parse_args()
+
+    mail_import = MailImport(args.path, args.account, parse_workers=args.workers, embed_batch_size=args.batch_size)
+    print(json.dumps(mail_import.run(), indent=2))
@@ -0,0 +1,282 @@
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SQLite side index of email headers kept next to the Chroma store
+EMAIL_INDEX_PATH = "./email_index.db"
+
+
+class EmailIndex:
+    """
+    Local structured index of email headers, dates and read state.
+
+    Chroma cannot index metadata substrings, so sender/recipient/subject
+    filters are resolved here first (an FTS5 trigram index turns substring
+    filters into index lookups) and only the matching ids are handed to
+    vector search. Rows are keyed by the Chroma document id; near-duplicate
+    emails, which are not embedded, have a row whose ``canonical_id`` names
+    the stored document they were linked to.
+    """
+
+    def __init__(self, path: str = EMAIL_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS emails (
+                    doc_id TEXT PRIMARY KEY,
+                    email_id TEXT,
+                    account TEXT,
+                    from_name TEXT,
+                    from_email TEXT,
+                    subject TEXT,
+                    thread_id TEXT,
+                    date INTEGER NOT NULL DEFAULT 0,
+                    read INTEGER,
+                    canonical_id TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_date ON emails(date DESC, doc_id DESC)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_thread ON emails(thread_id)")
+            # FTS rows share the rowid of their ``emails`` row, so updates and
+            # deletes address them by rowid instead of scanning the FTS table
+            try:
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+                        sender, recipients, subject, tokenize='trigram'
+                    )
+                """)
+            except sqlite3.OperationalError:
+                # SQLite < 3.34 has no trigram tokenizer: search falls back to LIKE scans
+                logger.warning("SQLite trigram tokenizer unavailable, header filters will scan")
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+                        sender, recipients, subject
+                    )
+                """)
+            # The table may predate this SQLite build, so check how it was created
+            fts_sql = self._conn.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'emails_fts'"
+            ).fetchone()[0]
+            self._trigram = "trigram" in fts_sql
+
+    def _rowids(self, doc_ids: List[str]) -> List[int]:
+        rowids = []
+        for doc_id in doc_ids:
+            row = self._conn.execute("SELECT rowid FROM emails WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row:
+                rowids.append(row[0])
+        return rowids
+
+    @staticmethod
+    def _row_from_metadata(doc_id: str, metadata: Dict[str, Any]) -> Tuple:
+        date = metadata.get("date")
+        try:
+            date = int(date)
+        except (TypeError, ValueError):
+            date = 0
+        read = metadata.get("read")
+        return (
+            doc_id,
+            metadata.get("email_id") or doc_id,
+            metadata.get("email_account", ""),
+            metadata.get("from_name", ""),
+            metadata.get("from_email", ""),
+            metadata.get("subject", ""),
+            metadata.get("thread_id", ""),
+            date,
+            None if read is None else int(bool(read)),
+            metadata.get("canonical_id"),
+        )
+
+    def upsert_many(self, items: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Insert or replace index rows from (doc_id, Chroma metadata) pairs."""
+        rows = []
+        fts_rows = []
+        for doc_id, metadata in items:
+            rows.append(self._row_from_metadata(doc_id, metadata))
+            sender = f"{metadata.get('from', '')} {metadata.get('from_name', '')} {metadata.get('from_email', '')}"
+            fts_rows.append((doc_id, sender, metadata.get("to", ""), metadata.get("subject", "")))
+        if not rows:
+            return
+
+        with self._lock, self._conn:
+            # Drop the old FTS rows by rowid, then update in place so rowids are kept
+            self._conn.executemany(
+                "DELETE FROM emails_fts WHERE rowid = ?",
+                [(rowid,) for rowid in self._rowids([row[0] for row in rows])]
+            )
+            self._conn.executemany(
+                "INSERT INTO emails VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(doc_id) DO UPDATE SET email_id = excluded.email_id, account = excluded.account, "
+                "from_name = excluded.from_name, from_email = excluded.from_email, subject = excluded.subject, "
+                "thread_id = excluded.thread_id, date = excluded.date, read = excluded.read, "
+                "canonical_id = excluded.canonical_id",
+                rows
+            )
+            rowids = self._rowids([row[0] for row in rows])
+            self._conn.executemany(
+                "INSERT INTO emails_fts (rowid, sender, recipients, subject) VALUES (?, ?, ?, ?)",
+                [(rowid, *fts_row[1:]) for rowid, fts_row in zip(rowids, fts_rows)]
+            )
+
+    def upsert(self, doc_id: str, metadata: Dict[str, Any]) -> None:
+        """Insert or replace the index row for a single email."""
+        self.upsert_many([(doc_id, metadata)])
+
+    def delete(self, doc_ids: List[str]) -> None:
+        """Remove emails from the index."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM emails_fts WHERE rowid = ?", [(rowid,) for rowid in self._rowids(doc_ids)]
+            )
+            self._conn.executemany("DELETE FROM emails WHERE doc_id = ?", [(d,) for d in doc_ids])
+
+    def count(self) -> int:
+        """Number of emails in the index."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+
+    def search(
+        self,
+        from_email: Optional[str] = None,
+        to: Optional[str] = None,
+        subject: Optional[str] = None,
+        unread: Optional[bool] = None,
+        since_ms: Optional[int] = None,
+        account: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after: Optional[Tuple[int, str]] = None
+    ) -> List[str]:
+        """
+        Resolve structured filters to Chroma document ids, newest first.
+
+        Args:
+            from_email: Case-insensitive substring of the sender name or address
+            to: Case-insensitive substring of the recipients
+            subject: Case-insensitive substring of the subject
+            unread: Only unread (True) or read (False) emails if given
+            since_ms: Only emails dated at or after this timestamp (ms since epoch)
+            account: Only emails ingested for this account
+            limit: Maximum number of ids to return (all if None)
+            offset: Number of matching ids to skip
+            after: (date, doc_id) of the last email of the previous page, for
+                keyset pagination
+
+        Returns:
+            Matching document ids ordered by date, newest first
+        """
+        clauses = []
+        params: List[Any] = []
+
+        text_filters = [("sender", from_email), ("recipients", to), ("subject", subject)]
+        text_filters = [(column, value) for column, value in text_filters if value]
+        if text_filters:
+            # Terms of 3+ characters use the trigram index as a substring
+            # phrase match; shorter ones fall back to a LIKE scan, as does
+            # every term without the trigram tokenizer (a MATCH would then
+            # only find whole tokens)
+            match_terms = []
+            fts_clauses = []
+            fts_params: List[Any] = []
+            for column, value in text_filters:
+                if len(value) >= 3 and self._trigram:
+                    phrase = value.replace('"', '""')
+                    match_terms.append(f'{{{column}}} : "{phrase}"')
+                else:
+                    fts_clauses.append(f"{column} LIKE ?")
+                    fts_params.append(f"%{value}%")
+            if match_terms:
+                fts_clauses.insert(0, "emails_fts MATCH ?")
+                fts_params.insert(0, " AND ".join(match_terms))
+            clauses.append(f"rowid IN (SELECT rowid FROM emails_fts WHERE {' AND '.join(fts_clauses)})")
+            params.extend(fts_params)
+
+        if unread is not None:
+            clauses.append("read = ?")
+            params.append(0 if unread else 1)
+        if since_ms is not None:
+            clauses.append("date >= ?")
+            params.append(since_ms)
+        if account:
+            clauses.append("account = ?")
+            params.append(account)
+        if after is not None:
+            clauses.append("(date < ? OR (date = ? AND doc_id < ?))")
+            params.extend([after[0], after[0], after[1]])
+
+        sql = "SELECT doc_id FROM emails"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY date DESC, doc_id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql, params)]
+
+    def position(self, doc_id: str) -> Optional[Tuple[int, str]]:
+        """Keyset position (date, doc_id) of an indexed email, for pagination cursors."""
+        with self._lock:
+            row = self._conn.execute("SELECT date FROM emails WHERE doc_id = ?", (doc_id,)).fetchone()
+        return (row[0], doc_id) if row else None
+
+    def near_duplicates(self, doc_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Index rows of near-duplicate emails among ``doc_ids``.
+
+        Returns:
+            Row fields (plus ``recipients``) by document id, for the ids that
+            were linked to a canonical document instead of being stored
+        """
+        rows = {}
+        with self._lock:
+            for doc_id in doc_ids:
+                row = self._conn.execute(
+                    "SELECT e.*, f.recipients FROM emails e LEFT JOIN emails_fts f ON f.rowid = e.rowid "
+                    "WHERE e.doc_id = ? AND e.canonical_id IS NOT NULL",
+                    (doc_id,)
+                ).fetchone()
+                if row:
+                    rows[doc_id] = dict(row)
+        return rows
+
+    def sync_from_collection(self, collection, batch_size: int = 500) -> int:
+        """
+        Populate the index from the Gmail emails already stored in Chroma.
+
+        Returns:
+            Number of emails indexed
+        """
+        indexed = 0
+        offset = 0
+        while True:
+            batch = collection.get(
+                where={"source": "gmail"},
+                include=["metadatas"],
+                limit=batch_size,
+                offset=offset
+            )
+            ids = batch.get("ids") or []
+            if not ids:
+                break
+            self.upsert_many(zip(ids, batch.get("metadatas") or [{}] * len(ids)))
+            indexed += len(ids)
+            offset += len(ids)
+        logger.info(f"Indexed {indexed} emails from Chroma")
+        return indexed
+
+
+# Shared index used by ingestion and search
+email_index = EmailIndex()
@@ -1,13 +1,33 @@
 import logging
+import os
 import time
 import json
 import threading
-from typing import List, Dict, Any, Optional, Set
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 
-from email_utils import get_gmail_service, get_recent_emails, get_unread_emails
-from chroma_client import add_to_chroma
+from email_utils import (
+    get_gmail_service,
+    get_recent_emails,
+    mark_as_read,
+    fetch_messages,
+    fetch_message_metadata,
+    parse_email,
+    get_current_history_id,
+    get_history_message_ids,
+    list_message_ids,
+    is_not_found,
+    HistoryExpiredError,
+    GMAIL_BATCH_SIZE
+)
+from body_queue import BodyFetchQueue, FailedMessageQueue, sender_importance
+from chroma_client import add_to_chroma, add_many_to_chroma, update_chroma_metadata
+from email_attachments import attachment_ingestor, INGEST_ATTACHMENTS
+from email_index import email_index
+from near_duplicates import near_duplicate_index
+from processed_store import ProcessedIdStore
 from embedding import generate_embeddings
 
 # Set up logging
@@ -21,51 +41,191 @@ logger = logging.getLogger(__name__)
 PROCESSED_EMAILS_DIR = Path("./processed_emails")
 PROCESSED_EMAILS_DIR.mkdir(exist_ok=True)
 
+# Sync modes: "history" follows users.history.list from a stored checkpoint and
+# leaves read state alone; "tiered" follows history too but first indexes only
+# headers (format='metadata') and fetches bodies in a later, prioritised pass;
+# "unread" polls INBOX+UNREAD and marks messages read
+SYNC_MODES = ("history", "tiered", "unread")
+GMAIL_SYNC_MODE = os.getenv("GMAIL_SYNC_MODE", "history")
+
+# Bodies fetched per pass in "tiered" mode, most important and newest first
+TIERED_BODY_BATCH = int(os.getenv("TIERED_BODY_BATCH", "200"))
+
+# Messages fetched by a full sync, used when there is no usable history checkpoint
+FULL_SYNC_MAX_RESULTS = 100
+
+def build_email_document(email: Dict[str, Any], account: str) -> Tuple[str, str, Dict[str, Any]]:
+    """Build the Chroma id, embedded text and metadata for a parsed email.
+    
+    Args:
+        email: Email dict as returned by email_utils.parse_email
+        account: The email address of the account the email was ingested for
+        
+    Returns:
+        Tuple of (doc_id, content, metadata)
+    """
+    email_id = email['id']
+    
+    # Create document content for embedding
+    content = "\n".join([
+        f"From: {email.get('from', '')}",
+        f"To: {email.get('to', '')}",
+        f"Subject: {email.get('subject', '')}",
+        f"Date: {email.get('date', '')}",
+        "",
+        email.get('body') or email.get('snippet', '')
+    ]).strip()
+    
+    # Parse the email date to a timestamp
+    email_date = email.get('date', '')
+    try:
+        # Try to parse the email date string to a datetime object
+        email_dt = parsedate_to_datetime(email_date)
+        timestamp = int(email_dt.timestamp() * 1000)  # Convert to milliseconds
+    except (ValueError, TypeError, AttributeError):
+        # If parsing fails, use current time
+        timestamp = int(datetime.utcnow().timestamp() * 1000)
+        logger.warning(f"Could not parse date: {email_date}, using current time")
+    
+    # Store with numeric timestamp. The display fields are normalised once
+    # here so search can use them as-is.
+    metadata = {
+        'source': 'gmail',
+        'email_id': email_id,
+        'email_account': account,
+        'from': email.get('from', ''),
+        'to': email.get('to', ''),
+        'subject': email.get('subject', ''),
+        'from_name': email.get('from_name', ''),
+        'from_email': email.get('from_email', ''),
+        'thread_id': email.get('thread_id') or '',
+        'preview': email.get('preview', ''),
+        'read': 'UNREAD' not in email.get('labels', []),
+        'body_fetched': email.get('body_fetched', True),  # False until the tiered body pass
+        'date': timestamp,  # Store as numeric timestamp (milliseconds since epoch)
+        'date_str': email_date,  # Keep original string for display
+        'type': 'email',
+        'processed_at': int(datetime.utcnow().timestamp() * 1000)  # Also numeric
+    }
+    
+    return f"email_{email_id}", content, metadata
+
 class EmailIngestionService:
-    def __init__(self, email: str, poll_interval: int = 300):
+    def __init__(
+        self,
+        email: str,
+        poll_interval: int = 300,
+        batch_size: int = GMAIL_BATCH_SIZE,
+        sync_mode: str = GMAIL_SYNC_MODE,
+        ingest_attachments: bool = INGEST_ATTACHMENTS
+    ):
         """Initialize the email ingestion service for a specific email account.
         
         Args:
             email: The email address of the account
             poll_interval: How often to check for new emails (in seconds)
+            batch_size: Number of messages fetched per Gmail batch request
+            sync_mode: "history" for incremental sync from the last history ID,
+                "tiered" for history sync that indexes headers first and bodies
+                later, or "unread" to poll unread messages and mark them read
+            ingest_attachments: Queue supported attachments (PDF, text, .eml)
+                for background indexing
         """
+        if sync_mode not in SYNC_MODES:
+            raise ValueError(f"Unknown sync mode: {sync_mode}. Supported modes: {', '.join(SYNC_MODES)}")
         self.email = email
         self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.sync_mode = sync_mode
+        self.ingest_attachments = ingest_attachments
         self.service = None
+        self._body_queue = self._open_body_queue() if sync_mode == "tiered" else None
+        self._failed_queue = self._open_failed_queue()
         self._stop_event = threading.Event()
-        self._processed_emails: Set[str] = set()
-        self._load_processed_emails()
+        self._processed_emails = self._load_processed_emails()
     
     def _get_processed_emails_file(self) -> Path:
-        """Get the path to the processed emails file for this account."""
+        """Get the path to the processed email ID store for this account."""
         safe_email = self.email.replace('@', '_').replace('.', '_')
-        return PROCESSED_EMAILS_DIR / f"{safe_email}_processed.json"
+        return PROCESSED_EMAILS_DIR / f"{safe_email}_processed.db"
     
-    def _load_processed_emails(self) -> None:
-        """Load the set of processed email IDs from disk."""
-        processed_file = self._get_processed_emails_file()
-        if processed_file.exists():
-            try:
-                with open(processed_file, 'r') as f:
-                    data = json.load(f)
-                    self._processed_emails = set(data.get('processed_emails', []))
-                logger.info(f"Loaded {len(self._processed_emails)} processed emails for {self.email}")
-            except Exception as e:
-                logger.error(f"Error loading processed emails for {self.email}: {e}")
-                self._processed_emails = set()
+    def _load_processed_emails(self) -> ProcessedIdStore:
+        """Open the processed email ID store, importing the legacy JSON set once."""
+        safe_email = self.email.replace('@', '_').replace('.', '_')
+        store = ProcessedIdStore(
+            self._get_processed_emails_file(),
+            legacy_json=PROCESSED_EMAILS_DIR / f"{safe_email}_processed.json"
+        )
+        logger.info(f"Loaded {len(store)} processed emails for {self.email}")
+        return store
     
-    def _save_processed_emails(self) -> None:
-        """Save the set of processed email IDs to disk."""
-        processed_file = self._get_processed_emails_file()
+    def save_processed_emails(self) -> None:
+        """Persist processed email IDs added since the last save."""
         try:
-            with open(processed_file, 'w') as f:
+            self._processed_emails.flush()
+        except Exception as e:
+            logger.error(f"Error saving processed emails for {self.email}: {e}")
+    
+    def is_processed(self, email_id: str) -> bool:
+        """Whether an email was already indexed (or linked as a near-duplicate)."""
+        return email_id in self._processed_emails
+    
+    def mark_processed(self, email_id: str) -> None:
+        """Record an email as indexed; persisted by the next save_processed_emails."""
+        self._processed_emails.add(email_id)
+    
+    def record_failed(self, message_ids: List[str]) -> List[str]:
+        """Keep messages that failed to index for retry by later sync passes.
+        
+        Returns:
+            Ids given up on after too many failed attempts
+        """
+        dropped = self._failed_queue.record_failures(message_ids)
+        logger.warning(
+            f"[{self.email}] {len(message_ids)} messages failed to index, {len(self._failed_queue)} queued for retry"
+        )
+        if dropped:
+            logger.error(f"[{self.email}] Giving up on {len(dropped)} messages after repeated failures: {dropped}")
+        return dropped
+    
+    def _open_body_queue(self) -> BodyFetchQueue:
+        """Open the queue of messages indexed from headers only, awaiting their body."""
+        safe_email = self.email.replace('@', '_').replace('.', '_')
+        return BodyFetchQueue(PROCESSED_EMAILS_DIR / f"{safe_email}_bodies.db")
+    
+    def _open_failed_queue(self) -> FailedMessageQueue:
+        """Open the set of messages that failed to index and are retried by later passes."""
+        safe_email = self.email.replace('@', '_').replace('.', '_')
+        return FailedMessageQueue(PROCESSED_EMAILS_DIR / f"{safe_email}_failed.db")
+    
+    def _get_sync_state_file(self) -> Path:
+        """Get the path to the incremental sync checkpoint for this account."""
+        safe_email = self.email.replace('@', '_').replace('.', '_')
+        return PROCESSED_EMAILS_DIR / f"{safe_email}_sync.json"
+    
+    def _load_history_id(self) -> Optional[str]:
+        """Load the last synced Gmail history ID, if any."""
+        state_file = self._get_sync_state_file()
+        if not state_file.exists():
+            return None
+        try:
+            with open(state_file, 'r') as f:
+                return json.load(f).get('history_id')
+        except Exception as e:
+            logger.error(f"Error loading sync state for {self.email}: {e}")
+            return None
+    
+    def _save_history_id(self, history_id: str) -> None:
+        """Persist the Gmail history ID reached by the last sync."""
+        try:
+            with open(self._get_sync_state_file(), 'w') as f:
                 json.dump({
                     'email': self.email,
-                    'last_updated': datetime.utcnow().isoformat(),
-                    'processed_emails': list(self._processed_emails)
+                    'history_id': history_id,
+                    'last_synced': datetime.utcnow().isoformat()
                 }, f, indent=2)
         except Exception as e:
-            logger.error(f"Error saving processed emails for {self.email}: {e}")
+            logger.error(f"Error saving sync state for {self.email}: {e}")
     
     def connect(self, max_retries: int = 3) -> bool:
         """Connect to Gmail API for the specific account.
@@ -121,25 +281,44 @@ class EmailIngestionService:
             logger.error(f"Final error: {last_error}")
         return False
     
-    def load_processed_emails(self):
-        """Load set of already processed email IDs."""
+    def queue_attachments(self, email: Dict[str, Any]) -> int:
+        """Queue a parsed email's attachments for lazy download and indexing.
+        
+        Returns:
+            Number of attachments queued
+        """
+        if not self.ingest_attachments or not email.get('attachments'):
+            return 0
         try:
-            if os.path.exists('processed_emails.txt'):
-                with open('processed_emails.txt', 'r') as f:
-                    self.processed_emails = set(line.strip() for line in f)
-            logger.info(f"Loaded {len(self.processed_emails)} processed email IDs")
+            return attachment_ingestor.submit(self.email, email)
         except Exception as e:
-            logger.error(f"Error loading processed emails: {e}")
-            self.processed_emails = set()
+            logger.error(f"[{self.email}] Error queueing attachments of {email.get('id')}: {e}")
+            return 0
     
-    def save_processed_email(self, email_id: str):
-        """Save processed email ID to file."""
-        try:
-            with open('processed_emails.txt', 'a') as f:
-                f.write(f"{email_id}\n")
-            self.processed_emails.add(email_id)
-        except Exception as e:
-            logger.error(f"Error saving processed email {email_id}: {e}")
+    def skip_near_duplicate(self, email: Dict[str, Any], doc_id: str, content: str,
+                            metadata: Dict[str, Any]) -> bool:
+        """Link an email whose body nearly matches an indexed one instead of embedding it.
+        
+        The email still gets its email index row, so it is listed and
+        filtered like any other; only the embedding is skipped.
+        
+        Returns:
+            True if the email is a near-duplicate and was marked processed
+        """
+        canonical_id = near_duplicate_index.check(
+            doc_id, email.get('body', ''), 'gmail', self.email,
+            entry={'ids': [doc_id], 'documents': [content], 'metadatas': [metadata]}
+        )
+        if canonical_id is None:
+            return False
+        email_index.upsert(doc_id, {**metadata, 'canonical_id': canonical_id, 'body_fetched': True})
+        if self._body_queue is not None:
+            # The header-only document stays; mark its body as handled so
+            # opening the email does not fetch it again
+            update_chroma_metadata([doc_id], [{'body_fetched': True, 'canonical_id': canonical_id}])
+        self._processed_emails.add(email['id'])
+        logger.info(f"[{self.email}] Skipping email {email['id']}: near-duplicate of {canonical_id}")
+        return True
     
     def process_email(self, email: Dict[str, Any]) -> bool:
         """Process a single email and store it in ChromaDB."""
@@ -149,19 +328,14 @@ class EmailIngestionService:
                 logger.error("Email missing ID")
                 return False
             
-            if email_id in self.processed_emails:
+            if email_id in self._processed_emails:
                 logger.debug(f"Email {email_id} already processed, skipping")
                 return False
             
-            # Create document content for embedding
-            content = f"""
-            From: {email.get('from', '')}
-            To: {email.get('to', '')}
-            Subject: {email.get('subject', '')}
-            Date: {email.get('date', '')}
-            
-            {email.get('body', '')}
-            """.strip()
+            doc_id, content, metadata = build_email_document(email, self.email)
+            self.queue_attachments(email)
+            if self.skip_near_duplicate(email, doc_id, content, metadata):
+                return False
             
             # Generate embedding
             embeddings = generate_embeddings([content])
@@ -169,121 +343,258 @@ class EmailIngestionService:
                 logger.error(f"Failed to generate embedding for email {email_id}")
                 return False
             
-            # Parse the email date to a timestamp
-            email_date = email.get('date', '')
-            try:
-                # Try to parse the email date string to a datetime object
-                from email.utils import parsedate_to_datetime
-                email_dt = parsedate_to_datetime(email_date)
-                timestamp = int(email_dt.timestamp() * 1000)  # Convert to milliseconds
-            except (ValueError, TypeError, AttributeError):
-                # If parsing fails, use current time
-                timestamp = int(datetime.utcnow().timestamp() * 1000)
-                logger.warning(f"Could not parse date: {email_date}, using current time")
-            
-            # Store in ChromaDB with numeric timestamp
-            metadata = {
-                'source': 'gmail',
-                'email_id': email_id,
-                'from': email.get('from', ''),
-                'to': email.get('to', ''),
-                'subject': email.get('subject', ''),
-                'date': timestamp,  # Store as numeric timestamp (milliseconds since epoch)
-                'date_str': email_date,  # Keep original string for display
-                'type': 'email',
-                'processed_at': int(datetime.utcnow().timestamp() * 1000)  # Also numeric
-            }
-            
             add_to_chroma(
-                doc_id=f"email_{email_id}",
+                doc_id=doc_id,
                 content=content,
                 metadata=metadata,
                 embedding=embeddings[0]
             )
+            email_index.upsert(doc_id, metadata)
+            near_duplicate_index.register(doc_id, email.get('body', ''), 'gmail', self.email)
             
             # Mark as processed
-            self.save_processed_email(email_id)
+            self._processed_emails.add(email_id)
             logger.info(f"Processed email: {email.get('subject', 'No subject')}")
             return True
         except Exception as e:
             logger.error(f"Error processing email: {e}")
             return False
             
-    def process_new_emails(self, max_results: int = 10) -> None:
-        """Process new unread emails.
+    def _fetch_and_process(self, message_ids: List[str]) -> int:
+        """Fetch, embed and store messages not processed yet through the staged pipeline.
+        
+        Messages that failed on earlier passes are retried first. Messages
+        that fail now (fetch errors other than 404, parse errors) are kept in
+        the failed queue, so callers can advance their checkpoint without
+        losing them; errors affecting the whole pass are raised instead.
+        
+        Returns:
+            Number of emails newly processed
+        """
+        retry_ids = self._failed_queue.pending()
+        retrying = set(retry_ids)
+        message_ids = retry_ids + [message_id for message_id in message_ids if message_id not in retrying]
+        new_ids = [message_id for message_id in message_ids if message_id not in self._processed_emails]
+        
+        if not new_ids:
+            processed_count, failed = 0, []
+        elif self._body_queue is not None:
+            processed_count, failed = self._index_metadata(new_ids)
+        else:
+            # Imported here: the pipeline imports build_email_document from this module
+            from ingestion_pipeline import email_pipeline
+            result = email_pipeline.run(self, new_ids)
+            self.save_processed_emails()
+            processed_count, failed = result.written, result.failed
+        
+        failed_set = set(failed)
+        self._failed_queue.remove_many(i for i in retry_ids if i not in failed_set)
+        if failed:
+            self.record_failed(failed)
+        return processed_count
+    
+    def _index_metadata(self, message_ids: List[str]) -> Tuple[int, List[str]]:
+        """Index messages from their headers and snippet only, queueing their bodies.
+        
+        The header-only documents are short, so they embed quickly and the
+        emails can be listed, filtered and found right away; the body pass
+        later replaces them with the full document.
+        
+        Returns:
+            Tuple of (number of emails indexed, ids that failed to fetch and
+            should be retried)
+        """
+        errors: Dict[str, Exception] = {}
+        messages = fetch_message_metadata(self.service, message_ids, batch_size=self.batch_size, errors=errors)
+        failed = [message_id for message_id, error in errors.items() if not is_not_found(error)]
+        emails = []
+        for message in messages:
+            try:
+                emails.append(parse_email(message))
+            except Exception as e:
+                logger.error(f"[{self.email}] Failed to parse message {message.get('id')}: {e}")
+                failed.append(message.get('id'))
+        if not emails:
+            return 0, failed
+        for email in emails:
+            email['body_fetched'] = False
+        
+        documents = [build_email_document(email, self.email) for email in emails]
+        doc_ids = [doc_id for doc_id, _, _ in documents]
+        contents = [content for _, content, _ in documents]
+        metadatas = [metadata for _, _, metadata in documents]
+        
+        add_many_to_chroma(doc_ids, contents, metadatas, generate_embeddings(contents))
+        email_index.upsert_many(zip(doc_ids, metadatas))
+        self._body_queue.add_many(
+            (email['id'], sender_importance(email), metadata['date'])
+            for email, metadata in zip(emails, metadatas)
+        )
+        logger.info(f"[{self.email}] Indexed headers of {len(emails)} emails, {len(self._body_queue)} bodies pending")
+        return len(emails), failed
+    
+    def fetch_bodies(self, limit: int = TIERED_BODY_BATCH) -> int:
+        """Fetch and embed full bodies of emails indexed from headers only.
         
         Args:
-            max_results: Maximum number of emails to process in one batch
+            limit: Maximum number of bodies to fetch from the queue
+        
+        Returns:
+            Number of emails whose body was indexed
         """
+        if self._body_queue is None:
+            return 0
+        message_ids = self._body_queue.next_batch(limit)
+        if not message_ids:
+            return 0
+        
+        # Imported here: the pipeline imports build_email_document from this module
+        from ingestion_pipeline import email_pipeline
+        result = email_pipeline.run(self, message_ids)
+        self.save_processed_emails()
+        
+        # Written, near-duplicate and deleted (404) messages are done; the
+        # ones that failed stay queued until they run out of attempts
+        failed = set(result.failed)
+        self._body_queue.remove_many(i for i in message_ids if i not in failed)
+        if failed:
+            dropped = self._body_queue.record_failures(failed)
+            if dropped:
+                logger.error(f"[{self.email}] Giving up on the bodies of {len(dropped)} emails: {dropped}")
+        logger.info(f"[{self.email}] Body pass indexed {result.written} emails, {len(self._body_queue)} pending")
+        return result.written
+    
+    def fetch_body(self, email_id: str) -> bool:
+        """Fetch and index one email's full body now (e.g. when a user opens it).
+        
+        Returns:
+            True if the body was indexed
+        """
+        errors: Dict[str, Exception] = {}
+        messages = fetch_messages(get_gmail_service(self.email), [email_id], errors=errors)
+        if not messages:
+            if is_not_found(errors.get(email_id)) and self._body_queue is not None:
+                self._body_queue.remove_many([email_id])
+            return False
+        
+        processed = self.process_email(parse_email(messages[0]))
+        if email_id in self._processed_emails:
+            # Indexed, or linked to a near-duplicate
+            if self._body_queue is not None:
+                self._body_queue.remove_many([email_id])
+            self.save_processed_emails()
+        return processed
+    
+    def full_sync(self, max_results: int = FULL_SYNC_MAX_RESULTS) -> int:
+        """Process the most recent inbox messages and start a new history checkpoint.
+        
+        Used when there is no checkpoint yet or it has expired, so it is
+        bounded to the newest max_results messages.
+        
+        Returns:
+            Number of emails newly processed
+        """
+        # Take the checkpoint first so nothing arriving during the sync is missed;
+        # messages that fail are kept in the failed queue, not behind the checkpoint
+        history_id = get_current_history_id(self.service)
+        message_ids = list_message_ids(self.service, max_results=max_results)
+        processed_count = self._fetch_and_process(message_ids)
+        self._save_history_id(history_id)
+        logger.info(f"[{self.email}] Full sync processed {processed_count} emails (history ID {history_id})")
+        return processed_count
+    
+    def sync_history(self) -> int:
+        """Process only messages added since the stored history checkpoint.
+        
+        Falls back to a bounded full sync when there is no checkpoint or
+        Gmail no longer has history for it.
+        
+        Returns:
+            Number of emails newly processed
+        """
+        history_id = self._load_history_id()
+        if not history_id:
+            logger.info(f"[{self.email}] No history checkpoint, running full sync")
+            return self.full_sync()
+        
+        try:
+            message_ids, latest_history_id = get_history_message_ids(self.service, history_id)
+        except HistoryExpiredError:
+            logger.warning(f"[{self.email}] History ID {history_id} expired, running full sync")
+            return self.full_sync()
+        
+        # Raises on errors affecting the whole pass, keeping the old checkpoint;
+        # individual failures are retried from the failed queue
+        processed_count = self._fetch_and_process(message_ids)
+        self._save_history_id(latest_history_id)
+        logger.info(f"[{self.email}] Incremental sync processed {processed_count} new emails.")
+        return processed_count
+    
+    def process_new_emails(self, max_results: int = 10) -> int:
+        """Process new emails using the configured sync mode.
+        
+        Args:
+            max_results: Maximum number of unread emails to process in one
+                batch (only used by the "unread" sync mode)
+        
+        Returns:
+            Number of emails newly processed
+        """
+        if self.sync_mode in ("history", "tiered"):
+            try:
+                return self.sync_history()
+            except Exception as e:
+                logger.error(f"[{self.email}] Error in incremental sync: {e}")
+                raise
+        
         try:
             # Get recent unread emails
-            emails = get_unread_emails(self.service, max_results=max_results)
+            message_ids = list_message_ids(self.service, max_results=max_results, label_ids=['INBOX', 'UNREAD'])
             
-            if not emails:
+            if not message_ids:
                 logger.info(f"[{self.email}] No new unread emails found.")
-                return
+                return 0
             
-            logger.info(f"[{self.email}] Found {len(emails)} new unread emails. Processing...")
+            logger.info(f"[{self.email}] Found {len(message_ids)} new unread emails. Processing...")
             
-            # Process each email
-            processed_count = 0
-            for email in emails:
-                if self._stop_event.is_set():
-                    break
-                    
-                try:
-                    # Skip if we've already processed this email
-                    if email['id'] in self._processed_emails:
-                        continue
-                    
-                    # Prepare metadata
-                    metadata = {
-                        'source': 'gmail',
-                        'email_account': self.email,
-                        'from': email.get('from', ''),
-                        'to': email.get('to', ''),
-                        'subject': email.get('subject', 'No Subject'),
-                        'date': email.get('date', ''),
-                        'message_id': email['id']
-                    }
-                    
-                    # Generate embedding for the email
-                    content = email.get('snippet', '')[:1000]  # Limit content length
-                    
-                    # Add to ChromaDB
-                    add_to_chroma(
-                        content=content,
-                        metadata=metadata
-                    )
-                    
-                    # Mark as processed
-                    self._processed_emails.add(email['id'])
-                    processed_count += 1
-                    
-                    # Periodically save processed emails to disk
-                    if processed_count % 10 == 0:
-                        self._save_processed_emails()
-                    
-                    logger.debug(f"[{self.email}] Processed email: {metadata['subject']} (ID: {email['id']})")
-                    
-                except Exception as e:
-                    logger.error(f"[{self.email}] Error processing email {email.get('id', 'unknown')}: {e}")
+            processed_count = self._fetch_and_process(message_ids)
             
-            # Save processed emails to disk
-            if processed_count > 0:
-                self._save_processed_emails()
+            # Messages that failed stay unread and queued for retry
+            mark_as_read(self.service, [i for i in message_ids if self.is_processed(i)])
             
             logger.info(f"[{self.email}] Processed {processed_count} new emails.")
+            return processed_count
             
         except Exception as e:
             logger.error(f"[{self.email}] Error in process_new_emails: {e}")
             raise
     
+    def run_once(self) -> int:
+        """Run a single sync pass, connecting to Gmail first if needed.
+        
+        Returns:
+            Number of emails newly processed
+        
+        Raises:
+            ConnectionError: If the Gmail API connection could not be established
+        """
+        if not self.service and not self.connect():
+            raise ConnectionError(f"Failed to connect to Gmail API for {self.email}")
+        # Cache hit for this worker thread; also refreshes the token ahead of expiry
+        self.service = get_gmail_service(self.email)
+        
+        processed_count = self.process_new_emails()
+        # New mail is indexed from headers first; bodies follow in a bounded pass
+        if self._body_queue is not None:
+            self.fetch_bodies()
+        self._processed_emails.compact()
+        return processed_count
+    
     def stop(self):
         """Stop the email ingestion service."""
         logger.info(f"[{self.email}] Stopping email ingestion service...")
         self._stop_event.set()
-        self._save_processed_emails()
+        self.save_processed_emails()
     
     def is_running(self) -> bool:
         """Check if the service is running."""
@@ -295,13 +606,7 @@ class EmailIngestionService:
         
         while not self._stop_event.is_set():
             try:
-                if not self.service and not self.connect():
-                    logger.error(f"[{self.email}] Failed to connect to Gmail API. Retrying in 60 seconds...")
-                    self._stop_event.wait(60)
-                    continue
-                
-                # Process new emails
-                self.process_new_emails()
+                self.run_once()
                 
                 # Wait for the next polling interval or until stopped
                 self._stop_event.wait(self.poll_interval)
@@ -0,0 +1,317 @@
+import base64
+import logging
+import re
+from email.message import Message
+from html import unescape
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tags whose text is never part of the readable body
+_SKIPPED_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template'}
+
+# Tags that start a new line of text
+_BLOCK_TAGS = {
+    'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'section', 'article',
+    'header', 'footer', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+}
+
+# Start of a quoted reply chain; everything from here down is dropped unless
+# it is an inline reply (answers between '>' quoted lines)
+_QUOTE_HEADER_PATTERNS = [
+    re.compile(r'^On .{1,200}(wrote|schrieb|a écrit|escribió):\s*$', re.IGNORECASE),
+    re.compile(r'^-{2,}\s*(Original Message|Forwarded message)\s*-{2,}\s*$', re.IGNORECASE),
+    re.compile(r'^_{10,}\s*$'),  # Outlook separator
+]
+
+# Outlook quotes replies under a "From: ..." line followed by "Sent: ..." or "Date: ..."
+_OUTLOOK_FROM = re.compile(r'^From:\s', re.IGNORECASE)
+_OUTLOOK_SENT = re.compile(r'^(Sent|Date):\s', re.IGNORECASE)
+
+# Start of a signature block
+_SIGNATURE_PATTERNS = [
+    re.compile(r'^--\s*$'),
+    re.compile(r'^Sent from my \w+', re.IGNORECASE),
+    re.compile(r'^Get Outlook for \w+', re.IGNORECASE),
+    re.compile(r'^Sent (from|with) (Mail|Yahoo Mail|Gmail|ProtonMail|Superhuman)\b', re.IGNORECASE),
+]
+
+# Bare link lines pointing at click-tracking/redirect hosts or carrying
+# campaign parameters; other bare links are content and are kept
+_TRACKING_LINK = re.compile(
+    r'^\s*https?://('
+    r'(click|clicks|links?|track(ing)?|trk|email|url\d*)\.\S+'
+    r'|\S*(list-manage\.com|sendgrid\.net|mailchi\.mp|mandrillapp\.com|hubspotlinks\.com'
+    r'|/track/click|/wf/click)\S*'
+    r'|\S*[?&](utm_[a-z]+|mc_[ce]id|_hsenc|_hsmi)=\S*'
+    r')\s*$',
+    re.IGNORECASE
+)
+
+# Tracking boilerplate dropped wherever it appears
+_BOILERPLATE_PATTERNS = [
+    re.compile(r'view (this email |it )?in (your|a) (web )?browser', re.IGNORECASE),
+    _TRACKING_LINK,
+]
+
+# Mailing list footer phrasing, only dropped from the trailing footer block
+_FOOTER_PATTERNS = [
+    re.compile(
+        r'\bto unsubscribe\b|\bunsubscribe (here|now|at any time|from (this|these|our|all|future)\b)'
+        r'|^\W*unsubscribe\W*(\||$)',
+        re.IGNORECASE
+    ),
+    re.compile(r'(manage|update) (your )?(email )?(preferences|subscription)', re.IGNORECASE),
+    re.compile(r'you (are )?receiv(ed|ing) this (email|message) because', re.IGNORECASE),
+    re.compile(r'this (email|message) was sent to', re.IGNORECASE),
+]
+
+# Boilerplate lines longer than this are treated as content
+_MAX_BOILERPLATE_LINE = 300
+
+# The footer block never reaches further up than this many lines from the end
+# (HTML bodies have no blank lines separating it from the content)
+_MAX_FOOTER_LINES = 15
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document, one line per block element."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """Convert HTML to plain text, keeping block elements on separate lines."""
+    parser = _HTMLTextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = ''.join(parser.parts)
+    except Exception as e:
+        logger.warning(f"Falling back to tag stripping for malformed HTML: {e}")
+        text = unescape(re.sub(r'<[^>]+>', ' ', html))
+    lines = (re.sub(r'[ \t\xa0]+', ' ', line).strip() for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def _cut_at(lines: List[str], patterns: List[re.Pattern], min_line: int = 1) -> List[str]:
+    """Drop everything from the first line (at or after min_line) matching a pattern."""
+    for i, line in enumerate(lines):
+        if i >= min_line and any(p.match(line.strip()) for p in patterns):
+            return lines[:i]
+    return lines
+
+
+def _matches(line: str, patterns: List[re.Pattern]) -> bool:
+    return len(line) <= _MAX_BOILERPLATE_LINE and any(p.search(line) for p in patterns)
+
+
+def _reply_header(lines: List[str]) -> Optional[int]:
+    """Index of the line starting the quoted reply chain (never the first line), if any."""
+    for i in range(1, len(lines)):
+        line = lines[i].strip()
+        if any(p.match(line) for p in _QUOTE_HEADER_PATTERNS):
+            return i
+        if i + 1 < len(lines) and _OUTLOOK_FROM.match(line) and _OUTLOOK_SENT.match(lines[i + 1].strip()):
+            return i
+    return None
+
+
+def _strip_quotes(lines: List[str]) -> List[str]:
+    """
+    Drop the quoted reply chain.
+
+    Everything from the reply header down is dropped, unless answers follow
+    '>' quoted lines below it (an inline or bottom-posted reply): then only
+    the header and the quoted lines go. '>' lines above the header are content.
+    """
+    header = _reply_header(lines)
+    if header is None:
+        return lines
+    quoted = False
+    for line in lines[header + 1:]:
+        if line.lstrip().startswith('>'):
+            quoted = True
+        elif quoted and line.strip():
+            return lines[:header] + [line for line in lines[header + 1:] if not line.lstrip().startswith('>')]
+    return lines[:header]
+
+
+def _strip_footer(lines: List[str]) -> List[str]:
+    """Drop mailing list footer lines from the trailing paragraphs that contain them."""
+    start = i = len(lines)
+    while i > 0:
+        j = i
+        while j > 0 and lines[j - 1].strip():
+            j -= 1
+        paragraph = lines[j:i]
+        if paragraph and not any(_matches(line, _FOOTER_PATTERNS + _BOILERPLATE_PATTERNS) for line in paragraph):
+            break
+        start = i = j
+        while i > 0 and not lines[i - 1].strip():
+            i -= 1
+    start = max(start, len(lines) - _MAX_FOOTER_LINES)
+    return lines[:start] + [line for line in lines[start:] if not _matches(line, _FOOTER_PATTERNS)]
+
+
+def clean_body(text: str) -> str:
+    """
+    Strip quoted replies, signatures and tracking boilerplate from an email body.
+
+    The first line is never treated as a quote or signature marker, so a
+    message that is nothing but a forwarded header block is kept as-is.
+    Unsubscribe and subscription notices are only removed from the footer.
+    """
+    text = (text or '').replace('\r\n', '\n').replace('\r', '\n')
+    lines = _strip_quotes(text.split('\n'))
+    lines = _cut_at(lines, _SIGNATURE_PATTERNS)
+    lines = _strip_footer(lines)
+    lines = [line for line in lines if not _matches(line, _BOILERPLATE_PATTERNS)]
+    cleaned = re.sub(r'\n{3,}', '\n\n', '\n'.join(line.rstrip() for line in lines)).strip()
+    # Never strip a message down to nothing
+    return cleaned or text.strip()
+
+
+def _choose_body(plain: Optional[str], html: Optional[str], clean: bool) -> str:
+    body = plain if plain and plain.strip() else html_to_text(html) if html else ''
+    return clean_body(body) if clean else body.strip()
+
+
+def _charset_from_headers(headers: List[Dict[str, str]]) -> str:
+    for header in headers or []:
+        if header.get('name', '').lower() == 'content-type':
+            match = re.search(r'charset="?([\w.-]+)"?', header.get('value', ''), re.IGNORECASE)
+            if match:
+                return match.group(1)
+    return 'utf-8'
+
+
+def _decode(data: bytes, charset: str) -> str:
+    try:
+        return data.decode(charset, errors='replace')
+    except LookupError:
+        return data.decode('utf-8', errors='replace')
+
+
+def _gmail_text_parts(payload: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Return the first text/plain and text/html bodies of a Gmail payload tree."""
+    plain = html = None
+    stack = [payload]
+    while stack:
+        part = stack.pop(0)
+        if part.get('parts'):
+            stack[:0] = part['parts']  # Depth-first, in document order
+            continue
+        if part.get('filename'):
+            continue  # Attachment
+        mime_type = part.get('mimeType', '').lower()
+        data = part.get('body', {}).get('data')
+        if not data or mime_type not in ('text/plain', 'text/html'):
+            continue
+        try:
+            text = _decode(base64.urlsafe_b64decode(data), _charset_from_headers(part.get('headers')))
+        except Exception as e:
+            logger.error(f"Error decoding email body part: {e}")
+            continue
+        if mime_type == 'text/plain' and plain is None:
+            plain = text
+        elif mime_type == 'text/html' and html is None:
+            html = text
+        if plain is not None:
+            break
+    return plain, html
+
+
+def gmail_attachments(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    List the attachments of a Gmail API message payload without downloading them.
+
+    Returns:
+        One dict per attachment with part_id, filename, mime_type, size and
+        either attachment_id (fetch with users.messages.attachments.get) or
+        inline base64url data for small parts
+    """
+    attachments = []
+    stack = [payload or {}]
+    while stack:
+        part = stack.pop(0)
+        if part.get('parts'):
+            stack[:0] = part['parts']
+        if not part.get('filename'):
+            continue
+        body = part.get('body', {})
+        attachments.append({
+            'part_id': part.get('partId', ''),
+            'filename': part['filename'],
+            'mime_type': part.get('mimeType', ''),
+            'size': body.get('size', 0),
+            'attachment_id': body.get('attachmentId'),
+            'data': body.get('data'),
+        })
+    return attachments
+
+
+def gmail_payload_body(payload: Dict[str, Any], clean: bool = True) -> str:
+    """
+    Extract the readable body from a Gmail API message payload (format='full').
+
+    Multipart trees are walked in order; text/plain is preferred and HTML is
+    converted to text only when there is no plain part. Attachments are skipped.
+
+    Args:
+        payload: The message's ``payload`` resource
+        clean: Strip quoted replies, signatures and boilerplate
+    """
+    plain, html = _gmail_text_parts(payload or {})
+    return _choose_body(plain, html, clean)
+
+
+def message_body(message: Message, clean: bool = True) -> str:
+    """
+    Extract the readable body from a parsed ``email.message.Message`` (.eml files).
+
+    Args:
+        message: Message parsed with the standard library email package
+        clean: Strip quoted replies, signatures and boilerplate
+    """
+    plain = html = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == 'attachment':
+            continue
+        content_type = part.get_content_type()
+        if content_type not in ('text/plain', 'text/html'):
+            continue
+        data = part.get_payload(decode=True)
+        if data is None:
+            continue
+        text = _decode(data, part.get_content_charset() or 'utf-8')
+        if content_type == 'text/plain' and plain is None:
+            plain = text
+            break
+        if content_type == 'text/html' and html is None:
+            html = text
+    return _choose_body(plain, html, clean)
@@ -0,0 +1,144 @@
+import hashlib
+import re
+from email.utils import parseaddr
+from typing import Dict, Optional, Tuple
+
+PREVIEW_LENGTH = 200
+MAX_SUBJECT_LENGTH = 100
+
+_EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+')
+_FROM_LINE_PATTERN = re.compile(r'^From:\s*(.+)$', re.IGNORECASE | re.MULTILINE)
+_REPLY_PREFIX_PATTERN = re.compile(r'^((re|fw|fwd)\s*:\s*)+', re.IGNORECASE)
+_LINKEDIN_PROFILE_PATTERN = re.compile(r'View profile:\s*https?://[^\s]+/in/([^?/\s]+)')
+_LINKEDIN_CONNECT_PATTERN = re.compile(r'Hi [^,]+,\s*([^\n]+) would like to connect')
+
+_HEADER_PREFIXES = ('from:', 'to:', 'subject:', 'date:', 'return-path:')
+_FOOTER_TERMS = ('unsubscribe', 'privacy', 'policy', 'terms', 'conditions', 'copyright')
+
+
+def parse_header_block(content: str) -> Tuple[Dict[str, str], str]:
+    """
+    Split "Header: value" lines at the top of a text email from its body.
+
+    Returns:
+        Tuple of (headers, body) where header names are lowercased
+    """
+    content = (content or '').replace('\r\n', '\n').replace('\r', '\n').strip()
+    headers: Dict[str, str] = {}
+    lines = content.split('\n')
+
+    body_start = 0
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped:
+            body_start = i + 1
+            break
+        name, sep, value = stripped.partition(':')
+        if not sep or ' ' in name.strip():
+            body_start = i
+            break
+        headers.setdefault(name.strip().lower(), value.strip())
+    else:
+        body_start = len(lines)
+
+    return headers, '\n'.join(lines[body_start:]).strip()
+
+
+def clean_subject(subject: str) -> str:
+    """Strip reply/forward prefixes, collapse whitespace and cap the length."""
+    subject = _REPLY_PREFIX_PATTERN.sub('', (subject or '').strip())
+    subject = re.sub(r'\s+', ' ', subject).strip()
+    if len(subject) > MAX_SUBJECT_LENGTH:
+        subject = subject[:MAX_SUBJECT_LENGTH - 3] + '...'
+    return subject
+
+
+def _guess_subject(body: str) -> str:
+    """Use the first meaningful body line as a subject when the header is missing."""
+    for line in body.split('\n')[:20]:
+        line = line.strip()
+        if not line or len(line) >= MAX_SUBJECT_LENGTH or len(line) <= 5:
+            continue
+        if line.lower().startswith(_HEADER_PREFIXES):
+            continue
+        if line.startswith(('-', '_', '*', '#')):
+            continue
+        if any(term in line.lower() for term in _FOOTER_TERMS):
+            continue
+        return line
+    return ''
+
+
+def _name_from_address(address: str) -> str:
+    """Turn first.last@example.com into "First Last"."""
+    local_part = address.split('@')[0]
+    if '.' not in local_part:
+        return ''
+    return ' '.join(part.capitalize() for part in local_part.split('.') if part)
+
+
+def make_preview(body: str, length: int = PREVIEW_LENGTH) -> str:
+    """Collapse whitespace and truncate the body for list views."""
+    text = re.sub(r'\s+', ' ', body or '').strip()
+    return (text[:length] + '...') if len(text) > length else text
+
+
+def normalize_email(
+    sender: str,
+    subject: str,
+    body: str,
+    thread_id: Optional[str] = None
+) -> Dict[str, str]:
+    """
+    Derive clean display fields for an email once, at ingestion time.
+
+    Args:
+        sender: Raw From header (e.g. 'Jane Doe <jane@example.com>'), may be empty
+        subject: Raw Subject header, may be empty
+        body: Plain-text body of the email
+        thread_id: Provider thread ID (Gmail threadId) if known
+
+    Returns:
+        Dictionary with from_name, from_email, subject, thread_id and preview
+    """
+    body = (body or '').replace('\r\n', '\n').replace('\r', '\n')
+    from_name, from_email = parseaddr(sender or '')
+    from_name = re.sub(r'\s+', ' ', from_name.strip().strip('"')).strip()
+
+    if 'linkedin.com/invite/' in body:
+        match = _LINKEDIN_PROFILE_PATTERN.search(body)
+        if match:
+            from_name = match.group(1).replace('-', ' ').title()
+        else:
+            match = _LINKEDIN_CONNECT_PATTERN.search(body)
+            if match:
+                from_name = match.group(1).strip()
+    elif not from_name and 'pinterest.com' in f"{from_email} {body}".lower():
+        from_name = 'Pinterest'
+
+    if not from_email:
+        match = _FROM_LINE_PATTERN.search(body)
+        candidate = match.group(1) if match else body
+        address = _EMAIL_PATTERN.search(candidate)
+        if address:
+            from_email = address.group(0)
+        elif match and not from_name:
+            from_name = re.sub(r'<[^>]*>', '', match.group(1)).strip()
+
+    if not from_name and from_email:
+        from_name = _name_from_address(from_email)
+
+    subject = clean_subject(subject) or clean_subject(_guess_subject(body))
+
+    if not thread_id:
+        # Group replies and forwards with their original by normalised subject
+        key = subject.lower() or from_email.lower()
+        thread_id = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    return {
+        'from_name': from_name,
+        'from_email': from_email.lower(),
+        'subject': subject,
+        'thread_id': thread_id,
+        'preview': make_preview(body)
+    }
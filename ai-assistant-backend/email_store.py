@@ -0,0 +1,328 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from email_normalize import normalize_email, parse_header_block
+
+logger = logging.getLogger(__name__)
+
+# Directory of exported email JSON files served by /api/search/emails/fast
+EMAILS_DIR = Path("./emails")
+EMAIL_STORE_PATH = "./email_store.db"
+
+# Minimum seconds between scans of the emails directory
+EMAIL_STORE_SYNC_INTERVAL = float(os.getenv("EMAIL_STORE_SYNC_INTERVAL", "5"))
+
+
+def parse_email_date(value: Any) -> Optional[datetime]:
+    """Parse a Unix timestamp (s or ms), ISO 8601 or RFC 2822 date."""
+    if value in (None, ""):
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            # Handle Unix timestamp (in seconds or milliseconds)
+            return datetime.fromtimestamp(value / 1000.0 if value > 1e12 else value)
+        try:
+            return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return parsedate_to_datetime(str(value))
+    except (ValueError, TypeError, OverflowError) as e:
+        logger.warning(f"Failed to parse date '{value}': {str(e)}")
+        return None
+
+
+def email_from_json(email_id: str, email_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn one exported email JSON document into a store row.
+
+    Sender/subject normalisation happens here, once per file write, instead of
+    on every search request.
+    """
+    # Get the raw content (try multiple possible field names)
+    raw_content = (
+        email_data.get('content') or
+        email_data.get('body') or
+        email_data.get('text') or
+        email_data.get('raw_content', '')
+    )
+    if not isinstance(raw_content, str):
+        raw_content = str(raw_content)
+    headers, body = parse_header_block(raw_content)
+
+    raw_sender = email_data.get('from') or email_data.get('sender') or headers.get('from', '')
+    if 'from_name' in email_data or 'from_email' in email_data:
+        sender = email_data.get('from_name') or email_data.get('from_email') or ''
+        raw_sender = f"{raw_sender} {email_data.get('from_email', '')}"
+        subject = email_data.get('subject') or 'No Subject'
+    else:
+        normalized = normalize_email(
+            raw_sender,
+            email_data.get('subject') or headers.get('subject', ''),
+            body
+        )
+        sender = normalized['from_name'] or normalized['from_email']
+        subject = normalized['subject'] or 'No Subject'
+
+    date_str = email_data.get('date') or headers.get('date', '')
+    date_obj = parse_email_date(date_str)
+
+    return {
+        'id': email_id,
+        'from': sender,
+        'sender_text': f"{sender} {raw_sender}",  # Searchable: display name and address
+        'to': email_data.get('to') or headers.get('to', ''),
+        'subject': subject,
+        'date': date_str if isinstance(date_str, str) else str(date_str),
+        'timestamp': int(date_obj.timestamp() * 1000) if date_obj else 0,
+        'content': raw_content
+    }
+
+
+class EmailStore:
+    """
+    Persistent, incrementally maintained index over the exported email files.
+
+    Rows are ordered by a sort key (the email date, or the file modification
+    time when the date is missing) with a B-tree index, and an FTS5 trigram
+    table answers substring queries over subject, sender, recipients and
+    content. Syncs are incremental: they do nothing while the directory's
+    own modification time is unchanged, and otherwise only read files whose
+    name or inode is new, without stat'ing the files already indexed.
+    """
+
+    def __init__(
+        self,
+        path: str = EMAIL_STORE_PATH,
+        emails_dir: Path = EMAILS_DIR,
+        sync_interval: float = EMAIL_STORE_SYNC_INTERVAL
+    ):
+        self.path = path
+        self.emails_dir = Path(emails_dir)
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._last_sync: Optional[float] = None
+        # Directory modification time (ns) as of the last sync
+        self._dir_mtime: Optional[int] = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    file_mtime REAL NOT NULL,
+                    file_inode INTEGER,
+                    sort_key INTEGER NOT NULL,
+                    sender TEXT,
+                    recipients TEXT,
+                    subject TEXT,
+                    date TEXT,
+                    timestamp INTEGER,
+                    content TEXT
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_sort ON messages(sort_key DESC, id DESC)"
+            )
+            # FTS rows share the rowid of their ``messages`` row, so rewrites
+            # and removals address them by rowid instead of scanning the FTS table
+            try:
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        subject, sender, recipients, content, tokenize='trigram'
+                    )
+                """)
+            except sqlite3.OperationalError:
+                logger.warning("SQLite trigram tokenizer unavailable, fast email search will scan")
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        subject, sender, recipients, content
+                    )
+                """)
+
+    def _rowid(self, email_id: str) -> Optional[int]:
+        row = self._conn.execute("SELECT rowid FROM messages WHERE id = ?", (email_id,)).fetchone()
+        return row[0] if row else None
+
+    def _write(self, row: Dict[str, Any], file_mtime: float, file_inode: int) -> None:
+        sort_key = row['timestamp'] or int(file_mtime * 1000)
+        rowid = self._rowid(row['id'])
+        if rowid is not None:
+            self._conn.execute("DELETE FROM messages_fts WHERE rowid = ?", (rowid,))
+        # Update in place so the row keeps its rowid
+        self._conn.execute(
+            "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET file_mtime = excluded.file_mtime, file_inode = excluded.file_inode, "
+            "sort_key = excluded.sort_key, "
+            "sender = excluded.sender, recipients = excluded.recipients, subject = excluded.subject, "
+            "date = excluded.date, timestamp = excluded.timestamp, content = excluded.content",
+            (row['id'], file_mtime, file_inode, sort_key, row['from'], row['to'], row['subject'],
+             row['date'], row['timestamp'], row['content'])
+        )
+        self._conn.execute(
+            "INSERT INTO messages_fts (rowid, subject, sender, recipients, content) VALUES (?, ?, ?, ?, ?)",
+            (self._rowid(row['id']), row['subject'], row['sender_text'], row['to'], row['content'])
+        )
+
+    def _remove(self, email_ids: List[str]) -> None:
+        rowids = [rowid for rowid in map(self._rowid, email_ids) if rowid is not None]
+        self._conn.executemany("DELETE FROM messages_fts WHERE rowid = ?", [(r,) for r in rowids])
+        self._conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in email_ids])
+
+    def sync(self, force: bool = False) -> int:
+        """
+        Bring the store up to date with the emails directory.
+
+        Adding, removing or replacing a file (written elsewhere and renamed
+        over) changes the directory's modification time, so while that is
+        unchanged the sync does nothing. Otherwise the directory listing is
+        compared with the store: new files and files with a new inode are
+        read, missing ones removed, and known files are not stat'ed. Files
+        rewritten in place keep their inode; ``force`` also compares every
+        file's modification time to pick those up. Checks run at most every
+        ``sync_interval`` seconds unless forced.
+
+        Returns:
+            Number of files (re)indexed or removed
+        """
+        now = time.monotonic()
+        if not force and self._last_sync is not None and now - self._last_sync < self.sync_interval:
+            return 0
+        self._last_sync = now
+        try:
+            # Taken before listing, so files added during the sync change it again
+            dir_mtime = self.emails_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        if not force and dir_mtime == self._dir_mtime:
+            return 0
+
+        with self._lock:
+            known = {
+                email_id: (file_mtime, file_inode)
+                for email_id, file_mtime, file_inode in self._conn.execute(
+                    "SELECT id, file_mtime, file_inode FROM messages"
+                )
+            }
+
+        changed: List[Tuple[str, float, int, str]] = []
+        seen = set()
+        with os.scandir(self.emails_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                email_id = entry.name[:-len('.json')]
+                seen.add(email_id)
+                previous = known.get(email_id)
+                # The inode comes from the directory listing, no stat needed
+                if previous is not None and previous[1] == entry.inode() and not force:
+                    continue
+                mtime = entry.stat().st_mtime
+                if previous != (mtime, entry.inode()):
+                    changed.append((email_id, mtime, entry.inode(), entry.path))
+
+        removed = [email_id for email_id in known if email_id not in seen]
+
+        with self._lock, self._conn:
+            for email_id, mtime, inode, file_path in changed:
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        email_data = json.load(f)
+                    if not isinstance(email_data, dict):
+                        logger.warning(f"Skipping non-dictionary email data in {file_path}")
+                        continue
+                    self._write(email_from_json(email_id, email_data), mtime, inode)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Error decoding JSON in {file_path}: {str(e)}")
+                except Exception as e:
+                    logger.error(f"Error indexing {file_path}: {str(e)}", exc_info=True)
+            if removed:
+                self._remove(removed)
+        self._dir_mtime = dir_mtime
+
+        if changed or removed:
+            logger.info(f"Email store synced: {len(changed)} indexed, {len(removed)} removed")
+        return len(changed) + len(removed)
+
+    def search(
+        self,
+        query: str = "",
+        since_ms: Optional[int] = None,
+        limit: int = 100,
+        after: Optional[Tuple[int, str]] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[Tuple[int, str]]]:
+        """
+        Find emails newest first, optionally matching a substring query.
+
+        Args:
+            query: Case-insensitive substring of subject, sender, recipients or content
+            since_ms: Only emails sorted at or after this timestamp (ms since epoch)
+            limit: Maximum number of emails to return
+            after: Position (sort_key, id) of the last email of the previous page
+
+        Returns:
+            Tuple of (emails, next_position); next_position is None on the last page
+        """
+        clauses = []
+        params: List[Any] = []
+
+        if query:
+            if len(query) >= 3:
+                phrase = query.replace('"', '""')
+                clauses.append("rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+                params.append(f'"{phrase}"')
+            else:
+                clauses.append(
+                    "rowid IN (SELECT rowid FROM messages_fts WHERE subject LIKE ? OR sender LIKE ? "
+                    "OR recipients LIKE ? OR content LIKE ?)"
+                )
+                params.extend([f"%{query}%"] * 4)
+        if since_ms is not None:
+            clauses.append("sort_key >= ?")
+            params.append(since_ms)
+        if after is not None:
+            clauses.append("(sort_key < ? OR (sort_key = ? AND id < ?))")
+            params.extend([after[0], after[0], after[1]])
+
+        sql = "SELECT * FROM messages"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY sort_key DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        next_position = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_position = (rows[-1]['sort_key'], rows[-1]['id'])
+
+        emails = [
+            {
+                'id': row['id'],
+                'from': row['sender'],
+                'to': row['recipients'],
+                'subject': row['subject'],
+                'content': row['content'],
+                'date': row['date'],
+                'timestamp': row['timestamp'],
+                'raw_content': row['content']  # Include full raw content for parsing on client
+            }
+            for row in rows
+        ]
+        return emails, next_position
+
+
+# Shared store used by the fast email search endpoint
+email_store = EmailStore()
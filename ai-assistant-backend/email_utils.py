@@ -1,22 +1,27 @@
-import base64
 import os
 import sys
 import json
 import logging
-import re
 import uuid
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Tuple
 from email import message_from_bytes
 from email.header import decode_header
+from email.utils import parseaddr
 from pathlib import Path
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
 from googleapiclient.discovery import build
+from googleapiclient.http import BatchHttpRequest
+from googleapiclient.errors import HttpError
 from fastapi import HTTPException
 
+from email_mime import gmail_attachments, gmail_payload_body
+from google_clients import GoogleClientCache
+from email_normalize import normalize_email
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,6 +39,21 @@ SCOPES = [
 TOKENS_DIR = Path("./tokens")
 TOKENS_DIR.mkdir(exist_ok=True)
 
+# Override the Gmail API root (e.g. http://localhost:8085/) to run against a
+# local fake Gmail server
+GMAIL_API_ENDPOINT = os.getenv("GMAIL_API_ENDPOINT")
+
+# Gmail allows up to 100 calls per batch request; 50 keeps clear of the
+# per-user concurrent request limit
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+
+# Partial response: only the parts of a message resource we actually use
+GMAIL_MESSAGE_FIELDS = "id,threadId,labelIds,snippet,internalDate,payload(partId,mimeType,filename,headers,body,parts)"
+
+# Headers requested by metadata-only fetches (format='metadata')
+GMAIL_METADATA_HEADERS = ['From', 'To', 'Subject', 'Date', 'List-Unsubscribe', 'Precedence']
+GMAIL_METADATA_FIELDS = "id,threadId,labelIds,snippet,internalDate,payload(headers)"
+
 def get_flow(redirect_uri: str) -> Flow:
     """Create and return a Flow instance for OAuth."""
     credentials_path = Path('credentials.json')
@@ -74,8 +94,9 @@ def exchange_code_for_token(code: str, redirect_uri: str, state: str = None) ->
         if not email:
             raise HTTPException(status_code=400, detail="Could not retrieve user email")
         
-        # Save the credentials
+        # Save the credentials and drop any cached ones for this account
         save_credentials(email, flow.credentials)
+        gmail_clients.invalidate(email)
         
         return flow.credentials, email
     except Exception as e:
@@ -124,80 +145,82 @@ def get_credentials(email: str) -> Optional[Credentials]:
         logger.error(f"Error loading credentials for {email}: {e}")
         return None
 
+# Cached Gmail clients and credentials, one entry per account
+gmail_clients = GoogleClientCache(loader=get_credentials, saver=save_credentials)
+
 def get_gmail_service(email: str):
-    """Get Gmail API service for a specific email account."""
-    creds = get_credentials(email)
-    if not creds:
-        raise HTTPException(status_code=401, detail="No credentials found. Please authenticate first.")
-    
-    # Refresh token if needed
-    if creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(Request())
-            save_credentials(email, creds)
-        except Exception as e:
-            logger.error(f"Error refreshing token for {email}: {e}")
-            raise HTTPException(status_code=401, detail="Failed to refresh access token")
+    """Get Gmail API service for a specific email account.
     
+    Services and credentials come from a per-account cache, so repeated calls
+    skip the token file, discovery and building; tokens are refreshed shortly
+    before they expire.
+    """
     try:
-        return build('gmail', 'v1', credentials=creds)
+        service = gmail_clients.get_service(
+            email,
+            'gmail',
+            'v1',
+            client_options={"api_endpoint": GMAIL_API_ENDPOINT} if GMAIL_API_ENDPOINT else None
+        )
+    except RefreshError as e:
+        logger.error(f"Error refreshing token for {email}: {e}")
+        gmail_clients.invalidate(email)
+        raise HTTPException(status_code=401, detail="Failed to refresh access token")
     except Exception as e:
         logger.error(f"Error building Gmail service for {email}: {e}")
         raise HTTPException(status_code=500, detail="Failed to initialize Gmail service")
+    
+    if service is None:
+        raise HTTPException(status_code=401, detail="No credentials found. Please authenticate first.")
+    return service
 
-def parse_email(raw_data):
-    msg = message_from_bytes(base64.urlsafe_b64decode(raw_data))
-    subject = decode_mime_words(msg.get("Subject"))
-    from_name, from_email = parse_email_header(msg.get("From"))
+def decode_mime_words(value: Optional[str]) -> str:
+    """Decode RFC 2047 encoded words (e.g. =?UTF-8?B?...?=) in a header value."""
+    if not value:
+        return ""
+    parts = []
+    for text, charset in decode_header(value):
+        if isinstance(text, bytes):
+            text = text.decode(charset or 'utf-8', errors='ignore')
+        parts.append(text)
+    return ''.join(parts)
 
-    return {
-        "subject": subject,
-        "from_name": from_name,
-        "from_email": from_email
+def parse_email(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a Gmail API message resource (format='full') into a flat email dict.
+
+    The display fields (from_name, from_email, clean subject, thread_id and
+    preview) are normalised here once so search never has to re-parse them.
+    """
+    headers = {
+        h.get('name', '').lower(): h.get('value', '')
+        for h in message.get('payload', {}).get('headers', [])
+    }
+    email_data = {
+        'id': message.get('id'),
+        'thread_id': message.get('threadId'),
+        'from': decode_mime_words(headers.get('from')),
+        'to': decode_mime_words(headers.get('to')),
+        'subject': decode_mime_words(headers.get('subject')),
+        'date': headers.get('date', ''),
+        'snippet': message.get('snippet', ''),
+        'labels': message.get('labelIds', []),
+        # Mailing lists and bulk senders mark themselves with these headers
+        'bulk': bool(headers.get('list-unsubscribe'))
+            or headers.get('precedence', '').lower() in ('bulk', 'list', 'junk'),
+        'body': ''
     }
 
+    # Readable body: prefers text/plain, without quoted replies or signatures
+    email_data['body'] = gmail_payload_body(message.get('payload', {}))
+    email_data['attachments'] = gmail_attachments(message.get('payload', {}))
 
-    
-    # Extract email body
-    def get_body(part):
-        """Recursively extract body from email parts."""
-        if part.get('parts'):
-            for subpart in part['parts']:
-                get_body(subpart)
-        
-        mime_type = part.get('mimeType', '').lower()
-        data = part.get('body', {}).get('data', '')
-        
-        if not data:
-            return
-            
-        try:
-            text = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-            
-            # Prefer plain text over HTML
-            if mime_type == 'text/plain' and not email_data['body']:
-                email_data['body'] = text
-            elif mime_type == 'text/html' and not email_data['body']:
-                # Simple HTML to text conversion
-                import re
-                text = re.sub('<[^<]+?>', ' ', text)
-                email_data['body'] = ' '.join(text.split())
-                
-        except Exception as e:
-            logger.error(f"Error decoding email body: {e}")
-    
-    # Start processing from the root payload
-    get_body(message.get('payload', {}))
-    
-    # If we still don't have a body, try the simple approach
-    if not email_data['body']:
-        data = message.get("payload", {}).get("body", {}).get("data", "")
-        if data:
-            try:
-                email_data['body'] = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
-            except Exception as e:
-                logger.error(f"Error decoding simple email body: {e}")
-    
+    email_data.update(normalize_email(
+        email_data['from'],
+        email_data['subject'],
+        email_data['body'] or email_data['snippet'],
+        thread_id=email_data['thread_id']
+    ))
     return email_data
 
 def parse_email_header(header: str) -> Tuple[str, str]:
@@ -208,7 +231,96 @@ def parse_email_header(header: str) -> Tuple[str, str]:
     name = decode_mime_words(name).strip()
     return name or "", email or ""
 
-def get_recent_emails(service, max_results: int = 10) -> List[Dict[str, Any]]:
+def new_batch_request(service, callback) -> BatchHttpRequest:
+    """Create a batch request for the Gmail service, honouring GMAIL_API_ENDPOINT."""
+    if GMAIL_API_ENDPOINT:
+        # The batch URI comes from the discovery document, not the endpoint override
+        return BatchHttpRequest(
+            callback=callback,
+            batch_uri=f"{GMAIL_API_ENDPOINT.rstrip('/')}/batch/gmail/v1"
+        )
+    return service.new_batch_http_request(callback=callback)
+
+def fetch_messages(
+    service,
+    message_ids: List[str],
+    format: str = 'full',
+    batch_size: int = GMAIL_BATCH_SIZE,
+    fields: Optional[str] = GMAIL_MESSAGE_FIELDS,
+    metadata_headers: Optional[List[str]] = None,
+    errors: Optional[Dict[str, Exception]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fetch several messages with Gmail batch HTTP requests.
+    
+    Args:
+        service: Gmail API service
+        message_ids: IDs of the messages to fetch
+        format: Message format ('full', 'metadata', 'minimal' or 'raw')
+        batch_size: Number of messages per batch request (at most 100)
+        fields: Partial-response field mask for each message
+        metadata_headers: Headers to return when format is 'metadata'
+        errors: If given, filled with the error of each message that failed
+            to fetch, by message ID
+        
+    Returns:
+        The fetched message resources, in the order of message_ids. Messages
+        that failed to fetch are logged and left out.
+    """
+    messages: Dict[str, Dict[str, Any]] = {}
+    
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            logger.error(f"Error fetching message {request_id}: {exception}")
+            if errors is not None:
+                errors[request_id] = exception
+        else:
+            messages[request_id] = response
+    
+    batch_size = max(1, min(batch_size, 100))
+    for start in range(0, len(message_ids), batch_size):
+        batch = new_batch_request(service, on_response)
+        for message_id in message_ids[start:start + batch_size]:
+            params = {'userId': 'me', 'id': message_id, 'format': format}
+            if fields:
+                params['fields'] = fields
+            if metadata_headers:
+                params['metadataHeaders'] = metadata_headers
+            batch.add(service.users().messages().get(**params), request_id=message_id)
+        batch.execute()
+    
+    return [messages[message_id] for message_id in message_ids if message_id in messages]
+
+def is_not_found(error: Exception) -> bool:
+    """Whether a Gmail API error means the message no longer exists (deleted)."""
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+def mark_as_read(service, message_ids: List[str]) -> None:
+    """Remove the UNREAD label from messages, up to 1000 per batchModify call."""
+    for start in range(0, len(message_ids), 1000):
+        service.users().messages().batchModify(
+            userId='me',
+            body={'ids': message_ids[start:start + 1000], 'removeLabelIds': ['UNREAD']}
+        ).execute()
+
+def fetch_message_metadata(
+    service,
+    message_ids: List[str],
+    batch_size: int = GMAIL_BATCH_SIZE,
+    errors: Optional[Dict[str, Exception]] = None
+) -> List[Dict[str, Any]]:
+    """Batch-fetch only the headers, labels and snippet of messages (format='metadata')."""
+    return fetch_messages(
+        service,
+        message_ids,
+        format='metadata',
+        batch_size=batch_size,
+        fields=GMAIL_METADATA_FIELDS,
+        metadata_headers=GMAIL_METADATA_HEADERS,
+        errors=errors
+    )
+
+def get_recent_emails(service, max_results: int = 10, batch_size: int = GMAIL_BATCH_SIZE) -> List[Dict[str, Any]]:
     """Fetch recent emails from Gmail."""
     try:
         results = service.users().messages().list(
@@ -217,28 +329,15 @@ def get_recent_emails(service, max_results: int = 10) -> List[Dict[str, Any]]:
             labelIds=['INBOX']
         ).execute()
         
-        messages = results.get('messages', [])
-        emails = []
-        
-        for msg in messages:
-            msg_data = service.users().messages().get(
-                userId='me',
-                id=msg['id'],
-                format='full'
-            ).execute()
-            
-            email = parse_email(msg_data)
-            email['id'] = msg['id']
-            emails.append(email)
-        
-        return emails
+        message_ids = [msg['id'] for msg in results.get('messages', [])]
+        return [parse_email(msg_data) for msg_data in fetch_messages(service, message_ids, batch_size=batch_size)]
     
     except Exception as e:
         logger.error(f"Error fetching emails: {e}")
         return []
 
-def get_unread_emails(service, max_results: int = 10) -> List[Dict[str, Any]]:
-    """Fetch unread emails from Gmail."""
+def get_unread_emails(service, max_results: int = 10, batch_size: int = GMAIL_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Fetch unread emails from Gmail and mark them as read."""
     try:
         results = service.users().messages().list(
             userId='me',
@@ -246,29 +345,87 @@ def get_unread_emails(service, max_results: int = 10) -> List[Dict[str, Any]]:
             labelIds=['INBOX', 'UNREAD']
         ).execute()
         
-        messages = results.get('messages', [])
-        emails = []
+        message_ids = [msg['id'] for msg in results.get('messages', [])]
+        emails = [parse_email(msg_data) for msg_data in fetch_messages(service, message_ids, batch_size=batch_size)]
         
-        for msg in messages:
-            msg_data = service.users().messages().get(
-                userId='me',
-                id=msg['id'],
-                format='full'
-            ).execute()
-            
-            email = parse_email(msg_data)
-            email['id'] = msg['id']
-            emails.append(email)
-            
-            # Mark as read
-            service.users().messages().modify(
-                userId='me',
-                id=msg['id'],
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
+        # Mark as read
+        mark_as_read(service, [email['id'] for email in emails])
         
         return emails
     
     except Exception as e:
         logger.error(f"Error fetching unread emails: {e}")
         return []
+
+class HistoryExpiredError(Exception):
+    """The start history ID is too old for users.history.list (HTTP 404)."""
+
+def get_current_history_id(service) -> str:
+    """Get the mailbox's current history ID, the checkpoint for incremental sync."""
+    profile = service.users().getProfile(userId='me').execute()
+    return str(profile['historyId'])
+
+def get_history_message_ids(service, start_history_id: str, label_id: str = 'INBOX') -> Tuple[List[str], str]:
+    """
+    List messages added to the mailbox since a history checkpoint.
+    
+    Args:
+        service: Gmail API service
+        start_history_id: History ID stored after the previous sync
+        label_id: Only return messages added with this label
+        
+    Returns:
+        Tuple of (message_ids, latest_history_id), oldest message first
+        
+    Raises:
+        HistoryExpiredError: If the start history ID is no longer available
+    """
+    message_ids: List[str] = []
+    seen = set()
+    latest_history_id = start_history_id
+    page_token = None
+    
+    while True:
+        try:
+            response = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                labelId=label_id,
+                pageToken=page_token
+            ).execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryExpiredError(f"History ID {start_history_id} has expired") from e
+            raise
+        
+        for record in response.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message_id = added['message']['id']
+                if message_id not in seen:
+                    seen.add(message_id)
+                    message_ids.append(message_id)
+        
+        latest_history_id = str(response.get('historyId', latest_history_id))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    
+    return message_ids, latest_history_id
+
+def list_message_ids(service, max_results: int = 100, label_ids: Optional[List[str]] = None) -> List[str]:
+    """List up to max_results message IDs, newest first, following page tokens."""
+    message_ids: List[str] = []
+    page_token = None
+    while len(message_ids) < max_results:
+        response = service.users().messages().list(
+            userId='me',
+            maxResults=min(500, max_results - len(message_ids)),
+            labelIds=label_ids or ['INBOX'],
+            pageToken=page_token
+        ).execute()
+        message_ids.extend(msg['id'] for msg in response.get('messages', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    return message_ids
@@ -1,4 +1,4 @@
 def generate_embeddings(documents: list[str]) -> list[list[float]]:
-    from ollama_client import get_embedding
+    from ollama_client import get_embeddings
 
-    return [get_embedding(text) for text in documents]
+    return get_embeddings(documents)
@@ -1,7 +1,18 @@
-from typing import BinaryIO, Union
+import os
+from typing import BinaryIO, List, Union
 from PyPDF2 import PdfReader
 from PyPDF2.errors import PdfReadError
-from email import message_from_string
+from email import message_from_binary_file, policy
+
+from context_packer import count_tokens, split_sentences
+from email_mime import message_body
+
+# File types parse_file understands
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".eml")
+
+# Chunk size for embedding; all-MiniLM-L6-v2 truncates input past 256 word pieces
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "30"))
 
 def parse_pdf(file: Union[str, BinaryIO]) -> str:
     """
@@ -51,11 +62,86 @@ def parse_pdf(file: Union[str, BinaryIO]) -> str:
     except Exception as e:
         raise Exception(f"Failed to parse PDF: {str(e)}")
 
-def parse_eml(file_path):
-    with open(file_path, 'r') as f:
-        raw_email = f.read()
-    msg = message_from_string(raw_email)
-    return msg.get_payload(decode=True).decode(errors="ignore")
+def parse_eml(file_path: str) -> str:
+    """
+    Extract the headers and readable body of an .eml file.
+    
+    Multipart messages are walked for their text/plain part (or HTML converted
+    to text); quoted replies, signatures and boilerplate are stripped.
+    
+    Args:
+        file_path: Path to the .eml file
+        
+    Returns:
+        str: From/To/Subject/Date lines followed by the body
+    """
+    with open(file_path, 'rb') as f:
+        # The default policy decodes RFC 2047 encoded headers
+        msg = message_from_binary_file(f, policy=policy.default)
+    
+    headers = [f"{name}: {msg[name]}" for name in ('From', 'To', 'Subject', 'Date') if msg[name]]
+    body = message_body(msg)
+    return "\n".join(headers) + "\n\n" + body if headers else body
+
+def chunk_text(
+    text: str,
+    max_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> List[str]:
+    """
+    Split text into chunks of whole sentences that fit the embedding model.
+    
+    Consecutive chunks share up to overlap_tokens of trailing sentences so a
+    passage cut at a chunk boundary is still found by search.
+    
+    Args:
+        text: Text to split
+        max_tokens: Approximate maximum tokens per chunk
+        overlap_tokens: Approximate tokens repeated from the previous chunk
+        
+    Returns:
+        List of chunks, empty if the text is blank
+    """
+    # Sentences longer than a chunk are split on words
+    pieces = []
+    for sentence in split_sentences(text or ""):
+        if count_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words = []
+        used = 0
+        for word in sentence.split():
+            cost = count_tokens(word)
+            if words and used + cost > max_tokens:
+                pieces.append(" ".join(words))
+                words, used = [], 0
+            words.append(word)
+            used += cost
+        if words:
+            pieces.append(" ".join(words))
+    
+    chunks = []
+    current: List[str] = []
+    used = 0
+    for piece in pieces:
+        cost = count_tokens(piece)
+        if current and used + cost > max_tokens:
+            chunks.append(" ".join(current))
+            # Carry trailing sentences over as overlap
+            overlap: List[str] = []
+            overlap_used = 0
+            for previous in reversed(current):
+                previous_cost = count_tokens(previous)
+                if overlap_used + previous_cost > overlap_tokens or overlap_used + previous_cost + cost > max_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_used += previous_cost
+            current, used = overlap, overlap_used
+        current.append(piece)
+        used += cost
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
 
 def parse_file(file_path: str) -> list[str]:
     """
@@ -84,7 +170,21 @@ def parse_file(file_path: str) -> list[str]:
             return [parse_eml(file_path)]
             
         else:
-            raise ValueError(f"Unsupported file type: {file_path.split('.')[-1]}. Supported types: .txt, .pdf, .eml")
+            raise ValueError(f"Unsupported file type: {file_path.split('.')[-1]}. Supported types: {', '.join(SUPPORTED_EXTENSIONS)}")
             
     except Exception as e:
         raise ValueError(f"Failed to parse file {file_path}: {str(e)}")
+
+def parse_and_chunk(file_path: str) -> List[str]:
+    """
+    Parse a file and split its pages into embedding-sized chunks.
+    
+    Top-level so it can run in a worker process.
+    
+    Raises:
+        ValueError: If the file type is not supported or the file cannot be parsed
+    """
+    chunks = []
+    for page in parse_file(file_path):
+        chunks.extend(chunk_text(page))
+    return chunks
@@ -0,0 +1,126 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+logger = logging.getLogger(__name__)
+
+# Refresh access tokens this long before they expire
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class GoogleClientCache:
+    """
+    Per-account cache of Google credentials and built API service objects.
+
+    Credentials are loaded from storage once and kept in memory; they are
+    refreshed (and saved back) shortly before expiry instead of after a
+    request fails. Service objects are built from the discovery document
+    bundled with google-api-python-client (no discovery fetch) and reused.
+    googleapiclient services are not thread-safe, so each thread gets its
+    own service objects, all sharing the account's credentials.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Optional[Credentials]],
+        saver: Optional[Callable[[str, Credentials], None]] = None,
+        refresh_margin: timedelta = TOKEN_REFRESH_MARGIN
+    ):
+        """
+        Args:
+            loader: Loads an account's stored credentials (None if missing)
+            saver: Persists credentials after a refresh
+            refresh_margin: How long before expiry tokens are refreshed
+        """
+        self.loader = loader
+        self.saver = saver
+        self.refresh_margin = refresh_margin
+        self._credentials: Dict[str, Credentials] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _account_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _needs_refresh(self, creds: Credentials) -> bool:
+        if not creds.refresh_token:
+            return False
+        if not creds.token or not creds.expiry:
+            return not creds.valid
+        # google-auth stores expiry as a naive UTC datetime
+        return creds.expiry - datetime.utcnow() <= self.refresh_margin
+
+    def get_credentials(self, key: str) -> Optional[Credentials]:
+        """
+        Get an account's credentials, refreshing them if they expire soon.
+
+        Returns:
+            The cached credentials, or None if the account has none stored
+
+        Raises:
+            google.auth.exceptions.RefreshError: If the refresh fails
+        """
+        with self._account_lock(key):
+            creds = self._credentials.get(key)
+            if creds is None:
+                creds = self.loader(key)
+                if creds is None:
+                    return None
+                self._credentials[key] = creds
+
+            if self._needs_refresh(creds):
+                logger.info(f"Refreshing access token for {key}")
+                creds.refresh(Request())
+                if self.saver:
+                    self.saver(key, creds)
+            return creds
+
+    def get_service(
+        self,
+        key: str,
+        api: str,
+        version: str,
+        client_options: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Get a built API service for an account, cached per thread.
+
+        Returns:
+            The service object, or None if the account has no credentials
+        """
+        creds = self.get_credentials(key)
+        if creds is None:
+            return None
+
+        services = getattr(self._local, 'services', None)
+        if services is None:
+            services = self._local.services = {}
+
+        cache_key: Tuple = (key, api, version, repr(client_options))
+        cached = services.get(cache_key)
+        # Rebuild if the account's credentials were invalidated and reloaded
+        if cached is not None and cached[0] is creds:
+            return cached[1]
+
+        service = build(
+            api,
+            version,
+            credentials=creds,
+            client_options=client_options,
+            static_discovery=True,
+            cache_discovery=False
+        )
+        services[cache_key] = (creds, service)
+        return service
+
+    def invalidate(self, key: str) -> None:
+        """Forget an account's credentials, e.g. after re-authentication or disconnect."""
+        with self._account_lock(key):
+            self._credentials.pop(key, None)
@@ -2,12 +2,13 @@ import os
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from urllib.parse import urlparse, parse_qs
 import pickle
 from typing import Dict, Tuple, List
 import logging
 
+from google_clients import GoogleClientCache
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,6 +19,10 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.metadata.readonly'
 ]
 
+def _save_pickle(creds: Credentials) -> None:
+    with open('token.pickle', 'wb') as token:
+        pickle.dump(creds, token)
+
 def get_credentials():
     """Get valid user credentials from storage or prompt for login."""
     creds = None
@@ -38,11 +43,16 @@ def get_credentials():
             )
             creds = flow.run_local_server(port=8080)
         # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+        _save_pickle(creds)
     
     return creds
 
+# Docs/Drive clients and the token.pickle credentials, loaded once per process
+docs_clients = GoogleClientCache(
+    loader=lambda _: get_credentials(),
+    saver=lambda _, creds: _save_pickle(creds)
+)
+
 def extract_document_id(url: str) -> str:
     """Extract document ID from Google Docs URL."""
     try:
@@ -75,11 +85,10 @@ def get_document_content(doc_id: str) -> Tuple[str, str]:
         Tuple of (title, content)
     """
     try:
-        creds = get_credentials()
-        service = build('docs', 'v1', credentials=creds)
+        service = docs_clients.get_service('default', 'docs', 'v1')
         
         # Get document metadata to get the title
-        drive_service = build('drive', 'v3', credentials=creds)
+        drive_service = docs_clients.get_service('default', 'drive', 'v3')
         file_metadata = drive_service.files().get(fileId=doc_id, fields='name').execute()
         title = file_metadata.get('name', 'Untitled Document')
         
@@ -0,0 +1,372 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chroma_client import add_many_to_chroma
+from email_index import email_index
+from email_ingestion import build_email_document
+from email_utils import GMAIL_BATCH_SIZE, get_gmail_service, fetch_messages, is_not_found, parse_email
+from embedding import generate_embeddings
+from near_duplicates import near_duplicate_index
+
+logger = logging.getLogger(__name__)
+
+# Workers per stage; fetching is I/O bound, parsing is cheap CPU work
+PIPELINE_FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", "4"))
+PIPELINE_PARSE_WORKERS = int(os.getenv("PIPELINE_PARSE_WORKERS", "2"))
+
+# Documents embedded (and then written) together
+PIPELINE_EMBED_BATCH_SIZE = int(os.getenv("PIPELINE_EMBED_BATCH_SIZE", "64"))
+
+# Items buffered between stages before upstream workers block
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "256"))
+
+# Sentinel telling a stage worker to exit
+_STOP = object()
+
+
+class PipelineResult:
+    """
+    Outcome of a submitted group of message ids.
+
+    Every id that is not in ``failed`` was written, skipped as already
+    processed or a near-duplicate, or is ``gone`` (deleted from the mailbox).
+    Failed ids (fetch errors such as 429s and 5xx, unparseable messages)
+    were not indexed and should be retried.
+    """
+
+    def __init__(self):
+        self.written = 0
+        self.failed: List[str] = []
+        self.gone: List[str] = []
+
+    @property
+    def complete(self) -> bool:
+        """Whether no id needs to be retried."""
+        return not self.failed
+
+    def __repr__(self) -> str:
+        return f"PipelineResult(written={self.written}, failed={len(self.failed)}, gone={len(self.gone)})"
+
+
+class _Job:
+    """A submitted group of message ids; its future resolves once every id has left the pipeline."""
+
+    def __init__(self, ingestion, pending: int):
+        self.ingestion = ingestion
+        self.future: Future = Future()
+        self.pending = pending
+        self.result = PipelineResult()
+        self._lock = threading.Lock()
+        if pending == 0:
+            self.future.set_result(self.result)
+
+    def resolve(
+        self,
+        count: int,
+        written: int = 0,
+        failed: Tuple[str, ...] = (),
+        gone: Tuple[str, ...] = ()
+    ) -> None:
+        with self._lock:
+            if self.future.done():
+                return
+            self.pending -= count
+            self.result.written += written
+            self.result.failed.extend(failed)
+            self.result.gone.extend(gone)
+            if self.pending <= 0:
+                self.future.set_result(self.result)
+
+    def fail(self, error: Exception) -> None:
+        with self._lock:
+            if not self.future.done():
+                self.future.set_exception(error)
+
+
+class StageMetrics:
+    """Counters for one pipeline stage."""
+
+    def __init__(self, name: str, workers: int, input_queue: "queue.Queue"):
+        self.name = name
+        self.workers = workers
+        self.input_queue = input_queue
+        self.items = 0
+        self.batches = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self.items += items
+            self.batches += 1
+            self.busy_seconds += seconds
+            if error:
+                self.errors += 1
+
+    def snapshot(self, elapsed: float) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "items": self.items,
+                "batches": self.batches,
+                "errors": self.errors,
+                "items_per_second": round(self.items / elapsed, 2) if elapsed > 0 else None,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "queue_depth": self.input_queue.qsize(),
+                "queue_capacity": self.input_queue.maxsize,
+            }
+
+
+class EmailPipeline:
+    """
+    Staged producer/consumer pipeline that indexes Gmail messages.
+
+    Message ids flow through four stages connected by bounded queues:
+    fetch (Gmail batch requests, several workers with their own API client),
+    parse (MIME decoding and document assembly), embed (one worker encoding
+    whole batches) and write (bulk Chroma upsert plus the email index). When
+    a downstream stage falls behind its input queue fills up and the stages
+    feeding it block, so fast fetchers cannot buffer unbounded mail.
+
+    One long-lived pipeline is shared by every account: each submitted job
+    carries its account's EmailIngestionService, so the worker count and
+    the number of concurrent encodes stay bounded however many sync passes
+    and backfills run, and the per-thread Gmail clients are reused.
+
+    ``submit`` returns a future per group of ids that resolves to a
+    PipelineResult, which lets callers such as the backfill checkpoint
+    completed pages while later ones are still in flight, and retry the ids
+    that failed.
+    """
+
+    def __init__(
+        self,
+        fetch_workers: int = PIPELINE_FETCH_WORKERS,
+        parse_workers: int = PIPELINE_PARSE_WORKERS,
+        embed_batch_size: int = PIPELINE_EMBED_BATCH_SIZE,
+        queue_size: int = PIPELINE_QUEUE_SIZE
+    ):
+        """
+        Args:
+            fetch_workers: Concurrent Gmail fetch workers
+            parse_workers: Parse/normalize workers
+            embed_batch_size: Documents embedded and written per batch
+            queue_size: Capacity of the queues between stages, in messages
+        """
+        self.embed_batch_size = embed_batch_size
+        self._threads: List[threading.Thread] = []
+        self._started: Optional[float] = None
+        self._start_lock = threading.Lock()
+
+        # The fetch queue holds id batches, so size it in batches
+        fetch_size = max(1, min(GMAIL_BATCH_SIZE, 100))
+        self._fetch_queue: "queue.Queue" = queue.Queue(maxsize=max(queue_size // fetch_size, fetch_workers))
+        self._parse_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._embed_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._write_queue: "queue.Queue" = queue.Queue(maxsize=max(queue_size // embed_batch_size, 2))
+
+        self.stages = {
+            "fetch": StageMetrics("fetch", fetch_workers, self._fetch_queue),
+            "parse": StageMetrics("parse", parse_workers, self._parse_queue),
+            "embed": StageMetrics("embed", 1, self._embed_queue),
+            "write": StageMetrics("write", 1, self._write_queue),
+        }
+
+    def __enter__(self) -> "EmailPipeline":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _spawn(self, target: Callable, count: int, name: str) -> None:
+        for i in range(count):
+            thread = threading.Thread(target=target, name=f"pipeline-{name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def start(self) -> None:
+        """Start the stage workers (daemon threads) unless they are running."""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._started = time.monotonic()
+            self._spawn(self._fetch_worker, self.stages["fetch"].workers, "fetch")
+            self._spawn(self._parse_worker, self.stages["parse"].workers, "parse")
+            self._spawn(self._embed_worker, 1, "embed")
+            self._spawn(self._write_worker, 1, "write")
+
+    def close(self) -> None:
+        """Drain everything submitted so far and stop the workers."""
+        stage_queues = [
+            ("fetch", self._fetch_queue),
+            ("parse", self._parse_queue),
+            ("embed", self._embed_queue),
+            ("write", self._write_queue),
+        ]
+        # Stop stages front to back so each one drains before its consumers exit
+        for name, stage_queue in stage_queues:
+            workers = [t for t in self._threads if t.name.startswith(f"pipeline-{name}-")]
+            for _ in workers:
+                stage_queue.put(_STOP)
+            for thread in workers:
+                thread.join()
+        self._threads = []
+        logger.info(f"Pipeline finished: {self.metrics()}")
+
+    def submit(self, ingestion, message_ids: List[str]) -> Future:
+        """
+        Queue an account's messages for indexing, blocking while the fetch queue is full.
+
+        Starts the workers if needed. Ids that were already processed are
+        skipped; the caller flushes the processed-id store once the job is done.
+
+        Args:
+            ingestion: The account's EmailIngestionService; supplies the
+                account, the Gmail batch size and the processed-id checks
+            message_ids: Gmail message ids to index
+
+        Returns:
+            Future resolving to a PipelineResult
+        """
+        self.start()
+        new_ids = [message_id for message_id in message_ids if not ingestion.is_processed(message_id)]
+        job = _Job(ingestion, len(new_ids))
+        fetch_size = max(1, min(ingestion.batch_size, 100))
+        for start in range(0, len(new_ids), fetch_size):
+            self._fetch_queue.put((job, new_ids[start:start + fetch_size]))
+        return job.future
+
+    def run(self, ingestion, message_ids: List[str]) -> PipelineResult:
+        """Index an account's messages and wait for them."""
+        return self.submit(ingestion, message_ids).result()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Per-stage throughput and queue depth."""
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        return {name: stage.snapshot(elapsed) for name, stage in self.stages.items()}
+
+    def _fetch_worker(self) -> None:
+        stage = self.stages["fetch"]
+        while True:
+            item = self._fetch_queue.get()
+            if item is _STOP:
+                return
+            job, ids = item
+            email = job.ingestion.email
+            started = time.monotonic()
+            try:
+                # Cached per thread and account: googleapiclient services are not thread-safe
+                service = get_gmail_service(email)
+                errors: Dict[str, Exception] = {}
+                messages = fetch_messages(service, ids, batch_size=len(ids), errors=errors)
+                stage.record(len(messages), time.monotonic() - started)
+                # Messages that failed to fetch leave the pipeline here; deleted
+                # ones are done, the rest are reported for a retry
+                gone = tuple(i for i, error in errors.items() if is_not_found(error))
+                failed = tuple(i for i, error in errors.items() if not is_not_found(error))
+                job.resolve(len(ids) - len(messages), failed=failed, gone=gone)
+                for message in messages:
+                    self._parse_queue.put((job, message))
+            except Exception as e:
+                stage.record(0, time.monotonic() - started, error=True)
+                logger.error(f"[{email}] Pipeline fetch failed: {e}")
+                job.fail(e)
+
+    def _parse_worker(self) -> None:
+        stage = self.stages["parse"]
+        while True:
+            item = self._parse_queue.get()
+            if item is _STOP:
+                return
+            job, message = item
+            ingestion = job.ingestion
+            started = time.monotonic()
+            try:
+                email = parse_email(message)
+                document = build_email_document(email, ingestion.email)
+                ingestion.queue_attachments(email)
+                stage.record(1, time.monotonic() - started)
+                if ingestion.skip_near_duplicate(email, *document):
+                    job.resolve(1)
+                    continue
+                # The body travels along so the write stage can register its fingerprint
+                self._embed_queue.put((job, document, email.get('body', '')))
+            except Exception as e:
+                stage.record(0, time.monotonic() - started, error=True)
+                logger.error(f"[{ingestion.email}] Pipeline failed to parse message {message.get('id')}: {e}")
+                job.resolve(1, failed=(message.get('id'),))
+
+    def _take_batch(self, stage_queue: "queue.Queue", size: int) -> Tuple[List[Any], bool]:
+        """Block for one item, then take whatever else is queued up to ``size``."""
+        items = []
+        stopped = False
+        item = stage_queue.get()
+        while True:
+            if item is _STOP:
+                stopped = True
+                break
+            items.append(item)
+            if len(items) >= size:
+                break
+            try:
+                item = stage_queue.get_nowait()
+            except queue.Empty:
+                break
+        return items, stopped
+
+    def _embed_worker(self) -> None:
+        stage = self.stages["embed"]
+        while True:
+            items, stopped = self._take_batch(self._embed_queue, self.embed_batch_size)
+            if items:
+                started = time.monotonic()
+                try:
+                    embeddings = generate_embeddings([content for _, (_, content, _), _ in items])
+                    stage.record(len(items), time.monotonic() - started)
+                    self._write_queue.put(list(zip(items, embeddings)))
+                except Exception as e:
+                    stage.record(0, time.monotonic() - started, error=True)
+                    logger.error(f"Pipeline embedding failed: {e}")
+                    for job, _, _ in items:
+                        job.fail(e)
+            if stopped:
+                return
+
+    def _write_worker(self) -> None:
+        stage = self.stages["write"]
+        while True:
+            batch = self._write_queue.get()
+            if batch is _STOP:
+                return
+            started = time.monotonic()
+            try:
+                doc_ids = [doc_id for (_, (doc_id, _, _), _), _ in batch]
+                contents = [content for (_, (_, content, _), _), _ in batch]
+                metadatas = [metadata for (_, (_, _, metadata), _), _ in batch]
+                embeddings = [embedding for _, embedding in batch]
+
+                add_many_to_chroma(doc_ids, contents, metadatas, embeddings)
+                email_index.upsert_many(zip(doc_ids, metadatas))
+                stage.record(len(batch), time.monotonic() - started)
+
+                # A batch can hold several accounts' messages
+                for (job, (doc_id, _, metadata), body), _ in batch:
+                    near_duplicate_index.register(doc_id, body, 'gmail', job.ingestion.email)
+                    job.ingestion.mark_processed(metadata['email_id'])
+                    job.resolve(1, written=1)
+            except Exception as e:
+                stage.record(0, time.monotonic() - started, error=True)
+                logger.error(f"Pipeline write failed: {e}")
+                for (job, _, _), _ in batch:
+                    job.fail(e)
+
+
+# Pipeline shared by live sync, body passes and backfills of every account
+email_pipeline = EmailPipeline()
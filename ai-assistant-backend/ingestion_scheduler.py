@@ -0,0 +1,241 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from email_ingestion import EmailIngestionService
+
+logger = logging.getLogger(__name__)
+
+# Sync passes that may run at the same time across all accounts
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", "4"))
+
+# Fraction of the poll interval added or removed at random from each run,
+# so accounts connected together do not keep polling in lockstep
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.2"))
+
+# Sync passes allowed per minute across all accounts, and per account
+SCHEDULER_GLOBAL_RATE = float(os.getenv("SCHEDULER_GLOBAL_RATE", "30"))
+SCHEDULER_ACCOUNT_RATE = float(os.getenv("SCHEDULER_ACCOUNT_RATE", "2"))
+
+# Accounts that received mail within this many seconds are served first
+SCHEDULER_ACTIVE_WINDOW = int(os.getenv("SCHEDULER_ACTIVE_WINDOW", "3600"))
+
+# Delay before retrying an account whose last sync failed
+SCHEDULER_RETRY_DELAY = 60
+
+# Longest the dispatcher sleeps before re-checking for due accounts
+SCHEDULER_TICK = 1.0
+
+
+class RateBudget:
+    """Token bucket allowing ``rate_per_minute`` operations with bursts of ``burst``."""
+
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst if burst is not None else max(rate_per_minute, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Take one token if available."""
+        self._refill(time.monotonic())
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until a token becomes available."""
+        self._refill(time.monotonic())
+        if self._tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class AccountSchedule:
+    """Scheduling state of one account."""
+
+    def __init__(self, service: EmailIngestionService, first_run: float):
+        self.service = service
+        self.budget = RateBudget(SCHEDULER_ACCOUNT_RATE)
+        self.next_run = first_run
+        self.queued = False
+        self.running = False
+        self.last_run_at: Optional[str] = None
+        self.last_duration: Optional[float] = None
+        self.last_lag: Optional[float] = None
+        self.last_new_emails = 0
+        self.last_activity: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failures = 0
+
+    def is_active(self, now: float) -> bool:
+        return self.last_activity is not None and now - self.last_activity < SCHEDULER_ACTIVE_WINDOW
+
+
+class IngestionScheduler:
+    """
+    Runs periodic sync passes for every connected account from one event loop.
+
+    Instead of one sleeping thread per account, a dispatcher coroutine
+    enqueues accounts as they come due and a fixed set of workers runs the
+    blocking Gmail calls in a bounded thread pool. Each account's next run is
+    jittered around its poll interval, a global and a per-account token
+    bucket cap how many passes start per minute, and accounts that received
+    mail recently are served first when the budget is contended.
+    """
+
+    def __init__(self, max_workers: int = SCHEDULER_MAX_WORKERS):
+        self.max_workers = max_workers
+        self.global_budget = RateBudget(SCHEDULER_GLOBAL_RATE)
+        self._accounts: Dict[str, AccountSchedule] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._sequence = itertools.count()
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - SCHEDULER_JITTER, 1 + SCHEDULER_JITTER)
+
+    def add_account(self, service: EmailIngestionService) -> None:
+        """Start scheduling sync passes for an account's ingestion service."""
+        if service.email in self._accounts:
+            return
+        # Spread first runs over a short window instead of polling all at once
+        first_run = time.monotonic() + random.uniform(0, min(service.poll_interval, 30))
+        self._accounts[service.email] = AccountSchedule(service, first_run)
+        logger.info(f"Scheduled email ingestion for {service.email}")
+
+    def remove_account(self, email: str) -> None:
+        """Stop scheduling an account; a pass already running is allowed to finish."""
+        self._accounts.pop(email, None)
+
+    def run_now(self, email: str) -> bool:
+        """Make an account due immediately, still subject to its rate budget."""
+        account = self._accounts.get(email)
+        if not account:
+            return False
+        account.next_run = time.monotonic()
+        return True
+
+    def start(self) -> None:
+        """Start the dispatcher and workers on the running event loop."""
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingestion")
+        self._tasks = [asyncio.create_task(self._dispatch())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        logger.info(f"Ingestion scheduler started with {self.max_workers} workers")
+
+    async def stop(self) -> None:
+        """Cancel scheduling and wait for running passes to finish."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for account in self._accounts.values():
+            account.service.stop()
+        if self._executor:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+            self._executor = None
+
+    async def _dispatch(self) -> None:
+        while True:
+            now = time.monotonic()
+            due = [
+                (email, account) for email, account in self._accounts.items()
+                if not account.queued and not account.running and account.next_run <= now
+            ]
+            # Recently active accounts first, then the most overdue
+            due.sort(key=lambda item: (not item[1].is_active(now), item[1].next_run))
+
+            for email, account in due:
+                if self.global_budget.wait_time() > 0:
+                    break
+                if not account.budget.try_acquire():
+                    account.next_run = now + account.budget.wait_time()
+                    continue
+                self.global_budget.try_acquire()
+                account.queued = True
+                priority = 0 if account.is_active(now) else 1
+                self._queue.put_nowait((priority, account.next_run, next(self._sequence), email))
+
+            pending = [a.next_run for a in self._accounts.values() if not a.queued and not a.running]
+            sleep_for = SCHEDULER_TICK
+            if pending:
+                sleep_for = min(max(min(pending) - time.monotonic(), 0.05), SCHEDULER_TICK)
+            await asyncio.sleep(sleep_for)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, _, email = await self._queue.get()
+            try:
+                account = self._accounts.get(email)
+                if account is None:
+                    continue
+                account.queued = False
+                account.running = True
+                started = time.monotonic()
+                account.last_lag = max(started - account.next_run, 0.0)
+                account.last_run_at = datetime.utcnow().isoformat()
+                try:
+                    new_emails = await loop.run_in_executor(self._executor, account.service.run_once)
+                    account.last_new_emails = new_emails
+                    account.last_error = None
+                    account.failures = 0
+                    if new_emails:
+                        account.last_activity = time.monotonic()
+                    account.next_run = time.monotonic() + self._jittered(account.service.poll_interval)
+                except Exception as e:
+                    logger.error(f"[{email}] Scheduled sync failed: {e}")
+                    account.last_error = str(e)
+                    account.failures += 1
+                    account.next_run = time.monotonic() + self._jittered(SCHEDULER_RETRY_DELAY)
+                finally:
+                    account.running = False
+                    account.last_duration = round(time.monotonic() - started, 3)
+            finally:
+                self._queue.task_done()
+
+    def account_status(self, email: str) -> Optional[Dict[str, Any]]:
+        """Scheduling state of one account, or None if it is not scheduled."""
+        account = self._accounts.get(email)
+        if account is None:
+            return None
+        now = time.monotonic()
+        waiting = not account.running
+        return {
+            "email": email,
+            "poll_interval": account.service.poll_interval,
+            "state": "running" if account.running else "queued" if account.queued else "scheduled",
+            "next_run_in": round(max(account.next_run - now, 0.0), 1) if waiting else None,
+            "lag_seconds": round(max(now - account.next_run, 0.0), 1) if waiting else 0.0,
+            "last_lag_seconds": round(account.last_lag, 1) if account.last_lag is not None else None,
+            "last_run_at": account.last_run_at,
+            "last_duration": account.last_duration,
+            "last_new_emails": account.last_new_emails,
+            "recently_active": account.is_active(now),
+            "last_error": account.last_error,
+            "consecutive_failures": account.failures,
+        }
+
+    def status(self) -> Dict[str, Any]:
+        """Scheduler-wide state with per-account next run and lag."""
+        return {
+            "running": bool(self._tasks),
+            "max_workers": self.max_workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "accounts": [self.account_status(email) for email in list(self._accounts)],
+        }
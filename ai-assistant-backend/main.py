@@ -4,10 +4,16 @@ from routes.upload import router as upload_router
 from routes.query import router as query_router
 from routes.delete import router as delete_router
 from routes.emails import router as email_router
+from routes.emails import (
+    resume_interrupted_backfills,
+    start_ingestion_scheduler,
+    stop_ingestion_scheduler
+)
 from routes.email_search import router as email_search_router
 from routes.debug_chroma import router as debug_chroma_router
 from routes import google_docs
 from routes.slack import router as slack_router
+from routes.slack import start_slack_workers, stop_slack_workers
 from routes.chat import init_chat_routes
 from routes.activity import router as activity_router
 from mongodb import client as mongodb_client, test_connection
@@ -39,10 +45,10 @@ app.add_middleware(
 
 # Include routers
 app.include_router(upload_router, prefix="")  # Handles /upload
-app.include_router(query_router, prefix="/api")  # Handles /api/search and /api/documents
+app.include_router(query_router, prefix="/api")  # Handles /api/search, /api/search/batch and /api/documents
 app.include_router(delete_router, prefix="/api")  # Handles /api/documents/{document_id}
 app.include_router(email_router, prefix="/api")  # Handles /api/emails/*
-app.include_router(email_search_router, prefix="/api")  # Handles /api/search/emails
+app.include_router(email_search_router, prefix="/api")  # Handles /api/search/emails and /api/emails/{email_id}
 app.include_router(debug_chroma_router, prefix="/api")  # Handles /api/debug/chroma/*
 app.include_router(google_docs.router, prefix="")  # Handles /api/google-docs/import and /api/google-docs/list
 app.include_router(slack_router, prefix="/api")  # Handles /api/slack/*
@@ -82,3 +88,18 @@ async def startup_db_client():
     # Create upload directories if they don't exist
     os.makedirs("uploaded_docs", exist_ok=True)
     os.makedirs("uploads", exist_ok=True)
+    
+    # Poll every connected account from the shared ingestion scheduler
+    start_ingestion_scheduler()
+    
+    # Pick up mailbox backfills interrupted by the last shutdown
+    resume_interrupted_backfills()
+    
+    # Process queued Slack events
+    start_slack_workers()
+
+
+@app.on_event("shutdown")
+async def shutdown_ingestion():
+    await stop_ingestion_scheduler()
+    await stop_slack_workers()
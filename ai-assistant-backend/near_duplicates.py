@@ -0,0 +1,287 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUP_INDEX_PATH = "./near_duplicates.db"
+
+# Skip storing texts whose fingerprint is this close to an indexed one
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() in ("1", "true", "yes")
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "3"))
+
+# Shorter texts collide too easily to be judged near-duplicates
+NEAR_DUP_MIN_WORDS = 30
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+
+# A 64-bit fingerprint is split into 4 bands of 16 bits. Two fingerprints
+# within 3 bits of each other must agree on at least one band, so looking up
+# the 4 bands finds every candidate within NEAR_DUP_MAX_DISTANCE <= 3.
+_BANDS = 4
+_BAND_BITS = SIMHASH_BITS // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# Largest distance the banding is guaranteed to find
+MAX_RECALL_DISTANCE = _BANDS - 1
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def simhash(text: str) -> Optional[int]:
+    """
+    64-bit SimHash of a text over word 3-shingles, or None if it is too short.
+
+    Near-identical texts (a changed date, name or tracking link) get
+    fingerprints that differ in only a few bits.
+    """
+    words = _WORD_PATTERN.findall((text or "").lower())
+    if len(words) < NEAR_DUP_MIN_WORDS:
+        return None
+    shingles = Counter(" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+    weights = [0] * SIMHASH_BITS
+    for shingle, count in shingles.items():
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if h >> bit & 1 else -count
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def _bands(fingerprint: int) -> List[int]:
+    return [(fingerprint >> (i * _BAND_BITS)) & _BAND_MASK for i in range(_BANDS)]
+
+
+class NearDuplicateIndex:
+    """
+    Local SimHash index of everything stored in the vector collection.
+
+    Each stored text is registered with its fingerprint, banded for LSH
+    lookups, under its source and account: items are only ever matched
+    against texts of the same source and account. Before embedding, ingestion asks whether a near-identical text
+    is already stored; if so the new item is recorded as a link to that
+    canonical document instead of being embedded and stored again. Texts
+    are only registered once they have been written, so a failed write
+    never leaves a canonical entry with nothing stored behind it.
+
+    A linked item keeps the documents it would have written (ids, texts and
+    metadata), so deleting its canonical document can restore it instead of
+    losing its content.
+    """
+
+    def __init__(self, path: str = NEAR_DUP_INDEX_PATH, max_distance: int = NEAR_DUP_MAX_DISTANCE):
+        self.path = path
+        if not 0 <= max_distance <= MAX_RECALL_DISTANCE:
+            logger.warning(
+                f"NEAR_DUP_MAX_DISTANCE={max_distance} is outside 0..{MAX_RECALL_DISTANCE}, "
+                f"the range the fingerprint bands can find; clamping"
+            )
+            max_distance = min(max(max_distance, 0), MAX_RECALL_DISTANCE)
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        band_columns = ", ".join(f"band{i} INTEGER NOT NULL" for i in range(_BANDS))
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    doc_id TEXT PRIMARY KEY,
+                    source TEXT,
+                    account TEXT NOT NULL DEFAULT '',
+                    simhash INTEGER NOT NULL,
+                    {band_columns},
+                    created_at REAL
+                )
+            """)
+            for i in range(_BANDS):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_fingerprints_band{i} ON fingerprints(band{i})")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS duplicates (
+                    doc_id TEXT PRIMARY KEY,
+                    canonical_id TEXT NOT NULL,
+                    source TEXT,
+                    account TEXT NOT NULL DEFAULT '',
+                    distance INTEGER,
+                    simhash INTEGER,
+                    entry TEXT,
+                    created_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_canonical ON duplicates(canonical_id)")
+
+    def _find(self, doc_id: str, fingerprint: int, source: str, account: str) -> Optional[Tuple[str, int]]:
+        bands = _bands(fingerprint)
+        where = " OR ".join(f"band{i} = ?" for i in range(_BANDS))
+        rows = self._conn.execute(
+            f"SELECT doc_id, simhash FROM fingerprints WHERE source = ? AND account = ? AND ({where})",
+            (source, account, *bands)
+        ).fetchall()
+        best = None
+        for candidate_id, candidate in rows:
+            if candidate_id == doc_id:
+                continue  # Re-ingesting the same document is not a duplicate
+            distance = bin(fingerprint ^ _to_unsigned(candidate)).count("1")
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (candidate_id, distance)
+        return best
+
+    def _register(self, doc_id: str, fingerprint: int, source: str, account: str) -> None:
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, {', '.join('?' * _BANDS)}, ?)",
+            (doc_id, source, account, _to_signed(fingerprint), *_bands(fingerprint), time.time())
+        )
+
+    def _link(self, doc_id: str, fingerprint: int, source: str, account: str,
+              entry: Optional[Dict[str, Any]]) -> Optional[str]:
+        match = self._find(doc_id, fingerprint, source, account)
+        if not match:
+            return None
+        canonical_id, distance = match
+        self._conn.execute(
+            "INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (doc_id, canonical_id, source, account, distance, _to_signed(fingerprint),
+             json.dumps(entry) if entry is not None else None, time.time())
+        )
+        logger.info(f"{doc_id} is a near-duplicate of {canonical_id} (distance {distance})")
+        return canonical_id
+
+    def check(self, doc_id: str, text: str, source: str, account: str = "",
+              entry: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Look up a text before storing it.
+
+        If a near-duplicate is already indexed, the item is linked to it and
+        its id is returned. Otherwise call ``register`` once the item has
+        been stored.
+
+        Args:
+            doc_id: Id the item would be stored under
+            text: The text that would be embedded
+            source: Ingestion source, e.g. "gmail", "upload" or "slack"
+            account: Mail account the item belongs to; empty for other sources
+            entry: What the item would have written to the collection, as
+                {"ids": [...], "documents": [...], "metadatas": [...]}; kept
+                with the link so the item can be restored later
+
+        Returns:
+            The canonical document id if this is a near-duplicate, else None
+        """
+        if not NEAR_DUP_ENABLED:
+            return None
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+
+        with self._lock, self._conn:
+            return self._link(doc_id, fingerprint, source, account, entry)
+
+    def register(self, doc_id: str, text: str, source: str, account: str = "") -> None:
+        """Register a stored text as canonical, after it was written to the collection."""
+        if not NEAR_DUP_ENABLED:
+            return
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return
+        with self._lock, self._conn:
+            self._register(doc_id, fingerprint, source, account)
+
+    def canonical_of(self, doc_id: str) -> Optional[str]:
+        """The canonical document a skipped near-duplicate was linked to."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT canonical_id FROM duplicates WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def duplicates_of(self, canonical_id: str) -> List[str]:
+        """Ids of the near-duplicates linked to a canonical document."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id FROM duplicates WHERE canonical_id = ?", (canonical_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def linked(self, source: str) -> List[Dict[str, Any]]:
+        """Linked near-duplicates of a source, with the entries they would have written."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, canonical_id, entry FROM duplicates WHERE source = ?", (source,)
+            ).fetchall()
+        return [
+            {"doc_id": doc_id, "canonical_id": canonical_id, "entry": json.loads(entry) if entry else None}
+            for doc_id, canonical_id, entry in rows
+        ]
+
+    def remove(self, doc_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Forget deleted documents so they are no longer used as canonical entries.
+
+        Near-duplicates linked to a removed document lose their canonical
+        copy; their links are dropped and they are returned so the caller
+        can store them (see ``relink`` and ``restore``).
+
+        Returns:
+            The orphaned near-duplicates: doc_id, source, account, simhash and entry
+        """
+        removed = set(doc_ids)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM fingerprints WHERE doc_id = ?", [(d,) for d in removed])
+            self._conn.executemany("DELETE FROM duplicates WHERE doc_id = ?", [(d,) for d in removed])
+            orphans = []
+            for canonical_id in removed:
+                rows = self._conn.execute(
+                    "SELECT doc_id, source, account, simhash, entry FROM duplicates WHERE canonical_id = ?",
+                    (canonical_id,)
+                ).fetchall()
+                for doc_id, source, account, fingerprint, entry in rows:
+                    orphans.append({
+                        "doc_id": doc_id,
+                        "source": source,
+                        "account": account,
+                        "simhash": _to_unsigned(fingerprint) if fingerprint is not None else None,
+                        "entry": json.loads(entry) if entry else None,
+                    })
+                self._conn.execute("DELETE FROM duplicates WHERE canonical_id = ?", (canonical_id,))
+        return orphans
+
+    def relink(self, orphan: Dict[str, Any]) -> Optional[str]:
+        """Link an orphaned near-duplicate to another stored copy, if one is left."""
+        if orphan["simhash"] is None:
+            return None
+        with self._lock, self._conn:
+            return self._link(
+                orphan["doc_id"], orphan["simhash"], orphan["source"], orphan["account"], orphan["entry"]
+            )
+
+    def restore(self, orphan: Dict[str, Any]) -> None:
+        """Register an orphaned near-duplicate as canonical once its entry has been stored."""
+        if orphan["simhash"] is None:
+            return
+        with self._lock, self._conn:
+            self._register(orphan["doc_id"], orphan["simhash"], orphan["source"], orphan["account"])
+
+
+# Shared index consulted by email, upload and Slack ingestion
+near_duplicate_index = NearDuplicateIndex()
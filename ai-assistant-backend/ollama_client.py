@@ -14,3 +14,19 @@ def get_embedding(text: str) -> list[float]:
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return [0.0] * 384
+
+
+def get_embeddings(texts: list[str], batch_size: int = 32) -> list[list[float]]:
+    """Embed several texts with a single batched encode call.
+
+    Errors are raised rather than replaced with zero vectors, so ingestion
+    never stores placeholder embeddings; query routes report them as a 500.
+    """
+    if not texts:
+        return []
+    try:
+        print(f"Generating embeddings for {len(texts)} texts")
+        return model.encode(texts, batch_size=batch_size, convert_to_numpy=True).tolist()
+    except Exception as e:
+        print(f"Error generating embeddings: {e}")
+        raise
@@ -0,0 +1,30 @@
+import base64
+import json
+from typing import Any, Optional
+
+from fastapi import HTTPException
+
+
+def encode_cursor(position: Any) -> str:
+    """Encode a pagination position (any JSON value) as an opaque cursor string."""
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Any:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Returns:
+        The decoded position, or None when no cursor was given
+
+    Raises:
+        HTTPException: If the cursor is malformed
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Pending ids written to SQLite in one transaction once this many accumulate
+PROCESSED_FLUSH_SIZE = int(os.getenv("PROCESSED_FLUSH_SIZE", "100"))
+
+# Minimum seconds between compactions of a store
+PROCESSED_COMPACT_INTERVAL = int(os.getenv("PROCESSED_COMPACT_INTERVAL", "86400"))
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Answers "definitely not seen" without touching disk; a positive answer
+    may be a false positive at roughly ``error_rate`` once ``capacity`` items
+    have been added.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class ProcessedIdStore:
+    """
+    Persistent set of processed message ids for one account.
+
+    Ids live in a SQLite table, so saving is an incremental insert rather
+    than a rewrite of the whole set. A Bloom filter in front answers most
+    membership checks for new messages from memory; only possible hits are
+    confirmed against the primary key index. Ids added since the last flush
+    are kept in a small pending set and written in one transaction.
+    """
+
+    def __init__(self, path: Path, legacy_json: Optional[Path] = None):
+        """
+        Args:
+            path: SQLite database file for this account
+            legacy_json: ``*_processed.json`` written by older versions; its
+                ids are imported once and the file renamed to ``*.migrated``
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS processed (id TEXT PRIMARY KEY) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_json is not None and legacy_json.exists():
+            self._import_legacy_json(legacy_json)
+        self._rebuild_bloom()
+
+    def _import_legacy_json(self, legacy_json: Path) -> None:
+        try:
+            with open(legacy_json, 'r') as f:
+                ids = json.load(f).get('processed_emails', [])
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT OR IGNORE INTO processed (id) VALUES (?)", [(i,) for i in ids])
+            legacy_json.rename(legacy_json.with_name(legacy_json.name + '.migrated'))
+            logger.info(f"Imported {len(ids)} processed ids from {legacy_json}")
+        except Exception as e:
+            logger.error(f"Error importing processed ids from {legacy_json}: {e}")
+
+    def _rebuild_bloom(self) -> None:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+            # Leave room to grow before the filter has to be rebuilt
+            bloom = BloomFilter(capacity=max((count + len(self._pending)) * 2, 100_000))
+            for (item,) in self._conn.execute("SELECT id FROM processed"):
+                bloom.add(item)
+            for item in self._pending:
+                bloom.add(item)
+            self._bloom = bloom
+
+    def __contains__(self, item: str) -> bool:
+        with self._lock:
+            if item not in self._bloom:
+                return False
+            if item in self._pending:
+                return True
+            row = self._conn.execute("SELECT 1 FROM processed WHERE id = ?", (item,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+            return stored + len(self._pending)
+
+    def add(self, item: str) -> None:
+        """Mark an id as processed; it is persisted on the next flush."""
+        self.add_many([item])
+
+    def add_many(self, items: Iterable[str]) -> None:
+        """Mark several ids as processed."""
+        with self._lock:
+            for item in items:
+                if item not in self._pending:
+                    self._pending.add(item)
+                    self._bloom.add(item)
+            should_flush = len(self._pending) >= PROCESSED_FLUSH_SIZE
+            rebuild = self._bloom.is_full()
+        if should_flush:
+            self.flush()
+        if rebuild:
+            self._rebuild_bloom()
+
+    def flush(self) -> None:
+        """Write pending ids to disk in a single transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed (id) VALUES (?)", [(i,) for i in self._pending]
+                )
+            self._pending.clear()
+
+    def compact(self, force: bool = False) -> bool:
+        """
+        Checkpoint the write-ahead log and vacuum the database.
+
+        Runs at most once per ``PROCESSED_COMPACT_INTERVAL`` unless forced.
+
+        Returns:
+            True if the store was compacted
+        """
+        self.flush()
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = 'last_compacted'").fetchone()
+            if not force and row and now - float(row[0]) < PROCESSED_COMPACT_INTERVAL:
+                return False
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('last_compacted', ?)", (str(now),)
+                )
+        logger.info(f"Compacted processed id store {self.path}")
+        return True
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
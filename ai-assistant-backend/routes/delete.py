@@ -2,7 +2,10 @@ from fastapi import APIRouter, HTTPException
 from typing import List
 import os
 import logging
-from chroma_client import client
+from chroma_client import client, add_many_to_chroma
+from email_index import email_index
+from embedding import generate_embeddings
+from near_duplicates import near_duplicate_index
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -10,6 +13,62 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Sources whose near-duplicates are looked up by name alongside stored documents
+LINKED_SOURCES = ("upload", "slack")
+
+def matches_name(meta: dict, name: str) -> bool:
+    """Check whether any of the filename-like metadata fields matches the name"""
+    # Check all possible fields that might contain the filename
+    possible_fields = [
+        meta.get("original_filename"),
+        meta.get("source"),
+        meta.get("filename"),
+        meta.get("file_path"),
+        meta.get("title")  # For Google Docs
+    ]
+    
+    # Check if any of the fields match the name (either directly or as a path)
+    for field in possible_fields:
+        if not field:
+            continue
+            
+        # Get just the filename part if it's a path
+        field_basename = os.path.basename(str(field))
+        
+        # Check for exact match or basename match
+        if field == name or field_basename == name:
+            return True
+    return False
+
+def restore_near_duplicates(orphans: List[dict]) -> int:
+    """
+    Store near-duplicates whose canonical document was deleted.
+    
+    Each one is linked to another remaining copy if there is one, otherwise
+    the entry it was linked with is embedded and written.
+    
+    Returns:
+        Number of near-duplicates written to the collection
+    """
+    restored = 0
+    for orphan in orphans:
+        entry = orphan["entry"]
+        if not entry:
+            logger.warning(f"Near-duplicate {orphan['doc_id']} lost its canonical document and has no stored content")
+            continue
+        is_email = orphan["source"] in ("gmail", "import")
+        canonical_id = near_duplicate_index.relink(orphan)
+        if canonical_id:
+            if is_email:
+                email_index.upsert(orphan["doc_id"], {**entry["metadatas"][0], "canonical_id": canonical_id})
+            continue
+        add_many_to_chroma(entry["ids"], entry["documents"], entry["metadatas"], generate_embeddings(entry["documents"]))
+        if is_email:
+            email_index.upsert_many(zip(entry["ids"], entry["metadatas"]))
+        near_duplicate_index.restore(orphan)
+        restored += 1
+    return restored
+
 @router.get("/documents/debug/list")
 async def list_all_documents():
     """Debug endpoint to list all documents in the collection"""
@@ -57,32 +116,18 @@ async def delete_document(name: str):
         matching_indices = []
         
         for i, meta in enumerate(all_docs["metadatas"]):
-            if not meta:
-                continue
-                
-            # Check all possible fields that might contain the filename
-            possible_fields = [
-                meta.get("original_filename"),
-                meta.get("source"),
-                meta.get("filename"),
-                meta.get("file_path"),
-                meta.get("title")  # For Google Docs
-            ]
-            
-            # Check if any of the fields match the name (either directly or as a path)
-            for field in possible_fields:
-                if not field:
-                    continue
-                    
-                # Get just the filename part if it's a path
-                field_basename = os.path.basename(str(field))
-                
-                # Check for exact match or basename match
-                if field == name or field_basename == name:
-                    matching_indices.append(i)
-                    break  # No need to check other fields for this document
-        
-        if not matching_indices:
+            if meta and matches_name(meta, name):
+                matching_indices.append(i)
+        
+        # Near-duplicates that were linked instead of stored are deleted by name too
+        linked_ids = [
+            linked["doc_id"]
+            for source in LINKED_SOURCES
+            for linked in near_duplicate_index.linked(source)
+            if linked["entry"] and any(matches_name(meta, name) for meta in linked["entry"]["metadatas"])
+        ]
+        
+        if not matching_indices and not linked_ids:
             raise HTTPException(status_code=404, detail=f"No documents found with name: {name}")
         
         # Get all document IDs to delete
@@ -102,15 +147,34 @@ async def delete_document(name: str):
         if doc_ids:
             collection.delete(ids=doc_ids)
         
+        # Deleted documents must not keep matching new items as their near-duplicates;
+        # Slack chunks are fingerprinted under their document id
+        fingerprint_ids = set(doc_ids) | set(linked_ids)
+        fingerprint_ids |= {
+            all_docs["metadatas"][i]["near_dup_id"]
+            for i in matching_indices
+            if all_docs["metadatas"][i].get("near_dup_id")
+        }
+        orphans = near_duplicate_index.remove(list(fingerprint_ids))
+        restored = restore_near_duplicates(orphans)
+        if orphans:
+            logger.info(f"Restored {restored} of {len(orphans)} near-duplicates of the deleted documents")
+        
         # Delete the file if it exists
         file_path = os.path.join("uploads", source_filename) if source_filename else None
-        if os.path.exists(file_path):
+        if file_path and os.path.exists(file_path):
             logger.info(f"Removing file: {file_path}")
             os.remove(file_path)
         
-        success_msg = f"Successfully deleted {len(doc_ids)} document chunks for: {name}"
+        deleted_count = len(doc_ids) + len(linked_ids)
+        success_msg = f"Successfully deleted {deleted_count} document chunks for: {name}"
         logger.info(success_msg)
-        return {"status": "success", "message": success_msg, "deleted_count": len(doc_ids)}
+        return {
+            "status": "success",
+            "message": success_msg,
+            "deleted_count": deleted_count,
+            "restored_duplicates": restored
+        }
         
     except HTTPException as he:
         logger.error(f"HTTP Exception: {he.detail}")
@@ -1,9 +1,21 @@
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 import re
 import chromadb
 from embedding import generate_embeddings
+from context_packer import pack_context
+from email_normalize import normalize_email, parse_header_block
+from email_index import email_index
+from email_store import email_store
+from pagination import encode_cursor, decode_cursor
+from routes.emails import ensure_service
+from ttl_cache import TTLCache
+from uuid import uuid4
+import numpy as np
+import heapq
 import ollama
 import logging
 import sys
@@ -30,6 +42,214 @@ collection = chroma_client.get_or_create_collection(
     metadata={"hnsw:space": "cosine"}
 )
 
+# Search results kept for deferred answer generation, by result_set_id
+result_sets = TTLCache(max_size=256, ttl=600)
+
+_email_index_checked = False
+
+def ensure_email_index() -> None:
+    """Populate the email index from Chroma once if it is empty (e.g. after an upgrade)."""
+    global _email_index_checked
+    if _email_index_checked:
+        return
+    _email_index_checked = True
+    try:
+        if email_index.count() == 0:
+            email_index.sync_from_collection(collection)
+    except Exception as e:
+        logger.error(f"Error syncing email index from Chroma: {str(e)}")
+
+# Fields an email entry can carry; "id" is always returned
+EMAIL_FIELDS = [
+    "id", "from", "from_email", "to", "subject", "date", "timestamp",
+    "preview", "thread_id", "content", "raw_content"
+]
+CONTENT_FIELDS = {"content", "raw_content"}
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Parse a comma separated ``fields=`` projection (all fields when not given)."""
+    if not fields:
+        return EMAIL_FIELDS
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in EMAIL_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed fields: {', '.join(EMAIL_FIELDS)}"
+        )
+    return ["id"] + [f for f in selected if f != "id"]
+
+def parse_search_position(cursor: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Decode and validate a /search/emails cursor.
+
+    Listing cursors are {"after": [date, doc_id]}, ranked ones {"offset": n}.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed or has the wrong shape
+    """
+    position = decode_cursor(cursor)
+    if position is None:
+        return None
+    after = position.get("after") if isinstance(position, dict) else None
+    offset = position.get("offset", 0) if isinstance(position, dict) else None
+    valid_after = after is None or (
+        isinstance(after, list) and len(after) == 2
+        and isinstance(after[0], int) and not isinstance(after[0], bool) and isinstance(after[1], str)
+    )
+    valid_offset = isinstance(offset, int) and not isinstance(offset, bool) and offset >= 0
+    if not (valid_after and valid_offset):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+def get_emails_by_ids(ids: List[str], include_documents: bool = True) -> Dict[str, Any]:
+    """
+    Fetch emails by id from Chroma, keeping the order of ``ids``.
+
+    The result is shaped like a single-query ``collection.query`` result so
+    it can be formatted the same way. Without ``include_documents`` the email
+    bodies are only loaded for legacy records that have no stored preview.
+    Near-duplicate emails, which are only in the email index, are served
+    from their canonical document with their own headers.
+    """
+    if not ids:
+        return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+    
+    include = ["documents", "metadatas"] if include_documents else ["metadatas"]
+    fetched = collection.get(ids=ids, include=include)
+    documents = fetched.get("documents") or [None] * len(fetched["ids"])
+    by_id = {
+        doc_id: [doc, meta or {}]
+        for doc_id, doc, meta in zip(fetched["ids"], documents, fetched["metadatas"])
+    }
+    
+    if not include_documents:
+        legacy_ids = [doc_id for doc_id, (_, meta) in by_id.items() if "preview" not in meta]
+        if legacy_ids:
+            legacy = collection.get(ids=legacy_ids, include=["documents"])
+            for doc_id, doc in zip(legacy["ids"], legacy["documents"]):
+                by_id[doc_id][0] = doc
+    
+    missing = [doc_id for doc_id in ids if doc_id not in by_id]
+    duplicates = email_index.near_duplicates(missing) if missing else {}
+    if duplicates:
+        canonical_ids = list({row["canonical_id"] for row in duplicates.values()})
+        canonical = collection.get(ids=canonical_ids, include=include)
+        canonical_documents = canonical.get("documents") or [None] * len(canonical["ids"])
+        canonical_by_id = {
+            doc_id: (doc, meta or {})
+            for doc_id, doc, meta in zip(canonical["ids"], canonical_documents, canonical["metadatas"])
+        }
+        for doc_id, row in duplicates.items():
+            if row["canonical_id"] not in canonical_by_id:
+                continue
+            doc, canonical_meta = canonical_by_id[row["canonical_id"]]
+            by_id[doc_id] = [doc, {
+                **canonical_meta,
+                "email_id": row["email_id"],
+                "email_account": row["account"],
+                "from": row["from_name"] or row["from_email"],
+                "from_name": row["from_name"],
+                "from_email": row["from_email"],
+                "to": row["recipients"] or "",
+                "subject": row["subject"],
+                "thread_id": row["thread_id"],
+                "date": row["date"],
+                "date_str": "",
+                "read": bool(row["read"]),
+                "body_fetched": True,
+                "canonical_id": row["canonical_id"]
+            }]
+    
+    ordered = [doc_id for doc_id in ids if doc_id in by_id]
+    return {
+        "ids": [ordered],
+        "documents": [[by_id[doc_id][0] for doc_id in ordered]],
+        "metadatas": [[by_id[doc_id][1] for doc_id in ordered]],
+        "distances": [[None] * len(ordered)]
+    }
+
+def rank_candidates(query_embedding: List[float], ids: List[str], limit: int, chunk_size: int = 1000) -> List[str]:
+    """
+    Rank a candidate set of emails by cosine distance to the query.
+
+    Only the candidates' stored embeddings are compared, so the cost depends on
+    how many emails passed the structured filters rather than on the mailbox size.
+
+    Returns:
+        The ``limit`` closest candidate ids, closest first
+    """
+    query_vec = np.asarray(query_embedding, dtype=np.float32)
+    query_vec /= (np.linalg.norm(query_vec) or 1.0)
+    
+    scored = []
+    for start in range(0, len(ids), chunk_size):
+        fetched = collection.get(ids=ids[start:start + chunk_size], include=["embeddings"])
+        if not fetched["ids"]:
+            continue
+        matrix = np.asarray(fetched["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        distances = 1.0 - (matrix @ query_vec) / norms
+        scored.extend(zip(distances.tolist(), fetched["ids"]))
+        scored = heapq.nsmallest(limit, scored)
+    
+    return [doc_id for _, doc_id in scored]
+
+def format_email(doc_id: str, metadata: Dict[str, Any], content: Optional[str]) -> Dict[str, Any]:
+    """Build the API representation of a stored email."""
+    # Handle date formatting
+    date_str = ""
+    timestamp = metadata.get("date")
+    
+    if timestamp:
+        try:
+            # Try to parse as timestamp (milliseconds since epoch)
+            if isinstance(timestamp, (int, float)) or (isinstance(timestamp, str) and timestamp.isdigit()):
+                date_str = datetime.fromtimestamp(int(timestamp) / 1000).strftime('%Y-%m-%d %H:%M:%S')
+            # Fall back to string date if available
+            elif "date_str" in metadata and metadata["date_str"]:
+                date_str = metadata["date_str"]
+            else:
+                date_str = str(timestamp)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Error parsing date {timestamp}: {str(e)}")
+            date_str = metadata.get("date_str", "")
+    
+    email_to = metadata.get("to") or metadata.get("recipient") or ""
+    
+    if "preview" in metadata:
+        # Display fields were normalised at ingestion time
+        email_from = metadata.get("from_name") or metadata.get("from_email") or ""
+        email_subject = metadata.get("subject") or ""
+        preview = metadata["preview"]
+    else:
+        # Emails ingested before normalisation: derive the fields now
+        headers, body = parse_header_block(content or "")
+        normalized = normalize_email(
+            metadata.get("from") or metadata.get("sender") or headers.get("from", ""),
+            metadata.get("subject") or headers.get("subject", ""),
+            body
+        )
+        email_from = normalized["from_name"] or normalized["from_email"]
+        email_subject = normalized["subject"]
+        email_to = email_to or headers.get("to", "")
+        preview = normalized["preview"]
+    
+    return {
+        "id": doc_id,
+        "from": email_from or "Unknown Sender",
+        "from_email": metadata.get("from_email", ""),
+        "to": email_to,
+        "subject": email_subject or "No Subject",
+        "date": date_str,
+        "timestamp": timestamp,
+        "preview": preview,
+        "thread_id": metadata.get("thread_id", ""),
+        "content": content,  # Full content for the detailed view
+        "raw_content": content  # Include raw content for client-side parsing
+    }
+
 @router.get("/search/emails")
 async def search_emails(
     query: str = "all",
@@ -38,262 +258,168 @@ async def search_emails(
     subject: Optional[str] = None,
     days: int = 30,
     limit: int = 100,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     unread: Optional[bool] = None
 ):
     """
     Search emails using semantic search with filtering options.
     
     Args:
-        query: Natural language search query or 'all' to get all emails
+        query: Natural language search query, or 'all'/empty to list emails
+            newest first from metadata only (no embedding or vector search)
         from_email: Filter by sender's email
         to: Filter by recipient's email
         subject: Filter by subject line
         days: Only search emails from the last N days (0 for all)
         limit: Maximum number of results to return
+        offset: Number of emails to skip (ignored when a cursor is given)
+        cursor: Opaque cursor from a previous response's next_cursor
+        fields: Comma separated fields to return per email, e.g.
+            "from,subject,date,preview" for list views. Full bodies are
+            available from GET /api/emails/{id}.
         unread: Filter by read/unread status if specified
+    
+    The response carries a result_set_id; the natural-language answer is only
+    generated when the client asks for it via
+    GET /api/search/emails/answer/{result_set_id}.
     """
     try:
-        # Build the where clause based on filters
-        filters = []
-        
-        # Always filter by source
-        filters.append({"source": {"$eq": "gmail"}})
-        
-        # Helper function to create case-insensitive regex pattern
-        def make_regex_pattern(value):
-            return {"$regex": f"(?i){re.escape(value)}"}
-        
-        if from_email:
-            filters.append({"from": make_regex_pattern(from_email)})
-        
-        if to:
-            filters.append({"to": make_regex_pattern(to)})
-            
-        if subject:
-            filters.append({"subject": make_regex_pattern(subject)})
-            
-        if unread is not None:
-            filters.append({"read": {"$eq": not unread}})
+        selected_fields = parse_fields(fields)
+        include_documents = bool(CONTENT_FIELDS.intersection(selected_fields))
+        position = parse_search_position(cursor)
         
         # Make date filtering optional based on the 'days' parameter
         # If days is 0 or negative, skip date filtering entirely
+        threshold_ms = None
         if days > 0:
-            try:
-                # Calculate timestamp threshold (in milliseconds since epoch)
-                threshold_ms = int((datetime.utcnow() - timedelta(days=days)).timestamp() * 1000)
-                filters.append({"date": {"$gte": threshold_ms}})
-                logger.debug(f"Applied date filter: >= {threshold_ms}")
-            except Exception as e:
-                logger.warning(f"Error applying date filter: {str(e)}")
-                # Continue without date filtering if there's an error
+            # Calculate timestamp threshold (in milliseconds since epoch)
+            threshold_ms = int((datetime.utcnow() - timedelta(days=days)).timestamp() * 1000)
+            logger.debug(f"Applied date filter: >= {threshold_ms}")
         
-        # Prepare query parameters
-        query_params = {
-            "n_results": limit,
-            "include": ["documents", "metadatas", "distances"]
-        }
-        
-        # If we have a search query, use it for semantic search
-        if query and query.lower() != "all":
-            query_embedding = generate_embeddings([query])[0]
-            query_params["query_embeddings"] = [query_embedding]
-        else:
-            # For no query or 'all', we'll use a default query with just the filters
-            default_query = "*"  # This will match all documents when combined with filters
-            query_params["query_texts"] = [default_query]
-        
-        # Add where clause if we have any filters
-        if filters:
-            query_params["where"] = {"$and": filters} if len(filters) > 1 else filters[0]
-        
-        # Debug: Log the query parameters and collection info
+        is_listing = not query or query.lower() == "all"
         logger.debug(f"Searching with query: {query}")
-        logger.debug(f"Query params: {query_params}")
-        
-        # Log collection info
-        try:
-            collection_info = collection.get()
-            logger.debug(f"Collection info: {collection_info}")
-            logger.debug(f"Collection count: {collection.count()}")
-        except Exception as e:
-            logger.error(f"Error getting collection info: {str(e)}")
+        next_position = None
         
-        try:
-            # Perform the search
-            results = collection.query(**query_params)
+        if is_listing:
+            # Listing needs no similarity at all: page through the metadata
+            # index in date order and fetch just that page from Chroma.
+            # Listing cursors are keyset positions: {"after": [date, doc_id]}
+            ensure_email_index()
+            after = tuple(position["after"]) if position and "after" in position else None
+            page_ids = email_index.search(
+                from_email=from_email,
+                to=to,
+                subject=subject,
+                unread=unread,
+                since_ms=threshold_ms,
+                limit=limit + 1,
+                offset=0 if after else offset,
+                after=after
+            )
+            if len(page_ids) > limit:
+                page_ids = page_ids[:limit]
+                last = email_index.position(page_ids[-1])
+                next_position = {"after": list(last)} if last else None
+            results = get_emails_by_ids(page_ids, include_documents)
+        else:
+            # Ranked results are paginated by rank: {"offset": n}
+            start = position.get("offset", 0) if position else offset
             
-            # Debug: Log the raw results
-            logger.debug(f"Search results: {results}")
-            if results and 'ids' in results and results['ids']:
-                logger.debug(f"Found {len(results['ids'][0])} results")
-                if 'distances' in results and results['distances']:
-                    logger.debug(f"Distances: {results['distances']}")
-        except Exception as e:
-            logger.error(f"Error querying ChromaDB: {str(e)}")
-            raise
+            if from_email or to or subject:
+                # Resolve sender/recipient/subject filters in the local index first;
+                # Chroma has no way to index substring filters on metadata
+                ensure_email_index()
+                candidate_ids = email_index.search(
+                    from_email=from_email,
+                    to=to,
+                    subject=subject,
+                    unread=unread,
+                    since_ms=threshold_ms
+                )
+                logger.debug(f"Email index matched {len(candidate_ids)} candidates")
+                ranked_ids = rank_candidates(generate_embeddings([query])[0], candidate_ids, start + limit + 1)
+            else:
+                # Build the where clause based on filters
+                filters = [{"source": {"$eq": "gmail"}}]
+                if unread is not None:
+                    filters.append({"read": {"$eq": not unread}})
+                if threshold_ms is not None:
+                    filters.append({"date": {"$gte": threshold_ms}})
+                where = {"$and": filters} if len(filters) > 1 else filters[0]
+                logger.debug(f"Query filters: {where}")
+                
+                try:
+                    # Perform the search; only ids are needed here, the page
+                    # itself is fetched below with the requested fields
+                    ranked = collection.query(
+                        query_embeddings=[generate_embeddings([query])[0]],
+                        n_results=start + limit + 1,
+                        include=["distances"],
+                        where=where
+                    )
+                    ranked_ids = ranked["ids"][0] if ranked.get("ids") else []
+                except Exception as e:
+                    logger.error(f"Error querying ChromaDB: {str(e)}")
+                    raise
+            
+            page_ids = ranked_ids[start:start + limit]
+            if len(ranked_ids) > start + limit:
+                next_position = {"offset": start + limit}
+            results = get_emails_by_ids(page_ids, include_documents)
+        
+        logger.debug(f"Found {len(results['ids'][0])} results")
         
         # Format the results
         emails = []
-        if results and 'documents' in results and results['documents'] and results['documents'][0]:
-            for i in range(len(results['documents'][0])):
-                try:
-                    metadata = results['metadatas'][0][i] if results.get('metadatas') and results['metadatas'] and i < len(results['metadatas'][0]) else {}
-                    content = results['documents'][0][i]
-                    
-                    # Truncate content for the list view
-                    preview = (content[:200] + '...') if len(content) > 200 else content
-                    
-                    # Handle date formatting
-                    date_str = ""
-                    timestamp = metadata.get("date")
-                    
-                    if timestamp:
-                        try:
-                            # Try to parse as timestamp (milliseconds since epoch)
-                            if isinstance(timestamp, (int, float)) or (isinstance(timestamp, str) and timestamp.isdigit()):
-                                date_str = datetime.fromtimestamp(int(timestamp) / 1000).strftime('%Y-%m-%d %H:%M:%S')
-                            # Fall back to string date if available
-                            elif "date_str" in metadata and metadata["date_str"]:
-                                date_str = metadata["date_str"]
-                            else:
-                                date_str = str(timestamp)
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Error parsing date {timestamp}: {str(e)}")
-                            date_str = metadata.get("date_str", "")
-                    
-                    # Extract email fields with better fallbacks
-                    email_from = metadata.get("from") or metadata.get("sender") or ""
-                    email_to = metadata.get("to") or metadata.get("recipient") or ""
-                    email_subject = metadata.get("subject") or ""
-                    
-                    # Parse headers from the raw content
-                    try:
-                        if content:
-                            # Clean up the content first
-                            content = content.replace('\r\n', '\n').replace('\r', '\n')
-                            lines = content.split('\n')
-                            
-                            # Special handling for Pinterest emails
-                            if 'pinterest.com' in content.lower():
-                                # Look for the company name in the email
-                                email_from = 'Pinterest'
-                                
-                                # Look for a subject line in the first few non-empty lines
-                                for line in lines[:20]:  # Check first 20 lines max
-                                    line = line.strip()
-                                    if not line:
-                                        continue
-                                    
-                                    # Skip common header patterns
-                                    if any(line.lower().startswith(prefix) for prefix in 
-                                           ['from:', 'to:', 'subject:', 'date:', 'return-path:']):
-                                        continue
-                                        
-                                    # Skip common footer patterns
-                                    if any(term in line.lower() for term in 
-                                           ['unsubscribe', 'privacy', 'policy', 'terms', 'conditions', 'copyright']):
-                                        continue
-                                        
-                                    # If we find a line that looks like a subject, use it
-                                    if 5 < len(line) < 100 and not email_subject:
-                                        email_subject = line
-                                        break
-                            else:
-                                # Standard email parsing for non-Pinterest emails
-                                for i, line in enumerate(lines):
-                                    line = line.strip()
-                                    
-                                    # Look for common email header patterns
-                                    if line.lower().startswith('from:') and not email_from:
-                                        email_from = line[5:].strip()
-                                    elif line.lower().startswith('to:') and not email_to:
-                                        email_to = line[3:].strip()
-                                    elif line.lower().startswith('subject:') and not email_subject:
-                                        email_subject = line[8:].strip()
-                                    
-                                    # Look for common email patterns in the body
-                                    if not email_from and ('@' in line or 'from:' in line.lower()):
-                                        # Try to extract an email address
-                                        email_match = re.search(r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+', line)
-                                        if email_match and not email_from:
-                                            email_from = email_match.group(0)
-                                    
-                                    # Look for the first meaningful line as a subject if we don't have one
-                                    if not email_subject and line and len(line) < 100 and not line.startswith((' ', '\t', '-', '_', '*', '#')):
-                                        # Skip common email footer/header patterns
-                                        if not any(term in line.lower() for term in ['unsubscribe', 'privacy', 'policy', 'terms', 'conditions', 'copyright']):
-                                            email_subject = line
-                            
-                            # If we still don't have a subject, try to extract it from the first few lines of the body
-                            if not email_subject:
-                                body_start = 0
-                                for i, line in enumerate(lines):
-                                    if not line.strip():
-                                        body_start = i + 1
-                                        break
-                                
-                                # Look at the first few lines after the headers
-                                for line in lines[body_start:body_start+5]:
-                                    line = line.strip()
-                                    if line and len(line) < 100 and not line.startswith((' ', '\t', '-', '_', '*', '#')):
-                                        if not any(term in line.lower() for term in ['unsubscribe', 'privacy', 'policy', 'terms']):
-                                            email_subject = line
-                                            break
-                            
-                            # Clean up the from field
-                            if email_from:
-                                # Remove any angle brackets and extra spaces
-                                email_from = re.sub(r'<[^>]+>', '', email_from).strip()
-                                email_from = re.sub(r'\s+', ' ', email_from).strip()
-                                
-                                # If it's just an email, extract the name part
-                                if '@' in email_from and ' ' not in email_from:
-                                    name_part = email_from.split('@')[0]
-                                    if '.' in name_part:
-                                        # Convert first.last@example.com to First Last
-                                        email_from = ' '.join(part.capitalize() for part in name_part.split('.'))
-                            
-                            # Clean up the subject
-                            if email_subject:
-                                # Remove common prefixes and clean up the subject
-                                email_subject = re.sub(r'^(re:|fw:|fwd:)\s*', '', email_subject, flags=re.IGNORECASE).strip()
-                                email_subject = re.sub(r'\s+', ' ', email_subject).strip()
-                                
-                                # If the subject is too long, truncate it
-                                if len(email_subject) > 100:
-                                    email_subject = email_subject[:97] + '...'
-                                        
-                    except Exception as e:
-                        logger.warning(f"Error parsing email content: {str(e)}")
-                    
-                    # Set default values if fields are still empty
-                    email_from = email_from or "Unknown Sender"
-                    email_subject = email_subject or "No Subject"
-                    
-                    emails.append({
-                        "id": results['ids'][0][i] if results.get('ids') and results['ids'] and i < len(results['ids'][0]) else str(i),
-                        "from": email_from,
-                        "to": email_to,
-                        "subject": email_subject,
-                        "date": date_str,
-                        "timestamp": timestamp,
-                        "preview": preview,
-                        "content": content,  # Full content for the detailed view
-                        "raw_content": content  # Include raw content for client-side parsing
-                    })
-                except Exception as e:
-                    logger.error(f"Error processing result {i}: {str(e)}")
+        for doc_id, metadata, content in zip(results["ids"][0], results["metadatas"][0], results["documents"][0]):
+            try:
+                emails.append(format_email(doc_id, metadata, content))
+            except Exception as e:
+                logger.error(f"Error processing result {doc_id}: {str(e)}")
+        
+        # Keep the result set so the answer can be generated later, on request
+        result_set_id = uuid4().hex
+        result_sets.set(result_set_id, {
+            "query": query,
+            "emails": [
+                {field: e[field] for field in ("from", "subject", "date", "preview")}
+                for e in emails
+            ]
+        })
         
-        # Generate a natural language response using Ollama
-        context = "\n---\n".join([
+        return {
+            "query": query,
+            "result_set_id": result_set_id,
+            "emails": [{field: e[field] for field in selected_fields} for e in emails],
+            "count": len(emails),
+            "next_cursor": encode_cursor(next_position) if next_position else None
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in search_emails: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def build_answer_messages(query: str, emails: List[Dict[str, Any]], max_context_tokens: Optional[int]):
+    """Build the Ollama chat messages answering ``query`` from a result set."""
+    # Emails are already in relevance order, so the packer keeps the best matches first
+    context, context_tokens = pack_context(
+        [
             f"From: {e['from']}\n"
             f"Subject: {e['subject']}\n"
             f"Date: {e['date']}\n"
-            f"Preview: {e['preview']}" 
+            f"Preview: {e['preview']}"
             for e in emails
-        ])
-        
-        prompt = f"""You are an AI assistant helping with email search. 
+        ],
+        query=query,
+        max_tokens=max_context_tokens,
+        separator="\n---\n"
+    )
+    
+    prompt = f"""You are an AI assistant helping with email search. 
         Based on the following email context, answer the user's question.
         
         User's question: {query}
@@ -304,36 +430,105 @@ async def search_emails(
         If the context doesn't contain relevant information, say "I couldn't find any relevant emails matching your query."
         Be concise and to the point in your response.
         """
+    
+    messages = [
+        {"role": "system", "content": "You are a helpful AI assistant that helps users find and understand their emails."},
+        {"role": "user", "content": prompt}
+    ]
+    return messages, context_tokens
+
+@router.get("/search/emails/answer/{result_set_id}")
+async def answer_email_search(
+    result_set_id: str,
+    stream: bool = False,
+    max_context_tokens: Optional[int] = None
+):
+    """
+    Generate the natural-language answer for a previous email search.
+    
+    Args:
+        result_set_id: The result_set_id returned by /api/search/emails
+        stream: Stream the answer as plain text while it is generated
+        max_context_tokens: Token budget for the email context given to the LLM
+    """
+    result_set = result_sets.get(result_set_id)
+    if result_set is None:
+        raise HTTPException(status_code=404, detail="Result set not found or expired")
+    
+    messages, context_tokens = build_answer_messages(
+        result_set["query"], result_set["emails"], max_context_tokens
+    )
+    
+    if stream:
+        def generate():
+            try:
+                for chunk in ollama.chat(model="llama3", messages=messages, stream=True):
+                    yield chunk['message']['content']
+            except Exception as e:
+                logger.error(f"Error streaming response: {str(e)}")
+                yield "\n[Error generating response]"
         
-        try:
-            response = ollama.chat(
-                model="llama3",
-                messages=[
-                    {"role": "system", "content": "You are a helpful AI assistant that helps users find and understand their emails."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            answer = response['message']['content']
-        except Exception as e:
-            logger.error(f"Error generating response: {str(e)}")
-            answer = "I found some emails but couldn't generate a response. Here are the matching emails:"
+        return StreamingResponse(
+            generate(),
+            media_type="text/plain",
+            headers={"X-Context-Tokens": str(context_tokens)}
+        )
+    
+    try:
+        response = await run_in_threadpool(ollama.chat, model="llama3", messages=messages)
+        answer = response['message']['content']
+    except Exception as e:
+        logger.error(f"Error generating response: {str(e)}")
+        answer = "I found some emails but couldn't generate a response. Here are the matching emails:"
+    
+    return {
+        "result_set_id": result_set_id,
+        "query": result_set["query"],
+        "answer": answer,
+        "context_tokens": context_tokens
+    }
+
+@router.get("/emails/{email_id}")
+async def get_email(email_id: str):
+    """
+    Get a single email with its full body.
+
+    Args:
+        email_id: Email id as returned by search (``email_<gmail id>``) or the
+            bare Gmail message id
+    """
+    try:
+        doc_id = email_id if email_id.startswith("email_") else f"email_{email_id}"
+        results = get_emails_by_ids([doc_id])
+        if not results["ids"][0]:
+            raise HTTPException(status_code=404, detail=f"Email not found: {email_id}")
         
-        return {
-            "query": query,
-            "answer": answer,
-            "emails": emails,
-            "count": len(emails)
-        }
+        metadata = results["metadatas"][0][0]
+        if metadata.get("body_fetched") is False:
+            # Indexed from headers only so far: fetch the body now instead of
+            # waiting for the background body pass
+            try:
+                service = ensure_service(metadata.get("email_account", ""))
+                await run_in_threadpool(service.fetch_body, metadata["email_id"])
+                results = get_emails_by_ids([doc_id])
+                metadata = results["metadatas"][0][0]
+            except Exception as e:
+                logger.warning(f"Could not fetch body of {doc_id}, returning headers only: {e}")
         
+        return format_email(doc_id, metadata, results["documents"][0][0])
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error in search_emails: {str(e)}", exc_info=True)
+        logger.error(f"Error fetching email {email_id}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/search/emails/fast")
 async def fast_search_emails(
     query: str = "",
     limit: int = 100,
-    days: int = 0
+    days: int = 0,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """
     Fast email search without embeddings - returns complete email data.
@@ -342,168 +537,43 @@ async def fast_search_emails(
         query: Text to search in email content (optional)
         limit: Maximum number of results to return
         days: Only search emails from the last N days (0 for all)
+        cursor: Opaque cursor from a previous response's next_cursor
+        fields: Comma separated fields to return per email (all by default)
     """
     try:
-        # Directory where emails are stored
-        emails_dir = Path("./emails")
-        if not emails_dir.exists():
-            logger.warning(f"Emails directory not found: {emails_dir.absolute()}")
-            return {"emails": []}
-            
-        results = []
-        current_time = datetime.utcnow()
+        selected_fields = parse_fields(fields)
         
-        # Get all JSON files in the emails directory, sorted by modification time (newest first)
-        email_files = sorted(emails_dir.glob("*.json"), 
-                           key=lambda f: f.stat().st_mtime, 
-                           reverse=True)
+        if not email_store.emails_dir.exists():
+            logger.warning(f"Emails directory not found: {email_store.emails_dir.absolute()}")
+            return {"emails": [], "next_cursor": None}
         
-        logger.info(f"Found {len(email_files)} email files to process")
+        # Pick up new or changed email files since the last scan, off the event loop
+        await run_in_threadpool(email_store.sync)
         
-        for email_file in email_files:
-            if len(results) >= limit:
-                break
-                
-            try:
-                with open(email_file, 'r', encoding='utf-8') as f:
-                    email_data = json.load(f)
-                
-                # Skip if email_data is not a dictionary
-                if not isinstance(email_data, dict):
-                    logger.warning(f"Skipping non-dictionary email data in {email_file}")
-                    continue
-                
-                # Get the raw content (try multiple possible field names)
-                raw_content = (
-                    email_data.get('content') or 
-                    email_data.get('body') or 
-                    email_data.get('text') or 
-                    email_data.get('raw_content', '')
-                )
-                
-                # Extract headers from raw content if needed
-                headers = {}
-                if isinstance(raw_content, str):
-                    # Try to parse headers from raw content
-                    header_end = raw_content.find('\n\n')
-                    if header_end > 0:
-                        header_text = raw_content[:header_end]
-                        for line in header_text.split('\n'):
-                            if ':' in line:
-                                key, value = line.split(':', 1)
-                                headers[key.strip().lower()] = value.strip()
-                
-                # Extract basic fields with fallbacks
-                from_email = (
-                    email_data.get('from') or 
-                    email_data.get('sender') or 
-                    headers.get('from', '')
-                )
-                
-                # Special handling for LinkedIn invitation emails
-                if isinstance(raw_content, str) and 'linkedin.com/invite/' in raw_content:
-                    # Try to extract sender name from LinkedIn URL
-                    import re
-                    linkedin_match = re.search(r'View profile:https?:\/\/[^\s]+\/in\/([^?\/]+)', raw_content)
-                    if linkedin_match:
-                        from_email = linkedin_match.group(1).replace('-', ' ').title()
-                    
-                    # If still no sender, try to get it from the content
-                    if not from_email or from_email == 'Unknown Sender':
-                        name_match = re.search(r'Hi [^,]+,\s*([^\n]+) would like to connect', raw_content)
-                        if name_match:
-                            from_email = name_match.group(1).strip()
-                
-                # Clean up the from_email if it's in angle brackets
-                if '<' in from_email and '>' in from_email:
-                    from_email = from_email.split('<')[-1].split('>')[0].strip()
-                
-                # If we still don't have a sender, try to extract from content
-                if not from_email or from_email == 'Unknown Sender':
-                    if isinstance(raw_content, str):
-                        # Look for common email patterns in the content
-                        email_match = re.search(r'From:\s*([^\n<]+)', raw_content, re.IGNORECASE)
-                        if email_match:
-                            from_email = email_match.group(1).strip()
-                
-                to_email = (
-                    email_data.get('to') or 
-                    headers.get('to', '')
-                )
-                
-                subject = (
-                    email_data.get('subject') or 
-                    headers.get('subject', 'No Subject')
-                )
-                
-                # Clean up subject if it starts with 'Re:' or 'Fwd:'
-                if isinstance(subject, str):
-                    subject = re.sub(r'^(Re:|Fwd:)\s*', '', subject).strip()
-                
-                # Handle date parsing
-                date_str = email_data.get('date') or headers.get('date', '')
-                timestamp = 0
-                
-                if date_str:
-                    try:
-                        # Try to parse the date string
-                        if isinstance(date_str, (int, float)):
-                            # Handle Unix timestamp (in seconds or milliseconds)
-                            if date_str > 1e12:  # Likely milliseconds
-                                date_obj = datetime.fromtimestamp(date_str / 1000.0)
-                            else:  # Likely seconds
-                                date_obj = datetime.fromtimestamp(date_str)
-                        else:
-                            # Handle ISO format or other string formats
-                            date_str_clean = date_str.replace('Z', '+00:00')
-                            date_obj = datetime.fromisoformat(date_str_clean)
-                        
-                        timestamp = int(date_obj.timestamp() * 1000)  # Convert to milliseconds
-                        
-                        # Apply date filter if specified
-                        if days > 0 and (current_time - date_obj).days > days:
-                            continue
-                            
-                    except (ValueError, TypeError) as e:
-                        logger.warning(f"Failed to parse date '{date_str}': {str(e)}")
-                
-                # Create email entry
-                email_entry = {
-                    'id': str(email_file.stem),
-                    'from': from_email,
-                    'to': to_email,
-                    'subject': subject,
-                    'content': raw_content,
-                    'date': date_str,
-                    'timestamp': timestamp,
-                    'raw_content': raw_content  # Include full raw content for parsing on client
-                }
-                
-                # If query is provided, search in relevant fields
-                if query:
-                    query = query.lower()
-                    search_fields = [
-                        str(subject).lower(),
-                        str(from_email).lower(),
-                        str(to_email).lower(),
-                        str(raw_content).lower()
-                    ]
-                    if not any(query in field for field in search_fields):
-                        continue
-                
-                results.append(email_entry)
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Error decoding JSON in {email_file}: {str(e)}")
-                continue
-            except Exception as e:
-                logger.error(f"Error processing {email_file}: {str(e)}", exc_info=True)
-                continue
+        since_ms = None
+        if days > 0:
+            since_ms = int((datetime.utcnow() - timedelta(days=days)).timestamp() * 1000)
         
-        logger.info(f"Returning {len(results)} emails")
-        return {"emails": results}
+        # Fast search cursors are store positions: [sort_key, id]
+        after = decode_cursor(cursor)
+        if after is not None and not (isinstance(after, list) and len(after) == 2):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        emails, next_position = await run_in_threadpool(
+            email_store.search,
+            query=query,
+            since_ms=since_ms,
+            limit=limit,
+            after=tuple(after) if after else None
+        )
         
+        logger.info(f"Returning {len(emails)} emails")
+        return {
+            "emails": [{field: e[field] for field in selected_fields if field in e} for e in emails],
+            "next_cursor": encode_cursor(list(next_position)) if next_position else None
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in fast_search_emails: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
-        raise HTTPException(status_code=500, detail=str(e))
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Request, Depends
+from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import logging
 import threading
@@ -7,10 +8,16 @@ from datetime import datetime
 from pathlib import Path
 
 from email_ingestion import EmailIngestionService
+from email_backfill import MailboxBackfill, checkpoint_progress, find_interrupted_backfills
+from email_import import MailImport, resolve_import_path
+from ingestion_scheduler import IngestionScheduler
+from ingestion_pipeline import email_pipeline
+from email_attachments import attachment_ingestor
 from email_utils import (
     get_auth_url, 
     exchange_code_for_token,
     get_credentials,
+    gmail_clients,
     TOKENS_DIR
 )
 
@@ -35,7 +42,10 @@ services_lock = threading.Lock()
 class EmailServiceManager:
     def __init__(self):
         self.services = {}
+        self.backfills = {}
+        self.imports = {}
         self.lock = threading.Lock()
+        self.scheduler = IngestionScheduler()
     
     def get_service(self, email: str) -> Optional[EmailIngestionService]:
         with self.lock:
@@ -44,19 +54,99 @@ class EmailServiceManager:
     def add_service(self, email: str, service: EmailIngestionService):
         with self.lock:
             self.services[email] = service
+        self.scheduler.add_account(service)
     
     def remove_service(self, email: str):
         with self.lock:
             if email in self.services:
                 del self.services[email]
+        self.scheduler.remove_account(email)
     
     def get_all_services(self) -> Dict[str, EmailIngestionService]:
         with self.lock:
             return self.services.copy()
+    
+    def get_backfill(self, email: str) -> Optional[MailboxBackfill]:
+        with self.lock:
+            return self.backfills.get(email)
+    
+    def add_backfill(self, email: str, backfill: MailboxBackfill):
+        with self.lock:
+            self.backfills[email] = backfill
+    
+    def get_import(self, import_id: str) -> Optional[MailImport]:
+        with self.lock:
+            return self.imports.get(import_id)
+    
+    def add_import(self, mail_import: MailImport):
+        with self.lock:
+            self.imports[mail_import.id] = mail_import
+    
+    def get_status(self, email: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Scheduler status with per-account next run and lag, or one account's.
+        
+        The overall status also carries the shared email pipeline's
+        per-stage throughput and queue depth.
+        """
+        if email is not None:
+            return self.scheduler.account_status(email)
+        return {**self.scheduler.status(), "pipeline": email_pipeline.metrics()}
 
 # Global email service manager
 email_service_manager = EmailServiceManager()
 
+def ensure_service(email: str) -> EmailIngestionService:
+    """Get the account's ingestion service, creating and scheduling it if needed."""
+    service = email_service_manager.get_service(email)
+    if not service:
+        service = EmailIngestionService(
+            email=email,
+            poll_interval=300  # 5 minutes
+        )
+        email_service_manager.add_service(email, service)
+    return service
+
+def start_ingestion_scheduler():
+    """Start the shared ingestion scheduler.
+    
+    Schedules every account with stored credentials and re-queues attachments
+    left pending by the last run.
+    """
+    email_service_manager.scheduler.start()
+    attachment_ingestor.resume_pending()
+    for token_file in TOKENS_DIR.glob("*.json"):
+        try:
+            ensure_service(token_file.stem)
+        except Exception as e:
+            logger.error(f"Error scheduling ingestion for {token_file.stem}: {e}")
+
+async def stop_ingestion_scheduler():
+    """Stop the shared scheduler, letting running sync passes finish."""
+    await email_service_manager.scheduler.stop()
+
+def start_backfill(email: str) -> MailboxBackfill:
+    """Start (or resume from its checkpoint) the mailbox backfill for an account."""
+    backfill = email_service_manager.get_backfill(email)
+    if backfill and backfill.is_running():
+        return backfill
+    
+    # Share the account's ingestion service so both paths use one processed set
+    service = ensure_service(email)
+    
+    backfill = MailboxBackfill(service)
+    email_service_manager.add_backfill(email, backfill)
+    threading.Thread(target=backfill.run, daemon=True).start()
+    logger.info(f"Started mailbox backfill for {email}")
+    return backfill
+
+def resume_interrupted_backfills():
+    """Resume backfills that were running when the server last stopped."""
+    for email in find_interrupted_backfills():
+        if get_credentials(email):
+            start_backfill(email)
+        else:
+            logger.warning(f"Not resuming backfill for {email}: no credentials")
+
 @router.get("/auth/url")
 async def get_auth_url_endpoint(redirect_uri: str):
     """Get the OAuth URL for Gmail authentication."""
@@ -73,20 +163,9 @@ async def auth_callback(code: str, redirect_uri: str, state: Optional[str] = Non
     try:
         credentials, email = exchange_code_for_token(code, redirect_uri, state)
         
-        # Initialize email service for this account if not exists
+        # Schedule email ingestion for this account if not already scheduled
         if not email_service_manager.get_service(email):
-            service = EmailIngestionService(
-                email=email,
-                poll_interval=300  # 5 minutes
-            )
-            email_service_manager.add_service(email, service)
-            
-            # Start the email ingestion in a separate thread
-            thread = threading.Thread(
-                target=service.run_continuous,
-                daemon=True
-            )
-            thread.start()
+            ensure_service(email)
             logger.info(f"Started email ingestion service for {email}")
         
         return {"status": "authenticated", "email": email}
@@ -109,7 +188,8 @@ async def get_connected_accounts():
                 accounts.append({
                     "email": email,
                     "scopes": token_data.get("scopes", []),
-                    "is_active": email in email_service_manager.get_all_services()
+                    "is_active": email in email_service_manager.get_all_services(),
+                    "schedule": email_service_manager.get_status(email)
                 })
             except Exception as e:
                 logger.error(f"Error reading token file {token_file}: {e}")
@@ -124,6 +204,10 @@ async def disconnect_account(email: str):
     """Disconnect an email account and stop its service."""
     try:
         # Stop the email service if running
+        backfill = email_service_manager.get_backfill(email)
+        if backfill:
+            backfill.stop()
+        
         service = email_service_manager.get_service(email)
         if service:
             service.stop()
@@ -133,23 +217,100 @@ async def disconnect_account(email: str):
         token_file = TOKENS_DIR / f"{email}.json"
         if token_file.exists():
             token_file.unlink()
+        gmail_clients.invalidate(email)
         
         return {"status": "disconnected", "email": email}
     except Exception as e:
         logger.error(f"Error disconnecting account {email}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to disconnect account: {e}")
 
+@router.post("/accounts/{email}/backfill")
+async def start_backfill_endpoint(email: str):
+    """Index the account's existing mailbox, resuming from the last checkpoint."""
+    if not get_credentials(email):
+        raise HTTPException(status_code=404, detail=f"No credentials found for {email}")
+    try:
+        backfill = start_backfill(email)
+        return {"status": "started", "progress": backfill.progress()}
+    except Exception as e:
+        logger.error(f"Error starting backfill for {email}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to start backfill: {e}")
+
+@router.get("/accounts/{email}/backfill")
+async def get_backfill_progress(email: str):
+    """Get backfill progress and ETA for an account."""
+    backfill = email_service_manager.get_backfill(email)
+    if backfill:
+        return backfill.progress()
+    # Not started in this process: report the persisted checkpoint, if any
+    progress = checkpoint_progress(email)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"No backfill for {email}")
+    return progress
+
+@router.post("/accounts/{email}/backfill/stop")
+async def stop_backfill(email: str):
+    """Stop a running backfill; it can be resumed later from its checkpoint."""
+    backfill = email_service_manager.get_backfill(email)
+    if not backfill or not backfill.is_running():
+        raise HTTPException(status_code=404, detail=f"No running backfill for {email}")
+    backfill.stop()
+    return {"status": "stopping", "progress": backfill.progress()}
+
+class MailImportRequest(BaseModel):
+    path: str  # mbox file, directory of .eml files or zip archive under IMPORT_DIR
+    account: str
+
+@router.post("/import")
+async def start_mail_import(request: MailImportRequest):
+    """Import an mbox file or a directory/zip of .eml files in the background."""
+    try:
+        mail_import = MailImport(str(resolve_import_path(request.path)), request.account)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    running = email_service_manager.get_import(mail_import.id)
+    if running and running.is_running():
+        return {"status": "running", "progress": running.progress()}
+    try:
+        email_service_manager.add_import(mail_import)
+        threading.Thread(target=mail_import.run, daemon=True).start()
+        logger.info(f"Started import of {request.path} for {request.account}")
+        return {"status": "started", "progress": mail_import.progress()}
+    except Exception as e:
+        logger.error(f"Error starting import of {request.path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to start import: {e}")
+
+@router.get("/import/{import_id}")
+async def get_mail_import_progress(import_id: str):
+    """Get the progress, throughput and ETA of an import."""
+    mail_import = email_service_manager.get_import(import_id)
+    if not mail_import:
+        raise HTTPException(status_code=404, detail=f"No import {import_id}")
+    return mail_import.progress()
+
+@router.post("/import/{import_id}/stop")
+async def stop_mail_import(import_id: str):
+    """Stop an import; starting it again skips the messages already imported."""
+    mail_import = email_service_manager.get_import(import_id)
+    if not mail_import or not mail_import.is_running():
+        raise HTTPException(status_code=404, detail=f"No running import {import_id}")
+    mail_import.stop()
+    return {"status": "stopping", "progress": mail_import.progress()}
+
 @router.get("/emails/status")
 async def get_email_status():
-    """Get the status of the email ingestion service."""
-    if not email_service:
-        return {"status": "not_initialized"}
-    
-    return {
-        "status": "running",
-        "processed_emails": len(email_service.processed_emails) if hasattr(email_service, 'processed_emails') else 0,
-        "last_checked": datetime.utcnow().isoformat()
-    }
+    """Get the status of the ingestion scheduler, with next run and lag per account, and pipeline metrics."""
+    return email_service_manager.get_status()
+
+@router.post("/accounts/{email}/sync")
+async def sync_account_now(email: str):
+    """Make an account's next sync pass due immediately (subject to its rate budget)."""
+    if not email_service_manager.scheduler.run_now(email):
+        raise HTTPException(status_code=404, detail=f"No ingestion service for {email}")
+    return {"status": "scheduled", "schedule": email_service_manager.get_status(email)}
 
 @router.post("/emails/ingest")
 async def ingest_emails(background_tasks: BackgroundTasks, max_results: int = 10):
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, HTTPException
 from typing import List, Dict, Any, Optional
-from chroma_client import query_chroma, search_similar_documents
+from pydantic import BaseModel, Field
+from chroma_client import query_chroma, query_chroma_batch, search_similar_documents
 from embedding import generate_embeddings
 from ollama_client import get_embedding
+from context_packer import pack_context
 import ollama  # Using the correct Ollama client import
+import json
 from uuid import uuid4
 from PyPDF2 import PdfReader
 
@@ -36,6 +39,72 @@ async def search_documents(query: str, top_k: int = 5):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+MAX_BATCH_QUERIES = 64
+# Results per query; a group's Chroma call fetches the largest top_k of its queries
+MAX_BATCH_TOP_K = 100
+
+class BatchSearchQuery(BaseModel):
+    query: str
+    top_k: Optional[int] = Field(default=None, ge=1, le=MAX_BATCH_TOP_K)
+    where: Optional[Dict[str, Any]] = None  # Chroma metadata filter for this query only
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+    top_k: int = Field(default=5, ge=1, le=MAX_BATCH_TOP_K)
+
+@router.post("/search/batch")
+async def search_documents_batch(request: BatchSearchRequest):
+    """
+    Search for documents similar to several queries in one request.
+
+    All queries are embedded in one batched encode. Queries sharing the same
+    metadata filter (or no filter) are sent to Chroma as a single
+    multi-embedding query.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries are allowed per batch")
+
+    try:
+        embeddings = generate_embeddings([q.query for q in request.queries])
+
+        # Group query positions by filter so each distinct filter costs one Chroma call
+        groups: Dict[str, List[int]] = {}
+        for i, q in enumerate(request.queries):
+            key = json.dumps(q.where, sort_keys=True) if q.where else ""
+            groups.setdefault(key, []).append(i)
+
+        batch_results: List[Dict[str, Any]] = [None] * len(request.queries)
+        for indices in groups.values():
+            where = request.queries[indices[0]].where
+            top_ks = [request.queries[i].top_k or request.top_k for i in indices]
+            results = query_chroma_batch(
+                [embeddings[i] for i in indices],
+                top_k=max(top_ks),
+                where=where
+            )
+
+            for position, (i, top_k) in enumerate(zip(indices, top_ks)):
+                formatted_results = []
+                documents = results.get('documents') or []
+                if position < len(documents):
+                    metadatas = results.get('metadatas') or []
+                    distances = results.get('distances') or []
+                    for j, doc in enumerate(documents[position][:top_k]):
+                        formatted_results.append({
+                            'content': doc,
+                            'metadata': metadatas[position][j] if position < len(metadatas) else {},
+                            'distance': distances[position][j] if position < len(distances) else None
+                        })
+                batch_results[i] = {"query": request.queries[i].query, "results": formatted_results}
+
+        return {"results": batch_results, "count": len(batch_results)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 import os
 from pathlib import Path
 from fastapi import HTTPException
@@ -102,7 +171,7 @@ async def list_documents(limit: int = 10, offset: int = 0):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @router.get("/search-similar")
-async def search_similar(query: str, top_k: int = 3):
+async def search_similar(query: str, top_k: int = 3, max_context_tokens: Optional[int] = None):
     try:
         # Get embedding for the query
         embedding = get_embedding(query)
@@ -116,11 +185,13 @@ async def search_similar(query: str, top_k: int = 3):
         # Format the results
         formatted_results = []
         documents = []
+        scores = []
         for i in range(len(results['documents'][0])):
             doc = results['documents'][0][i]
             documents.append(doc)
             meta = results['metadatas'][0][i] if results.get('metadatas') and results['metadatas'][0] else {}
             score = results['distances'][0][i] if results.get('distances') and results['distances'][0] else None
+            scores.append(score)
 
             formatted_results.append({
                 "content": doc,
@@ -128,8 +199,8 @@ async def search_similar(query: str, top_k: int = 3):
                 "score": score
             })
 
-        # Prepare context for Ollama
-        context = "\n\n".join(documents)
+        # Prepare context for Ollama, trimmed to the token budget
+        context, context_tokens = pack_context(documents, scores, query, max_tokens=max_context_tokens)
         prompt = f"""You are an assistant that extracts specific answers based on files and documents.:
 
         \"\"\"
@@ -149,7 +220,8 @@ Answer this question briefly and clearly: "{query}"
             "status": "success",
             # "query": query,
             # "results": formatted_results,
-            "ollama_answer": response['message']['content']
+            "ollama_answer": response['message']['content'],
+            "context_tokens": context_tokens
         }
 
     except Exception as e:
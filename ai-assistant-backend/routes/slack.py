@@ -2,16 +2,26 @@ import os
 import logging
 import json
 import re
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from fastapi import APIRouter, HTTPException, Request, Depends, Header
 from typing import Dict, Any, Optional, List
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from slack_sdk.signature import SignatureVerifier
 from urllib.parse import parse_qs
+from pathlib import Path
 import requests
 
 from embedding import generate_embeddings
-from chroma_client import add_to_chroma
+from chroma_client import add_many_to_chroma
+from file_parser import SUPPORTED_EXTENSIONS, parse_and_chunk
+from near_duplicates import near_duplicate_index
+from slack_jobs import SlackJobWorker, slack_job_queue
+from ttl_cache import TTLCache
+from downloads import download_service
+from slack_backfill import SlackTeamBackfill, slack_history_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -47,16 +57,26 @@ async def slack_status():
         "teams": list(slack_tokens.keys())
     }
 
+# Processes parsing downloaded documents
+SLACK_PARSE_WORKERS = int(os.getenv("SLACK_PARSE_WORKERS", "2"))
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+# Event ids already queued. Slack redelivers an event (with X-Slack-Retry-Num)
+# up to 3 times over a few minutes when the ack is slow or fails.
+seen_events = TTLCache(max_size=10000, ttl=3600)
+
 # Initialize signature verifier
 signature_verifier = SignatureVerifier(SLACK_SIGNING_SECRET)
 
-def verify_slack_request(request: Request, x_slack_signature: str = Header(None), x_slack_request_timestamp: str = Header(None)):
+async def verify_slack_request(request: Request):
     """Verify that the request is coming from Slack"""
+    x_slack_signature = request.headers.get("X-Slack-Signature")
+    x_slack_request_timestamp = request.headers.get("X-Slack-Request-Timestamp")
     if not x_slack_signature or not x_slack_request_timestamp:
         raise HTTPException(status_code=401, detail="Missing Slack headers")
     
     # Get raw body as bytes
-    body = request.body()
+    body = await request.body()
     
     if not signature_verifier.is_valid(
         body=body,
@@ -115,7 +135,7 @@ async def slack_oauth_callback(code: str):
 async def slack_events(request: Request):
     """Handle Slack events (including URL verification)"""
     # Verify request is from Slack
-    verify_slack_request(request)
+    await verify_slack_request(request)
     
     # Parse the request body
     body = await request.json()
@@ -128,55 +148,150 @@ async def slack_events(request: Request):
     if body.get("type") == "event_callback":
         event = body.get("event", {})
         
-        # Handle message events
+        # Drop redeliveries before any download or embedding work
+        event_id = body.get("event_id")
+        if event_id and not seen_events.add(event_id):
+            logger.info(
+                f"Ignoring duplicate Slack event {event_id} "
+                f"(retry {request.headers.get('X-Slack-Retry-Num', 0)}: {request.headers.get('X-Slack-Retry-Reason', '')})"
+            )
+            return {"status": "ok"}
+        
+        # Handle message events: queue them and ack right away, Slack retries
+        # events not acknowledged within 3 seconds
         if event.get("type") == "message" and not event.get("subtype"):
-            await process_slack_message(event)
+            event.setdefault("team", body.get("team_id"))
+            try:
+                slack_job_queue.enqueue("message", event)
+            except Exception:
+                # Not queued: let Slack's retry through
+                if event_id:
+                    seen_events.delete(event_id)
+                raise
+            slack_worker.notify()
     
     return {"status": "ok"}
 
-async def process_slack_message(event: Dict[str, Any]):
-    """Process a Slack message and extract/save documents"""
-    try:
-        text = event.get("text", "")
-        team_id = event.get("team")
-        channel = event.get("channel")
-        ts = event.get("ts")
-        
-        if not all([team_id, channel, ts]):
-            return
-        
-        # Get the Slack client
-        token = slack_tokens.get(team_id)
+# Running or finished channel history backfills by team ID
+slack_backfills: Dict[str, SlackTeamBackfill] = {}
+
+@router.post("/slack/teams/{team_id}/backfill")
+async def start_slack_backfill(team_id: str):
+    """Index the team's channel history, or catch up from each channel's last indexed message"""
+    token = slack_tokens.get(team_id)
+    if not token:
+        raise HTTPException(status_code=404, detail=f"No token found for team {team_id}")
+    
+    backfill = slack_backfills.get(team_id)
+    if backfill and backfill.is_running():
+        return {"status": "running", "progress": backfill.progress()}
+    
+    backfill = SlackTeamBackfill(team_id, token, slack_history_store)
+    slack_backfills[team_id] = backfill
+    threading.Thread(target=backfill.run, daemon=True).start()
+    logger.info(f"Started Slack history backfill for team {team_id}")
+    return {"status": "started", "progress": backfill.progress()}
+
+@router.get("/slack/teams/{team_id}/backfill")
+async def get_slack_backfill_progress(team_id: str):
+    """Progress of the team's backfill and each channel's checkpoint"""
+    backfill = slack_backfills.get(team_id)
+    return {
+        "progress": backfill.progress() if backfill else None,
+        "channels": slack_history_store.channels(team_id)
+    }
+
+@router.post("/slack/teams/{team_id}/backfill/stop")
+async def stop_slack_backfill(team_id: str):
+    """Stop a running backfill; the next one resumes from the channel checkpoints"""
+    backfill = slack_backfills.get(team_id)
+    if not backfill or not backfill.is_running():
+        raise HTTPException(status_code=404, detail=f"No running backfill for team {team_id}")
+    backfill.stop()
+    return {"status": "stopping", "progress": backfill.progress()}
+
+@router.get("/slack/jobs")
+async def slack_jobs_status():
+    """Job queue counts by status and the most recent dead-lettered jobs"""
+    return {**slack_worker.status(), "dead_letters": slack_job_queue.dead_letters()}
+
+@router.post("/slack/jobs/{job_id}/retry")
+async def retry_slack_job(job_id: int):
+    """Give a dead-lettered job a fresh set of attempts"""
+    if not slack_job_queue.retry_dead(job_id):
+        raise HTTPException(status_code=404, detail=f"No dead-lettered job {job_id}")
+    slack_worker.notify()
+    return {"status": "queued", "job_id": job_id}
+
+async def handle_slack_job(kind: str, payload: Dict[str, Any]):
+    """Run a queued Slack job; raising makes the queue retry it"""
+    if kind == "message":
+        await process_slack_message(payload)
+    elif kind == "link":
+        await process_document(payload["url"], {"source": "slack", "channel": payload["channel"], "ts": payload["ts"]})
+    elif kind == "file":
+        # The token is looked up when the job runs so it is never stored in the queue
+        token = slack_tokens.get(payload["team"])
         if not token:
-            logger.warning(f"No token found for team {team_id}")
-            return
-        
-        client = WebClient(token=token)
-        
-        # Extract links from message
-        links = extract_links(text)
-        
-        # Process each link
-        for link in links:
-            try:
-                # Check if it's a document link
-                if is_document_link(link):
-                    # Download and process the document
-                    await process_document(link, {"source": "slack", "channel": channel, "ts": ts})
-            except Exception as e:
-                logger.error(f"Error processing link {link}: {str(e)}")
-        
-        # Check for file attachments
-        if "files" in event:
-            for file_info in event["files"]:
-                try:
-                    if is_supported_file(file_info["name"]):
-                        await process_slack_file(client, file_info, {"source": "slack", "channel": channel, "ts": ts})
-                except Exception as e:
-                    logger.error(f"Error processing file {file_info.get('name')}: {str(e)}")
+            # Tokens are held in memory: keep the job for retry until the team reconnects
+            raise RuntimeError(f"No token found for team {payload['team']}")
+        await process_slack_file(
+            WebClient(token=token), payload["file"],
+            {"source": "slack", "channel": payload["channel"], "ts": payload["ts"]}
+        )
+    else:
+        raise ValueError(f"Unknown Slack job kind: {kind}")
+
+# Processes queued events with bounded concurrency, retries and dead-lettering
+slack_worker = SlackJobWorker(slack_job_queue, handle_slack_job)
+
+def start_slack_workers():
+    """Start processing queued Slack jobs, including ones interrupted by the last shutdown"""
+    slack_worker.start()
+
+async def stop_slack_workers():
+    """Stop the Slack job workers, letting running jobs finish"""
+    global _parse_pool
+    await slack_worker.stop()
+    await download_service.close()
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False)
+        _parse_pool = None
+
+async def process_slack_message(event: Dict[str, Any]):
+    """Queue the documents linked or attached in a Slack message
     
-    except Exception as e:
-        logger.error(f"Error processing Slack message: {str(e)}")
+    Each document link and supported file becomes its own job, so a failing
+    item is retried alone without downloading and embedding the others again.
+    """
+    text = event.get("text", "")
+    team_id = event.get("team")
+    channel = event.get("channel")
+    ts = event.get("ts")
+    
+    if not all([team_id, channel, ts]):
+        return
+    
+    if not slack_tokens.get(team_id):
+        raise RuntimeError(f"No token found for team {team_id}")
+    
+    jobs = [
+        ("link", {"url": link, "team": team_id, "channel": channel, "ts": ts})
+        for link in extract_links(text)
+        if is_document_link(link)
+    ]
+    for file_info in event.get("files") or []:
+        if is_supported_file(file_info.get("name", "")):
+            # Only the fields process_slack_file reads, to keep job payloads small
+            file_fields = ("name", "filetype", "user", "title", "url_private_download")
+            jobs.append(("file", {
+                "file": {key: file_info[key] for key in file_fields if key in file_info},
+                "team": team_id, "channel": channel, "ts": ts
+            }))
+    
+    if jobs:
+        slack_job_queue.enqueue_many(jobs)
+        logger.info(f"Queued {len(jobs)} documents from Slack message {ts}")
 
 def extract_links(text: str) -> List[str]:
     """Extract all URLs from text"""
@@ -185,59 +300,90 @@ def extract_links(text: str) -> List[str]:
     return re.findall(url_pattern, text)
 
 def is_document_link(url: str) -> bool:
-    """Check if a URL points to a document"""
-    doc_extensions = ['.pdf', '.doc', '.docx', '.txt', '.md', '.csv', '.xls', '.xlsx', '.ppt', '.pptx']
-    return any(url.lower().endswith(ext) for ext in doc_extensions)
+    """Check if a URL points to a document file_parser can read"""
+    return url.lower().split("?")[0].endswith(SUPPORTED_EXTENSIONS)
 
 def is_supported_file(filename: str) -> bool:
-    """Check if a file is supported"""
-    supported_extensions = ['.pdf', '.txt', '.md', '.csv', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']
-    return any(filename.lower().endswith(ext) for ext in supported_extensions)
+    """Check if a file is supported by file_parser"""
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
 
-async def process_document(url: str, metadata: Dict[str, Any]):
-    """Download and process a document from a URL"""
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Worker processes parsing downloaded documents (PDF text extraction is CPU bound)"""
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=SLACK_PARSE_WORKERS)
+    return _parse_pool
+
+async def process_document(url: str, metadata: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+    """Download and process a document from a URL
+    
+    Links already processed are requested conditionally, and unchanged ones
+    are not parsed or embedded again. Parsing and chunking run in a worker
+    process so the event loop keeps serving requests.
+    """
+    download = None
     try:
-        # Download the file
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        # Get the filename from the URL or use a default
-        filename = url.split("/")[-1].split("?")[0] or "document"
-        
-        # Save the file temporarily
-        temp_path = f"/tmp/{filename}"
-        with open(temp_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        # Get the filename from the metadata or the URL, or use a default
+        filename = metadata.get("filename") or url.split("/")[-1].split("?")[0] or "document"
         
-        # Process the file (you'll need to implement this based on your file processing logic)
-        # This is a placeholder - you'll need to implement the actual processing
-        content = process_file(temp_path)
+        # Download the file to a unique temporary file
+        download = await download_service.download(url, headers=headers, suffix=Path(filename).suffix)
+        if download.not_modified:
+            logger.info(f"Skipping {url}: unchanged since it was last processed")
+            return
         
-        # Generate embeddings
-        embeddings = generate_embeddings([content])
+        # Parse and chunk with the same file_parser pipeline as uploads
+        chunks = await asyncio.get_running_loop().run_in_executor(
+            _get_parse_pool(), parse_and_chunk, download.path
+        )
+        if not chunks:
+            logger.info(f"No text extracted from {url}")
+            download_service.record(download)
+            return
         
-        # Store in ChromaDB
-        doc_id = f"slack_{metadata.get('channel')}_{metadata.get('ts')}"
-        add_to_chroma(
-            doc_id=doc_id,
-            document=content,
-            metadata={
+        base_id = f"slack_{metadata.get('channel')}_{metadata.get('ts')}_{download.content_hash[:16]}"
+        doc_ids = [f"{base_id}_{i}" for i in range(len(chunks))]
+        metadatas = [
+            {
+                **{key: value for key, value in metadata.items() if value is not None},
                 "source": "slack",
                 "url": url,
                 "filename": filename,
-                "channel": metadata.get("channel"),
-                "timestamp": metadata.get("ts"),
-                **metadata
-            },
-            embedding=embeddings[0] if embeddings else None
+                "channel": metadata.get("channel", ""),
+                "timestamp": metadata.get("ts", ""),
+                "content_hash": download.content_hash,
+                # Fingerprints are kept per document, not per chunk
+                "near_dup_id": base_id,
+                "chunk_index": i,
+                "chunk_count": len(chunks)
+            }
+            for i in range(len(chunks))
+        ]
+        
+        # Link re-shared documents to the stored copy instead of embedding them again
+        canonical_id = near_duplicate_index.check(
+            base_id, "\n".join(chunks), "slack",
+            entry={"ids": doc_ids, "documents": chunks, "metadatas": metadatas}
         )
+        if canonical_id:
+            logger.info(f"Skipping {url}: near-duplicate of {canonical_id}")
+            download_service.record(download)
+            return
+        
+        # Embed all chunks in one batch and store them in one upsert
+        embeddings = await asyncio.get_running_loop().run_in_executor(None, generate_embeddings, chunks)
+        add_many_to_chroma(doc_ids, chunks, metadatas, embeddings)
+        near_duplicate_index.register(base_id, "\n".join(chunks), "slack")
+        download_service.record(download)
         
-        logger.info(f"Processed document from {url}")
+        logger.info(f"Processed document from {url} ({len(chunks)} chunks)")
         
     except Exception as e:
         logger.error(f"Error processing document {url}: {str(e)}")
         raise
+    finally:
+        if download:
+            download.cleanup()
 
 async def process_slack_file(client: WebClient, file_info: Dict[str, Any], metadata: Dict[str, Any]):
     """Process a file shared in Slack"""
@@ -248,34 +394,18 @@ async def process_slack_file(client: WebClient, file_info: Dict[str, Any], metad
             logger.warning("No download URL available for file")
             return
         
-        # Download the file
-        response = client.files_getTemporaryUploadURLExternal(file=file_info["id"])
-        if not response.get("ok"):
-            logger.warning(f"Failed to get file download URL: {response.get('error', 'Unknown error')}")
-            return
-        
-        # Process the file
-        await process_document(response["url"], {
+        # Private file URLs are downloaded with the team's bot token
+        await process_document(file_url, {
             **metadata,
             "filename": file_info.get("name", "file"),
             "filetype": file_info.get("filetype", ""),
             "user": file_info.get("user", ""),
             "title": file_info.get("title", "")
-        })
+        }, headers={"Authorization": f"Bearer {client.token}"})
     
     except SlackApiError as e:
         logger.error(f"Slack API error: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"Error processing Slack file: {str(e)}")
-
-def process_file(file_path: str) -> str:
-    """Process a file and return its content as text"""
-    # This is a placeholder - implement based on your file processing needs
-    # You might want to use libraries like PyPDF2, python-docx, etc.
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    except UnicodeDecodeError:
-        # Handle binary files
-        with open(file_path, 'rb') as f:
-            return f.read().decode('utf-8', errors='ignore')
+        raise
@@ -4,6 +4,7 @@ from utils import save_uploaded_file
 from file_parser import parse_file
 from embedding import generate_embeddings
 from chroma_client import add_to_chroma
+from near_duplicates import near_duplicate_index
 import logging
 import os
 from uuid import uuid4
@@ -40,21 +41,39 @@ async def upload_file(file: UploadFile = File(...)):
         # Step 2: Parse file contents
         documents = parse_file(file_path)
 
-        # Step 3: Generate embeddings
-        embeddings = generate_embeddings(documents)
+        # Step 3: Skip pages nearly identical to something already stored
+        pages = []
+        duplicates = {}
+        for i, doc in enumerate(documents):
+            doc_id = f"{file.filename}_{i}"
+            # The page is kept with the link, so deleting its canonical document restores it
+            entry = {"ids": [doc_id], "documents": [doc], "metadatas": [{"source": file.filename, "doc_index": i}]}
+            canonical_id = near_duplicate_index.check(doc_id, doc, "upload", entry=entry)
+            if canonical_id:
+                duplicates[doc_id] = canonical_id
+            else:
+                pages.append((i, doc_id, doc))
+
+        # Step 4: Generate embeddings
+        embeddings = generate_embeddings([doc for _, _, doc in pages]) if pages else []
 
-        # Step 4: Store in ChromaDB
+        # Step 5: Store in ChromaDB
         # For each document, store with its corresponding embedding
-        for i, (doc, embedding) in enumerate(zip(documents, embeddings)):
-            doc_id = f"{file.filename}_{i}"
+        for (i, doc_id, doc), embedding in zip(pages, embeddings):
             add_to_chroma(
                 doc_id=doc_id,
                 content=doc,
                 metadata={"source": file.filename, "doc_index": i},
                 embedding=embedding
             )
+            near_duplicate_index.register(doc_id, doc, "upload")
 
-        return {"status": "success", "message": f"{file.filename} processed"}
+        return {
+            "status": "success",
+            "message": f"{file.filename} processed",
+            "stored": len(pages),
+            "duplicates": duplicates
+        }
     
     except HTTPException as he:
         # Re-raise HTTP exceptions directly
@@ -0,0 +1,356 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from chroma_client import add_many_to_chroma
+from embedding import generate_embeddings
+from file_parser import chunk_text
+
+logger = logging.getLogger(__name__)
+
+SLACK_BACKFILL_DB_PATH = "./slack_backfill.db"
+
+# Messages of a channel are grouped into one document per window
+SLACK_WINDOW_SECONDS = int(os.getenv("SLACK_WINDOW_SECONDS", "3600"))
+
+# Messages per conversations.history / conversations.replies page (Slack allows up to 1000)
+SLACK_HISTORY_PAGE_SIZE = 200
+
+# Calls per minute by Slack rate-limit tier. History and replies are Tier 3
+# for Marketplace apps; lower SLACK_HISTORY_RATE for apps on reduced limits.
+SLACK_TIER_RATES = {
+    "conversations.list": 20,  # Tier 2
+    "conversations.history": int(os.getenv("SLACK_HISTORY_RATE", "50")),  # Tier 3
+    "conversations.replies": int(os.getenv("SLACK_HISTORY_RATE", "50")),  # Tier 3
+}
+
+# Give up on a call after this many 429 responses in a row
+MAX_RATE_LIMIT_RETRIES = 5
+
+
+class SlackHistoryStore:
+    """
+    SQLite record of backfilled Slack messages and per-channel checkpoints.
+
+    Messages are kept so a time-window document can be rebuilt whole when
+    messages for it arrive on a later page or a later catch-up run.
+    ``channels`` holds, per channel, the highest ``ts`` indexed by a
+    completed run (``latest_ts``) and the cursor and bounds of the run in
+    progress, so an interrupted run resumes from its last page.
+    """
+
+    def __init__(self, path: str = SLACK_BACKFILL_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS channels (
+                    team_id TEXT NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    name TEXT,
+                    latest_ts TEXT,
+                    run_oldest TEXT,
+                    run_latest TEXT,
+                    cursor TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (team_id, channel_id)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    channel_id TEXT NOT NULL,
+                    ts TEXT NOT NULL,
+                    window INTEGER NOT NULL,
+                    thread_ts TEXT,
+                    user TEXT,
+                    text TEXT,
+                    PRIMARY KEY (channel_id, ts)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_window ON messages(channel_id, window)")
+
+    def channel(self, team_id: str, channel_id: str, name: str) -> Dict[str, Any]:
+        """Get a channel's checkpoint, creating it on first sight."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO channels (team_id, channel_id, name, updated_at) VALUES (?, ?, ?, ?)",
+                (team_id, channel_id, name, time.time())
+            )
+            row = self._conn.execute(
+                "SELECT * FROM channels WHERE team_id = ? AND channel_id = ?", (team_id, channel_id)
+            ).fetchone()
+        return dict(row)
+
+    def save_channel(self, state: Dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE channels SET latest_ts = ?, run_oldest = ?, run_latest = ?, cursor = ?, updated_at = ? "
+                "WHERE team_id = ? AND channel_id = ?",
+                (state['latest_ts'], state['run_oldest'], state['run_latest'], state['cursor'], time.time(),
+                 state['team_id'], state['channel_id'])
+            )
+
+    def channels(self, team_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM channels WHERE team_id = ?", (team_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_messages(self, channel_id: str, messages: Iterable[Tuple]) -> None:
+        """Insert or replace (ts, window, thread_ts, user, text) rows."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                [(channel_id, *message) for message in messages]
+            )
+
+    def window_messages(self, channel_id: str, window: int) -> List[Dict[str, Any]]:
+        """A window's messages, threads kept together under their parent."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM messages WHERE channel_id = ? AND window = ? "
+                "ORDER BY COALESCE(thread_ts, ts), ts",
+                (channel_id, window)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class SlackTeamBackfill:
+    """
+    Index the message history of every channel a Slack team's bot is in.
+
+    Each channel is paged through ``conversations.history`` (and
+    ``conversations.replies`` for threads) at its rate-limit tier, honouring
+    Retry-After on 429s. Messages are grouped into per-channel time-window
+    documents, and the windows touched by each page are rebuilt, batch
+    embedded and bulk-upserted. The cursor is checkpointed after every page.
+    Later runs only fetch messages newer than the last ``ts`` indexed per
+    channel; replies posted since to older threads are not picked up.
+    """
+
+    def __init__(
+        self,
+        team_id: str,
+        token: str,
+        store: SlackHistoryStore,
+        window_seconds: int = SLACK_WINDOW_SECONDS
+    ):
+        self.team_id = team_id
+        self.client = WebClient(token=token)
+        self.store = store
+        self.window_seconds = window_seconds
+        self._last_call: Dict[str, float] = {}
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.state = {
+            'team_id': team_id,
+            'status': 'pending',
+            'channels_total': None,
+            'channels_done': 0,
+            'current_channel': None,
+            'messages': 0,
+            'documents': 0,
+            'rate_limited_seconds': 0.0,
+            'error': None,
+            'started_at': None,
+            'finished_at': None
+        }
+
+    def progress(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.state)
+
+    def stop(self) -> None:
+        """Stop after the current page; channel checkpoints are kept for resuming."""
+        self._stop_event.set()
+
+    def is_running(self) -> bool:
+        return self.state['status'] == 'running'
+
+    def _count(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self.state[key] += amount
+
+    def _call(self, method: str, **kwargs) -> Dict[str, Any]:
+        """Call a Web API method, spacing calls by its tier and retrying 429s after Retry-After."""
+        interval = 60.0 / SLACK_TIER_RATES.get(method, 20)
+        for _ in range(MAX_RATE_LIMIT_RETRIES):
+            wait = self._last_call.get(method, 0) + interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_call[method] = time.monotonic()
+            try:
+                params = {key: value for key, value in kwargs.items() if value is not None}
+                return self.client.api_call(method, http_verb="GET", params=params).data
+            except SlackApiError as e:
+                if e.response.status_code != 429:
+                    raise
+                headers = e.response.headers or {}
+                retry_after = int(headers.get('Retry-After') or headers.get('retry-after') or 30)
+                logger.warning(f"[{self.team_id}] Rate limited on {method}, retrying in {retry_after}s")
+                self._count('rate_limited_seconds', retry_after)
+                time.sleep(retry_after)
+        raise RuntimeError(f"{method} still rate limited after {MAX_RATE_LIMIT_RETRIES} retries")
+
+    def _member_channels(self) -> List[Dict[str, Any]]:
+        channels = []
+        cursor = None
+        while True:
+            response = self._call(
+                "conversations.list",
+                types="public_channel,private_channel",
+                exclude_archived="true",
+                limit=SLACK_HISTORY_PAGE_SIZE,
+                cursor=cursor
+            )
+            channels.extend(c for c in response.get('channels', []) if c.get('is_member'))
+            cursor = response.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                return channels
+
+    def _thread_replies(self, channel_id: str, thread_ts: str) -> List[Dict[str, Any]]:
+        replies = []
+        cursor = None
+        while True:
+            response = self._call(
+                "conversations.replies", channel=channel_id, ts=thread_ts,
+                limit=SLACK_HISTORY_PAGE_SIZE, cursor=cursor
+            )
+            # The parent message comes back first on every page
+            replies.extend(m for m in response.get('messages', []) if m.get('ts') != thread_ts)
+            cursor = response.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                return replies
+
+    def _window(self, ts: str) -> int:
+        return int(float(ts)) // self.window_seconds * self.window_seconds
+
+    def _index_windows(self, channel: Dict[str, Any], windows: Iterable[int]) -> int:
+        """Rebuild, embed and upsert the documents of the given windows."""
+        doc_ids, contents, metadatas = [], [], []
+        for window in sorted(windows):
+            lines = [
+                f"[{datetime.utcfromtimestamp(float(m['ts'])).strftime('%H:%M')}] "
+                f"{'(thread) ' if m['thread_ts'] and m['thread_ts'] != m['ts'] else ''}{m['user'] or 'unknown'}: {m['text']}"
+                for m in self.store.window_messages(channel['id'], window)
+                if m['text']
+            ]
+            if not lines:
+                continue
+            header = f"Slack #{channel.get('name', channel['id'])}, {datetime.utcfromtimestamp(window).strftime('%Y-%m-%d %H:%M')} UTC"
+            chunks = chunk_text("\n".join(lines))
+            for i, chunk in enumerate(chunks):
+                doc_ids.append(f"slack_history_{channel['id']}_{window}_{i}")
+                contents.append(f"{header}\n{chunk}")
+                metadatas.append({
+                    'source': 'slack',
+                    'type': 'slack_history',
+                    'team_id': self.team_id,
+                    'channel': channel['id'],
+                    'channel_name': channel.get('name', ''),
+                    'window_start': window,
+                    'window_seconds': self.window_seconds,
+                    'message_count': len(lines),
+                    'chunk_index': i,
+                    'chunk_count': len(chunks),
+                })
+        if doc_ids:
+            add_many_to_chroma(doc_ids, contents, metadatas, generate_embeddings(contents))
+        return len(doc_ids)
+
+    def _backfill_channel(self, channel: Dict[str, Any]) -> None:
+        state = self.store.channel(self.team_id, channel['id'], channel.get('name', ''))
+        if not state['cursor']:
+            # New run: everything after the last indexed message (all history the first time)
+            state['run_oldest'] = state['latest_ts']
+            state['run_latest'] = state['latest_ts']
+
+        while not self._stop_event.is_set():
+            try:
+                response = self._call(
+                    "conversations.history", channel=channel['id'], oldest=state['run_oldest'] or "0",
+                    limit=SLACK_HISTORY_PAGE_SIZE, cursor=state['cursor']
+                )
+            except SlackApiError as e:
+                if e.response.get('error') != 'invalid_cursor' or not state['cursor']:
+                    raise
+                # Expired checkpoint: restart the run; upserts are idempotent
+                logger.warning(f"[{self.team_id}] Cursor expired for #{channel.get('name')}, restarting run")
+                state['cursor'] = None
+                continue
+
+            messages = [m for m in response.get('messages', []) if m.get('type') == 'message']
+            for message in list(messages):
+                if message.get('reply_count'):
+                    messages.extend(self._thread_replies(channel['id'], message['ts']))
+
+            rows = []
+            for m in messages:
+                # Replies are grouped in their parent's window
+                window = self._window(m.get('thread_ts') or m['ts'])
+                rows.append((m['ts'], window, m.get('thread_ts'), m.get('user') or m.get('bot_id'), m.get('text', '')))
+            self.store.add_messages(channel['id'], rows)
+            documents = self._index_windows(channel, {row[1] for row in rows})
+
+            top_ts = max((m['ts'] for m in messages if not m.get('thread_ts') or m['thread_ts'] == m['ts']),
+                         key=float, default=None)
+            if top_ts and (not state['run_latest'] or float(top_ts) > float(state['run_latest'])):
+                state['run_latest'] = top_ts
+            state['cursor'] = response.get('response_metadata', {}).get('next_cursor') or None
+            if not state['cursor']:
+                # Run complete: the next one only fetches newer messages
+                state['latest_ts'] = state['run_latest']
+            self.store.save_channel(state)
+
+            self._count('messages', len(messages))
+            self._count('documents', documents)
+            if not state['cursor']:
+                return
+
+    def run(self) -> Dict[str, Any]:
+        """Backfill (or catch up) every channel the bot is a member of."""
+        self._stop_event.clear()
+        with self._lock:
+            self.state['status'] = 'running'
+            self.state['error'] = None
+            self.state['started_at'] = datetime.utcnow().isoformat()
+
+        try:
+            channels = self._member_channels()
+            with self._lock:
+                self.state['channels_total'] = len(channels)
+            for channel in channels:
+                if self._stop_event.is_set():
+                    break
+                with self._lock:
+                    self.state['current_channel'] = channel.get('name', channel['id'])
+                self._backfill_channel(channel)
+                if not self._stop_event.is_set():
+                    self._count('channels_done')
+                logger.info(f"[{self.team_id}] Slack backfill progress: {self.progress()}")
+
+            with self._lock:
+                self.state['status'] = 'stopped' if self._stop_event.is_set() else 'completed'
+                self.state['current_channel'] = None
+        except Exception as e:
+            logger.error(f"[{self.team_id}] Slack backfill failed: {e}")
+            with self._lock:
+                self.state['status'] = 'failed'
+                self.state['error'] = str(e)
+        finally:
+            with self._lock:
+                self.state['finished_at'] = datetime.utcnow().isoformat()
+        return self.progress()
+
+
+# Shared message and checkpoint store for every team's backfill
+slack_history_store = SlackHistoryStore()
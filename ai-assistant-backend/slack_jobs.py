@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLACK_JOBS_DB_PATH = "./slack_jobs.db"
+
+# Jobs processed at once
+SLACK_JOB_WORKERS = int(os.getenv("SLACK_JOB_WORKERS", "4"))
+
+# Attempts before a job is moved to the dead-letter state
+SLACK_JOB_MAX_ATTEMPTS = int(os.getenv("SLACK_JOB_MAX_ATTEMPTS", "5"))
+
+# Retry backoff: RETRY_BASE * 2^(attempt - 1) seconds, capped
+RETRY_BASE = 30
+RETRY_MAX = 3600
+
+# Seconds between polls for jobs whose retry time has come
+POLL_INTERVAL = 1.0
+
+# Seconds running jobs get to finish on shutdown before being cancelled
+SHUTDOWN_GRACE = 10
+
+
+class SlackJobQueue:
+    """
+    Durable SQLite queue of Slack work (event processing, downloads).
+
+    Jobs go from ``pending`` to ``running`` when claimed and are deleted
+    once done. Failed jobs are retried with exponential backoff and moved to
+    ``dead`` after SLACK_JOB_MAX_ATTEMPTS; jobs left ``running`` by a crash
+    are made pending again on startup.
+    """
+
+    def __init__(self, path: str = SLACK_JOBS_DB_PATH, max_attempts: int = SLACK_JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_run_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL,
+                    updated_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(status, next_run_at)")
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> int:
+        """Persist a job; returns its id."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, payload, status, next_run_at, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?)",
+                (kind, json.dumps(payload), now, now, now)
+            )
+            return cursor.lastrowid
+
+    def enqueue_many(self, jobs: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Persist several (kind, payload) jobs in one transaction, so all or none are queued."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO jobs (kind, payload, status, next_run_at, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?)",
+                [(kind, json.dumps(payload), now, now, now) for kind, payload in jobs]
+            )
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Mark up to ``limit`` due jobs as running and return them, oldest first."""
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND next_run_at <= ? "
+                "ORDER BY next_run_at, id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(now, row['id']) for row in rows]
+            )
+        return [
+            {**dict(row), 'payload': json.loads(row['payload']), 'attempts': row['attempts'] + 1}
+            for row in rows
+        ]
+
+    def complete(self, job_id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def fail(self, job: Dict[str, Any], error: str) -> bool:
+        """
+        Record a failed attempt, scheduling a retry or dead-lettering the job.
+
+        Returns:
+            True if the job will be retried
+        """
+        now = time.time()
+        retry = job['attempts'] < self.max_attempts
+        delay = min(RETRY_BASE * 2 ** (job['attempts'] - 1), RETRY_MAX)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, next_run_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                ('pending' if retry else 'dead', now + delay, error, now, job['id'])
+            )
+        return retry
+
+    def requeue_running(self) -> int:
+        """Make jobs interrupted by a crash or shutdown pending again."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'pending', next_run_at = ? WHERE status = 'running'", (time.time(),)
+            )
+            return cursor.rowcount
+
+    def retry_dead(self, job_id: int) -> bool:
+        """Give a dead-lettered job a fresh set of attempts."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, next_run_at = ? WHERE id = ? AND status = 'dead'",
+                (time.time(), job_id)
+            )
+            return cursor.rowcount > 0
+
+    def dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, attempts, last_error, created_at, updated_at FROM jobs "
+                "WHERE status = 'dead' ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class SlackJobWorker:
+    """
+    Asyncio consumer of a SlackJobQueue with bounded concurrency.
+
+    A dispatcher task claims due jobs while fewer than ``concurrency`` are
+    running and runs each through ``handler(kind, payload)``; ``notify``
+    wakes it as soon as a job is enqueued.
+    """
+
+    def __init__(
+        self,
+        queue: SlackJobQueue,
+        handler: Callable[[str, Dict[str, Any]], Awaitable[None]],
+        concurrency: int = SLACK_JOB_WORKERS
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        """Start the dispatcher on the running event loop, resuming interrupted jobs."""
+        if self._dispatcher and not self._dispatcher.done():
+            return
+        requeued = self.queue.requeue_running()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted Slack jobs")
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def notify(self) -> None:
+        """Wake the dispatcher after enqueueing a job."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self) -> None:
+        """Stop claiming jobs and give running ones SHUTDOWN_GRACE seconds to finish."""
+        self._stopping = True
+        self.notify()
+        if self._dispatcher:
+            await self._dispatcher
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=SHUTDOWN_GRACE)
+            for task in pending:
+                # Left 'running' in the queue; picked up again on the next start
+                task.cancel()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'running': len(self._tasks),
+            'concurrency': self.concurrency,
+            'jobs': self.queue.counts()
+        }
+
+    async def _dispatch(self) -> None:
+        while not self._stopping:
+            self._wake.clear()
+            free = self.concurrency - len(self._tasks)
+            jobs = self.queue.claim(free) if free > 0 else []
+            for job in jobs:
+                task = asyncio.create_task(self._execute(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            if jobs and len(jobs) == free:
+                # Every slot is taken: wait for one to free up
+                await self._wake.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        try:
+            await self.handler(job['kind'], job['payload'])
+            self.queue.complete(job['id'])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.queue.fail(job, str(e)):
+                logger.warning(f"Slack job {job['id']} ({job['kind']}) failed, attempt {job['attempts']}: {e}")
+            else:
+                logger.error(f"Slack job {job['id']} ({job['kind']}) dead-lettered after {job['attempts']} attempts: {e}")
+        finally:
+            # Free the slot before waking the dispatcher
+            self._tasks.discard(asyncio.current_task())
+            self.notify()
+
+
+# Shared queue the Slack events endpoint enqueues to
+slack_job_queue = SlackJobQueue()
@@ -0,0 +1,39 @@
+from context_packer import count_tokens, pack_context
+
+
+def test_documents_within_budget_are_packed_whole():
+    context, tokens = pack_context(["First document.", "Second document."], max_tokens=100)
+    assert context == "First document.\n\nSecond document."
+    assert tokens == count_tokens(context)
+
+
+def test_closest_documents_are_packed_first():
+    context, _ = pack_context(["far", "near"], distances=[0.9, 0.1], max_tokens=100)
+    assert context == "near\n\nfar"
+
+
+def test_packed_context_stays_within_budget():
+    documents = [" ".join(f"word{i}{j}" for j in range(50)) for i in range(10)]
+    for budget in (5, 40, 120, 500):
+        context, tokens = pack_context(documents, max_tokens=budget)
+        assert tokens <= budget
+        assert count_tokens(context) <= budget
+
+
+def test_oversized_document_keeps_sentences_matching_the_query():
+    doc = (
+        "The office moved last spring. "
+        "Parking is available behind the building. "
+        "The invoice total was 420 dollars. "
+        "Lunch is served at noon."
+    )
+    budget = count_tokens("The invoice total was 420 dollars.") + 2
+    context, tokens = pack_context([doc], query="what was the invoice total", max_tokens=budget)
+    assert "invoice total" in context
+    assert "Parking" not in context
+    assert tokens <= budget
+
+
+def test_empty_documents_and_zero_budget():
+    assert pack_context(["", "   "], max_tokens=100) == ("", 0)
+    assert pack_context(["Some text."], max_tokens=0) == ("", 0)
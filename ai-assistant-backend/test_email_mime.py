@@ -0,0 +1,60 @@
+from email_mime import clean_body, html_to_text
+
+
+def test_quoted_reply_chain_is_dropped():
+    body = "Sounds good, see you then.\n\nOn Mon, 3 Jun 2024 at 10:00, Bob <bob@example.com> wrote:\n> Lunch at noon?\n> Bob"
+    assert clean_body(body) == "Sounds good, see you then."
+
+
+def test_outlook_reply_header_is_dropped():
+    body = "Approved.\nFrom: Alice\nSent: Monday\nTo: Bob\nPlease approve the budget."
+    assert clean_body(body) == "Approved."
+
+
+def test_inline_reply_keeps_answers():
+    body = "Answers below.\nOn Mon, Bob wrote:\n> Can you make Friday?\nYes, after 2pm.\n> Room?\nThe big one."
+    assert clean_body(body) == "Answers below.\nYes, after 2pm.\nThe big one."
+
+
+def test_quoted_lines_without_reply_header_are_content():
+    body = "The error is:\n> KeyError: 'id'\nAny idea?"
+    assert clean_body(body) == body
+
+
+def test_signature_is_dropped():
+    assert clean_body("See attached.\n--\nAlice\nACME Inc") == "See attached."
+    assert clean_body("On my way\nSent from my iPhone") == "On my way"
+
+
+def test_unsubscribe_question_is_kept():
+    body = "Hi,\nHow do I unsubscribe user X from the plan?\nThanks"
+    assert clean_body(body) == body
+
+
+def test_footer_notices_are_dropped():
+    body = (
+        "This week's release notes.\n\n"
+        "ACME Inc, 1 Main Street\n"
+        "You are receiving this email because you signed up.\n"
+        "Unsubscribe | Update your preferences"
+    )
+    assert clean_body(body) == "This week's release notes.\n\nACME Inc, 1 Main Street"
+
+
+def test_tracking_links_are_dropped_but_other_links_kept():
+    body = "Read more:\nhttps://click.example.com/abc123\nhttps://docs.example.com/guide"
+    assert clean_body(body) == "Read more:\nhttps://docs.example.com/guide"
+
+
+def test_first_line_is_never_a_reply_header():
+    body = "---------- Forwarded message ---------\nThe original text"
+    assert clean_body(body) == body
+
+
+def test_body_is_never_cleaned_to_nothing():
+    assert clean_body("https://click.example.com/abc") == "https://click.example.com/abc"
+
+
+def test_html_to_text_keeps_blocks_and_skips_scripts():
+    html = "<html><head><title>x</title><style>p{}</style></head><body><p>Hello&nbsp;there</p><div>Bye</div></body></html>"
+    assert html_to_text(html) == "Hello there\nBye"
@@ -0,0 +1,87 @@
+import random
+
+import near_duplicates
+from near_duplicates import MAX_RECALL_DISTANCE, NearDuplicateIndex, simhash
+
+WORDS = (
+    "the quarterly report covers revenue growth across all regions and highlights "
+    "several risks that the board should review before the next planning cycle "
+    "including supply chain delays currency movements and hiring plans for the "
+    "engineering and sales teams in europe and asia during the coming year"
+).split()
+
+
+def _text(seed: int, changed: int = 0) -> str:
+    words = list(WORDS)
+    for i in range(changed):
+        words[(seed + i * 7) % len(words)] = f"changed{seed}x{i}"
+    return " ".join(words)
+
+
+def _flip(fingerprint: int, bits) -> int:
+    for bit in bits:
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def test_simhash_skips_short_texts():
+    assert simhash("too short to fingerprint") is None
+
+
+def test_simhash_is_stable_and_close_for_small_edits():
+    a = simhash(_text(0))
+    assert a == simhash(_text(0))
+    assert bin(a ^ simhash(_text(0, changed=1))).count("1") < bin(a ^ simhash(" ".join(reversed(WORDS)))).count("1")
+
+
+def test_banding_finds_every_fingerprint_within_max_recall_distance(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "nd.db"), max_distance=MAX_RECALL_DISTANCE)
+    rng = random.Random(42)
+    for n in range(200):
+        fingerprint = rng.getrandbits(64)
+        distance = rng.randint(0, MAX_RECALL_DISTANCE)
+        query = _flip(fingerprint, rng.sample(range(64), distance))
+        with index._lock, index._conn:
+            index._register(f"doc{n}", fingerprint, "upload", "")
+            match = index._find(f"new{n}", query, "upload", "")
+        assert match is not None
+        assert match[1] <= distance
+
+
+def test_fingerprints_beyond_max_distance_are_not_matched(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "nd.db"), max_distance=2)
+    fingerprint = random.Random(1).getrandbits(64)
+    with index._lock, index._conn:
+        index._register("doc", fingerprint, "upload", "")
+        # 3 bits in one band: the other bands still agree, but it is too far
+        assert index._find("new", _flip(fingerprint, [0, 1, 2]), "upload", "") is None
+        assert index._find("new", _flip(fingerprint, [0, 1]), "upload", "") == ("doc", 2)
+
+
+def test_max_distance_is_clamped_to_recall_distance(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "nd.db"), max_distance=10)
+    assert index.max_distance == MAX_RECALL_DISTANCE
+
+
+def test_check_links_within_source_and_account_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(near_duplicates, "NEAR_DUP_ENABLED", True)
+    index = NearDuplicateIndex(str(tmp_path / "nd.db"))
+    index.register("email_1", _text(0), "gmail", "a@example.com")
+
+    assert index.check("upload_1", _text(0), "upload") is None
+    assert index.check("email_2", _text(0), "gmail", "b@example.com") is None
+    assert index.check("email_3", _text(0), "gmail", "a@example.com") == "email_1"
+    assert index.canonical_of("email_3") == "email_1"
+
+
+def test_removing_canonical_returns_orphaned_duplicates(tmp_path, monkeypatch):
+    monkeypatch.setattr(near_duplicates, "NEAR_DUP_ENABLED", True)
+    index = NearDuplicateIndex(str(tmp_path / "nd.db"))
+    index.register("upload_1", _text(0), "upload")
+    entry = {"ids": ["upload_2"], "documents": [_text(0)], "metadatas": [{"source": "upload"}]}
+    assert index.check("upload_2", _text(0), "upload", entry=entry) == "upload_1"
+
+    orphans = index.remove(["upload_1"])
+    assert [o["doc_id"] for o in orphans] == ["upload_2"]
+    assert orphans[0]["entry"] == entry
+    assert index.duplicates_of("upload_1") == []
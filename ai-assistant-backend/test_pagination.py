@@ -0,0 +1,23 @@
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("position", [{"after": [1717000000000, "email_abc"]}, {"offset": 40}, ["k", "id"], 0])
+def test_cursor_round_trip(position):
+    cursor = encode_cursor(position)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == position
+
+
+def test_missing_cursor_decodes_to_none():
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGpzb24", "é"])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor)
+    assert exc.value.status_code == 400
@@ -0,0 +1,62 @@
+import processed_store
+from processed_store import BloomFilter, ProcessedIdStore
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000)
+    items = [f"msg-{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    assert bloom.is_full()
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"msg-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_membership_before_and_after_flush(tmp_path):
+    store = ProcessedIdStore(tmp_path / "a.db")
+    store.add("m1")
+    assert "m1" in store
+    assert "m2" not in store
+    store.flush()
+    assert "m1" in store
+    assert len(store) == 1
+    store.close()
+
+
+def test_add_many_flushes_at_flush_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(processed_store, "PROCESSED_FLUSH_SIZE", 3)
+    store = ProcessedIdStore(tmp_path / "a.db")
+    store.add_many(["m1", "m2", "m3"])
+    # Written in one transaction, nothing left pending
+    assert store._pending == set()
+    assert store._conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0] == 3
+    store.close()
+
+
+def test_ids_survive_reopen(tmp_path):
+    store = ProcessedIdStore(tmp_path / "a.db")
+    store.add_many(["m1", "m2"])
+    store.close()
+
+    reopened = ProcessedIdStore(tmp_path / "a.db")
+    assert "m1" in reopened and "m2" in reopened
+    assert "m3" not in reopened
+    assert len(reopened) == 2
+    reopened.close()
+
+
+def test_legacy_json_is_imported_once(tmp_path):
+    legacy = tmp_path / "a_processed.json"
+    legacy.write_text('{"processed_emails": ["m1", "m2"]}')
+    store = ProcessedIdStore(tmp_path / "a.db", legacy_json=legacy)
+    assert "m1" in store and "m2" in store
+    assert not legacy.exists()
+    assert (tmp_path / "a_processed.json.migrated").exists()
+    store.close()
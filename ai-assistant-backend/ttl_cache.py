@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Small thread-safe in-memory cache with per-entry expiry and a size bound.
+
+    Entries expire ``ttl`` seconds after they were set; when more than
+    ``max_size`` entries are stored the least recently set ones are evicted.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now: float) -> None:
+        # Entries are kept in insertion order, so expired ones are at the front
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[key]
+
+    def _store(self, key: Hashable, value: Any, now: float) -> None:
+        # Caller holds the lock
+        self._data.pop(key, None)
+        self._data[key] = (now + self.ttl, value)
+        self._evict_expired(now)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, replacing any existing entry for the key."""
+        with self._lock:
+            self._store(key, value, time.monotonic())
+
+    def add(self, key: Hashable, value: Any = True) -> bool:
+        """
+        Store a value only if the key is missing or expired.
+
+        Returns:
+            True if the value was stored, False if a live entry already existed
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                return False
+            self._store(key, value, now)
+            return True
+
+    def delete(self, key: Hashable) -> None:
+        """Remove an entry if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Return the value for a key, or ``default`` if it is missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                return default
+            return entry[1]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return len(self._data)
+